@@ -0,0 +1,77 @@
+"""Note 全文索引（FTS5）
+
+Revision ID: 385e1895e89a
+Revises: 096e13d313fd
+Create Date: 2026-10-16 10:12:31.402817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '385e1895e89a'
+down_revision: Union[str, Sequence[str], None] = '096e13d313fd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def fts5_available() -> bool:
+    """探测当前 sqlite 是否编译了 FTS5 且支持 trigram 分词器（sqlite >= 3.34）"""
+    bind = op.get_bind()
+    try:
+        bind.exec_driver_sql("CREATE VIRTUAL TABLE temp.nms_fts5_probe USING fts5(x, tokenize='trigram')")
+        bind.exec_driver_sql("DROP TABLE temp.nms_fts5_probe")
+        return True
+    except Exception:  # noqa: sqlite3.OperationalError: no such module: fts5 / no such tokenizer: trigram
+        return False
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 不支持 FTS5 的 sqlite 直接跳过，NoteService 检测不到 note_fts 表时会退回 LIKE 搜索
+    if not fts5_available():
+        return
+
+    # external content 表：索引内容来自 note 表，note_fts 本身不重复存储正文
+    # trigram 分词器按三个字符切分，中文也能做子串匹配，与原先 LIKE '%x%' 的语义一致
+    op.execute("""
+    CREATE VIRTUAL TABLE note_fts USING fts5(
+        title, content,
+        content='note', content_rowid='id',
+        tokenize='trigram'
+    )
+    """)
+
+    # 触发器同步 note -> note_fts
+    # 注意：batch_alter_table 若触发重建 note 表（move and copy），这些触发器会被一并删除，需要在对应迁移中重新创建
+    op.execute("""
+    CREATE TRIGGER note_fts_ai AFTER INSERT ON note BEGIN
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_ad AFTER DELETE ON note BEGIN
+        INSERT INTO note_fts(note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END
+    """)
+    # 只监听 title 和 content，incr_visit 等更新不需要重建索引
+    op.execute("""
+    CREATE TRIGGER note_fts_au AFTER UPDATE OF title, content ON note BEGIN
+        INSERT INTO note_fts(note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """)
+
+    # 回填已有数据
+    op.execute("INSERT INTO note_fts(note_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS note_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS note_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS note_fts_ai")
+    op.execute("DROP TABLE IF EXISTS note_fts")
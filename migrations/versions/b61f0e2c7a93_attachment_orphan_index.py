@@ -0,0 +1,30 @@
+"""临时附件部分索引：attachment(created_at) WHERE note_id IS NULL
+
+Revision ID: b61f0e2c7a93
+Revises: 385e1895e89a
+Create Date: 2026-10-16 19:58:40.126733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b61f0e2c7a93'
+down_revision: Union[str, Sequence[str], None] = '385e1895e89a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 直接 CREATE INDEX，不使用 batch_alter_table（会重建表）
+    op.create_index('ix_attachment_orphan_created_at', 'attachment', ['created_at'], unique=False,
+                    sqlite_where=sa.text('note_id IS NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_attachment_orphan_created_at', table_name='attachment', sqlite_where=sa.text('note_id IS NULL'))
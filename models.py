@@ -7,7 +7,7 @@ from typing import Any, TypedDict, Literal, List
 
 from alembic import command
 from alembic.config import Config
-from sqlalchemy import Column, DateTime, func, Integer, String, Text, ForeignKey, BLOB, Enum, JSON
+from sqlalchemy import Column, DateTime, func, Integer, String, Text, ForeignKey, BLOB, Enum, JSON, Index, table, column
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, async_scoped_session
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, declared_attr, relationship
@@ -119,6 +119,10 @@ class Note(Base):
     """
 
 
+note_fts = table("note_fts", column("rowid", Integer), column("title", Text), column("content", Text))
+"""Note 的 FTS5 全文索引虚拟表（迁移脚本创建 + 触发器同步，非 ORM 模型，只用于构建查询语句）"""
+
+
 class TagSourceEnum(enum.Enum):
     USER = "user"
     AUTO = "auto"
@@ -141,6 +145,11 @@ class Attachment(Base):
 
     note = relationship("Note", back_populates="attachments")
 
+    __table_args__ = (
+        # 清理服务分批删除过期的临时附件：WHERE note_id IS NULL AND created_at <= ?
+        Index("ix_attachment_orphan_created_at", "created_at", sqlite_where=note_id.is_(None)),
+    )
+
 
 class NoteDetailRenderTypeEnum(enum.Enum):
     """
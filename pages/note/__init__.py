@@ -1179,11 +1179,11 @@ class PageMainView(View["PageMainController"]):
         # ====== build ui - view ====== #
         with self.table:
             with ui.grid(columns=3).classes("w-full gap-4"):
+                # 一次 GROUP BY 查询拿到本页所有笔记的附件数量，避免每条笔记查询一次
                 async with AttachmentService() as attachment_service:
-                    for note in notes:
-                        result = await attachment_service.count_attachment(note.id)
-                        attachment_count = result.unwrap()
-                        await self._create_table_card(note, attachment_count)
+                    attachment_counts = (await attachment_service.count_attachments([note.id for note in notes])).unwrap()
+                for note in notes:
+                    await self._create_table_card(note, attachment_counts[note.id])
 
             await self._create_paging_control(current_page, total_pages, search_content)
 
@@ -2,7 +2,7 @@ import contextlib
 import functools
 from typing import List, Any, Coroutine, Sequence, Tuple, Union, TypeVar, Type, Dict, TypedDict
 
-from sqlalchemy import select, update, delete, insert, Row, RowMapping, or_, desc, and_, func, exists
+from sqlalchemy import select, update, delete, insert, Row, RowMapping, or_, desc, and_, func, exists, text, literal_column
 from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
@@ -10,7 +10,7 @@ from sqlalchemy.ext.declarative import DeclarativeMeta
 from loguru import logger
 from result import Ok, Err, Result
 
-from models import AsyncSessionLocal, Note, Attachment, UserConfig, NoteTypeMaskedEnum
+from models import AsyncSessionLocal, Note, Attachment, UserConfig, NoteTypeMaskedEnum, note_fts
 
 # [note] 项目较小时，services.py 多半是累赘，基础的 CRUD 本就不需要抽成单独的函数，当然如果多次使用，自然也是 ok 的
 #        其实即使项目小，这样一个简单的拆分操作，也是很有益处的，建议还是优先考虑拆到 services.py 中吧
@@ -136,6 +136,32 @@ class NoteService(Service[Note]):
     def __init__(self) -> None:
         super().__init__()
 
+    fts_enabled: bool | None = None  # note_fts 全文索引表是否存在（类属性缓存，进程内只探测一次）
+    fts_min_query_length = 3  # trigram 分词器至少需要 3 个字符才能命中索引
+
+    async def _is_fts_enabled(self) -> bool:
+        if NoteService.fts_enabled is None:
+            stmt = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'note_fts'")
+            NoteService.fts_enabled = (await self.db.execute(stmt)).scalar() is not None
+            logger.debug("[_is_fts_enabled] fts_enabled: {}", NoteService.fts_enabled)
+        return NoteService.fts_enabled
+
+    async def build_search_condition(self, search_content: str):
+        """构建搜索标题和正文的条件
+
+        Details:
+            1. 优先走 note_fts 全文索引，避免 LIKE '%x%' 对每条笔记正文的全表扫描
+            2. 搜索内容过短或者 sqlite 不支持 FTS5（未创建 note_fts）时，退回 LIKE
+
+        """
+        if len(search_content) >= self.fts_min_query_length and await self._is_fts_enabled():
+            # 整体作为一个短语查询，双引号需要转义，避免用户输入被解析成 FTS5 查询语法
+            fts_query = '"{}"'.format(search_content.replace('"', '""'))
+            matched_ids = select(note_fts.c.rowid).where(literal_column("note_fts").match(fts_query))
+            return Note.id.in_(matched_ids)
+        # search_content 为 "" 时，contains 可以忽略，即全部匹配
+        return or_(Note.title.contains(search_content), Note.content.contains(search_content))
+
     async def build_filter_statement(self,
                                      page: int | None = 1,
                                      search_filter: Dict | None = None,
@@ -164,8 +190,7 @@ class NoteService(Service[Note]):
 
         # 自定义格式 - 搜索标题和正文
         if search_content is not None:
-            # search_content 为 "" 时，contains 可以忽略，即全部匹配
-            stmt = stmt.filter(or_(Note.title.contains(search_content), Note.content.contains(search_content)))
+            stmt = stmt.filter(await self.build_search_condition(search_content))
 
         # 自定义格式 - 有附件（无附件暂时就不处理了，True/False/None 三进制）
         if has_attachment is True:  # noqa
@@ -226,6 +251,15 @@ class NoteService(Service[Note]):
             logger.error(e)
             return Err(str(e))
 
+    async def get_notes_with_attachment_count(self, **kwargs) -> List[Tuple[Note, int]]:
+        """get_notes + 每条笔记的附件数量，固定两次查询（笔记一次、附件数量一次 GROUP BY），参数同 get_notes"""
+        notes = await self.get_notes(**kwargs)
+        if not notes:
+            return []
+        stmt = AttachmentService.build_count_by_note_ids_statement([note.id for note in notes])
+        counts = dict((await self.db.execute(stmt)).tuples().all())
+        return [(note, counts.get(note.id, 0)) for note in notes]
+
     async def count_note(self, search_filter: Dict | None = None) -> Result[int, str]:
         """在有过滤的情况下，统计 Note 数量"""
         logger.debug("[count_note] start")
@@ -287,6 +321,28 @@ class AttachmentService(Service[Attachment]):
             logger.error(e)
             return Err(str(e))
 
+    @staticmethod
+    def build_count_by_note_ids_statement(note_ids: Sequence[int]):
+        """SELECT note_id, count(id) FROM attachment WHERE note_id IN (...) GROUP BY note_id（走 note_id 索引）"""
+        return (
+            select(Attachment.note_id, func.count(Attachment.id))
+            .where(Attachment.note_id.in_(note_ids))
+            .group_by(Attachment.note_id)
+        )
+
+    async def count_attachments(self, note_ids: Sequence[int]) -> Result[Dict[int, int], str]:
+        """批量统计附件数量（一条 GROUP BY 查询），返回 {note_id: count}，没有附件的 note_id 为 0"""
+        try:
+            counts = dict.fromkeys(note_ids, 0)
+            if not counts:
+                return Ok(counts)
+            result = await self.db.execute(self.build_count_by_note_ids_statement(list(counts)))
+            counts.update(result.tuples().all())
+            return Ok(counts)
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
     async def count_attachment_by_temporary_uuid(self, temporary_uuid: str) -> Result[int, str]:
         try:
             stmt = select(func.count(Attachment.id)).filter(Attachment.temporary_uuid == temporary_uuid)
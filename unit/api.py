@@ -1,20 +1,23 @@
+import asyncio
+import email.utils
 import os
 import traceback
 import urllib.parse
 import webbrowser
 import tempfile
-from typing import List
+from datetime import datetime, timezone
+from typing import List, Tuple
 
 from fastapi import Request, UploadFile, File, FastAPI
 from fastapi.exceptions import HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse, Response
+from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse, Response, RedirectResponse
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from nicegui import app
 
 from services import AttachmentService
-from schemas import SuccessResponse
-from utils import audio_to_text_by_qwen3_asr
+from schemas import SuccessResponse, ChunkedUploadInitRequest, ChunkedUploadFinalizeRequest
+from utils import audio_to_text_by_qwen3_asr, metrics, thumbnails, chunked_uploads, UploadSession
 from log import logger
 
 # [note] StreamingResponse 是流式返回，FileResponse 直接传入文件路径
@@ -33,6 +36,20 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
+
+@app.get("/storage_stats")
+async def get_storage_stats():
+    async with AttachmentService() as service:
+        result = await service.storage_stats()
+    if result.is_err():
+        raise HTTPException(status_code=500, detail=result.err())
+    return result.unwrap()
+
+
 @app.get("/open-external-link")
 def open_external_link(url: str):
     webbrowser.open(url)
@@ -47,29 +64,141 @@ async def upload_file(request: Request, temporary_uuid: str, files: List[UploadF
 
     # [knowledge] fastapi File 和 UploadFile 注解
 
-    failed_num = 0
-    for file in files:
-        content = await file.read()
-        async with AttachmentService() as service:
-            result = await service.create(
-                filename=file.filename,
-                content=content,
-                mimetype=file.content_type,
-                size=file.size,
-                note_id=None,
-                temporary_uuid=temporary_uuid
-            )
-            if result.is_err():
-                failed_num += 1
+    # 分块写入附件存储，不把整个文件读进内存（size 和 hash 在写入时计算），所有记录在一个事务中插入
+    async with AttachmentService() as service:
+        result = await service.bulk_create_from_streams([
+            (file.read, dict(filename=file.filename, mimetype=file.content_type, note_id=None,
+                             temporary_uuid=temporary_uuid))
+            for file in files
+        ])
+    if result.is_err():
+        statuses = [result] * len(files)
+    else:
+        statuses = result.unwrap()
+    failed_num = sum(1 for status in statuses if status.is_err())
+
+    data = [{"filename": file.filename, "id": status.ok(), "error": status.err()} for file, status in zip(files, statuses)]
+    return {"message": f"上传文件成功，失败数量 {failed_num} 个", "data": data}
+
+
+def _upload_session_json(session: UploadSession) -> dict:
+    return {**session._asdict(), "received": sorted(session.received)}
+
+
+async def _call_chunked_uploads(func, *args):
+    """在线程中执行 chunked_uploads 的文件操作，会话不存在返回 404，参数不合法返回 400"""
+    try:
+        return await asyncio.to_thread(func, *args)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"upload {args[0] if args else ''} not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@fastapi_app.post("/upload/chunked", summary="分块上传：创建会话")
+async def init_chunked_upload(body: ChunkedUploadInitRequest):
+    """大文件分块上传（可续传），协议见 utils/chunked_upload.py"""
+    session = await _call_chunked_uploads(chunked_uploads.init, body.filename, body.mimetype, body.size,
+                                          body.chunk_size, body.temporary_uuid)
+    return _upload_session_json(session)
+
+
+@fastapi_app.get("/upload/chunked/{upload_id}", summary="分块上传：查询已收到的分块（续传）")
+async def get_chunked_upload(upload_id: str):
+    return _upload_session_json(await _call_chunked_uploads(chunked_uploads.load, upload_id))
+
+
+@fastapi_app.put("/upload/chunked/{upload_id}/{index}", summary="分块上传：上传第 index 个分块")
+async def put_upload_chunk(request: Request, upload_id: str, index: int):
+    """请求体为分块的原始内容，请求头 X-Chunk-Sha256 可选（分块的 SHA-256）"""
+    # 分块大小有上限，读进内存后一次写入；超过上限的请求不读完直接拒绝
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        if len(data) > chunked_uploads.max_chunk_size:
+            raise HTTPException(status_code=413, detail="chunk too large")
+    session = await _call_chunked_uploads(chunked_uploads.write_chunk, upload_id, index, bytes(data),
+                                          request.headers.get("x-chunk-sha256"))
+    return {"upload_id": upload_id, "index": index, "received": len(session.received),
+            "chunk_count": session.chunk_count}
+
+
+@fastapi_app.post("/upload/chunked/{upload_id}/finalize", summary="分块上传：校验 hash 并创建附件")
+async def finalize_chunked_upload(upload_id: str, body: ChunkedUploadFinalizeRequest):
+    await _call_chunked_uploads(chunked_uploads.load, upload_id)
+    async with AttachmentService() as service:
+        result = await service.create_from_upload(upload_id, body.content_hash)
+    if result.is_err():
+        raise HTTPException(status_code=400, detail=result.err())
+    attachment = result.unwrap()
+    return {"message": "上传文件成功", "data": {"filename": attachment.filename, "id": attachment.id,
+                                            "content_hash": attachment.content_hash}}
+
+
+@fastapi_app.delete("/upload/chunked/{upload_id}", summary="分块上传：放弃上传")
+async def abort_chunked_upload(upload_id: str):
+    await _call_chunked_uploads(chunked_uploads.discard, upload_id)
+    return {"status": "ok"}
+
+
+class _RangeNotSatisfiable(Exception):
+    pass
+
+
+def _parse_range(range_header: str | None, size: int) -> Tuple[int, int] | None:
+    """解析 Range 请求头，返回 [start, end]（闭区间），忽略 Range 时返回 None
+
+    只支持单个区间（bytes=0-99、bytes=100-、bytes=-100），多区间和格式错误的请求按普通请求处理，
+    区间超出文件大小抛出 _RangeNotSatisfiable
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    ranges = range_header[len("bytes="):].split(",")
+    if len(ranges) != 1:
+        return None
+    start, sep, end = ranges[0].strip().partition("-")
+    if not sep or not (start or end) or (start and not start.isdigit()) or (end and not end.isdigit()):
+        return None
+    if not start:
+        # 最后 N 个字节
+        suffix = int(end)
+        if suffix == 0 or size == 0:
+            raise _RangeNotSatisfiable()
+        return max(size - suffix, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise _RangeNotSatisfiable()
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match / If-Range 的弱比较（忽略 W/ 前缀），* 匹配任意"""
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in [candidate.removeprefix("W/") for candidate in candidates]
 
-    return {"message": f"上传文件成功，失败数量 {failed_num} 个"}
+
+def _not_modified_since(header: str | None, last_modified: datetime) -> bool:
+    if not header:
+        return False
+    try:
+        return last_modified <= email.utils.parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
 
 
 @fastapi_app.get("/view_file", summary="查看文件")
-async def view_file(request: Request, file_id: int):
-    logger.debug("[view_file] start")
+async def view_file(request: Request, file_id: int, v: str | None = None):
+    """查看文件
 
-    # todo: 添加缓存
+    Details:
+        1. ETag 为内容的 SHA-256（强校验），支持 If-None-Match / If-Modified-Since 返回 304
+        2. 支持单区间 Range 请求（206/416），音视频拖动进度条、PDF 分段加载只读取需要的部分
+        3. 链接带上 v=内容 hash 前缀时，内容不会再变化，允许浏览器长期缓存；
+           不带 v 时每次都要向服务器确认（file_id 在删除后可能被复用）
+        4. 内容分块流式读取，不会整个加载到内存
+    """
+    logger.debug("[view_file] start")
 
     # 正常情况，文件必定存在，不存在的情况暂不考虑
     async with AttachmentService() as service:
@@ -77,21 +206,113 @@ async def view_file(request: Request, file_id: int):
         if result.is_err():
             raise HTTPException(status_code=400, detail=f"file {file_id} not found")
         file = result.unwrap()
+        result = await service.open_content(file)
+        if result.is_err():
+            raise HTTPException(status_code=400, detail=f"file {file_id} not found")
+        content = result.unwrap()
 
     filename = file.filename
     ascii_name = filename.encode("ascii", "ignore").decode("ascii")
     encoded_filename = urllib.parse.quote(filename, encoding="utf-8")
 
+    etag = f'"{content.content_hash}"'
+    # updated_at 读取时已转为本地时间（naive），HTTP 日期精确到秒
+    last_modified = file.updated_at.astimezone(timezone.utc)
+    immutable = v is not None and content.content_hash.startswith(v) and len(v) >= 8
+
     # [note] [文件名包含非 ASCII 字符](https://lxblog.com/qianwen/share?shareId=47782eed-a1c4-43d8-8651-b8bf2e3aad05)
     # Content-Disposition 的 inline 可改为 attachment 实现强制下载
     headers = {
-        "Content-Disposition": f'inline; filename="{ascii_name}"; filename*=UTF-8\'\'{encoded_filename}'
+        "Content-Disposition": f'inline; filename="{ascii_name}"; filename*=UTF-8\'\'{encoded_filename}',
+        "ETag": etag,
+        "Last-Modified": email.utils.format_datetime(last_modified, usegmt=True),
+        "Cache-Control": "private, max-age=31536000, immutable" if immutable else "private, no-cache",
+        "Accept-Ranges": "bytes",
     }
-    return Response(
-        file.content,
-        media_type=file.mimetype,
-        headers=headers
-    )
+
+    # If-None-Match 优先，存在时忽略 If-Modified-Since（RFC 9110）
+    if_none_match = request.headers.get("if-none-match")
+    if (_etag_matches(if_none_match, etag) if if_none_match
+            else _not_modified_since(request.headers.get("if-modified-since"), last_modified)):
+        metrics.incr("view_file.not_modified")
+        return Response(status_code=304, headers=headers)
+
+    # If-Range 与当前 ETag 不一致时（文件已变化）返回完整内容
+    if_range = request.headers.get("if-range")
+    range_header = request.headers.get("range") if not if_range or if_range == etag else None
+    try:
+        byte_range = _parse_range(range_header, content.size)
+    except _RangeNotSatisfiable:
+        metrics.incr("view_file.range_not_satisfiable")
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{content.size}"})
+
+    if byte_range is None:
+        metrics.incr("view_file.full")
+        return StreamingResponse(content.iter_range(0, content.size), media_type=file.mimetype,
+                                 headers={**headers, "Content-Length": str(content.size)})
+
+    start, end = byte_range
+    metrics.incr("view_file.partial")
+    return StreamingResponse(content.iter_range(start, end - start + 1), status_code=206, media_type=file.mimetype,
+                             headers={**headers, "Content-Length": str(end - start + 1),
+                                      "Content-Range": f"bytes {start}-{end}/{content.size}"})
+
+
+@fastapi_app.get("/download_zip", summary="打包下载笔记的所有附件")
+async def download_zip(note_id: int, with_note: bool = False):
+    """边压缩边下载（见 utils/zip_stream.py），不在服务端暂存压缩包；with_note 为 True 时附带笔记正文（markdown）
+
+    压缩后的大小事先未知，不返回 Content-Length（分块传输）
+    """
+    async with AttachmentService() as service:
+        result = await service.open_note_archive(note_id, with_note=with_note)
+    if result.is_err():
+        raise HTTPException(status_code=404, detail=result.err())
+    archive = result.unwrap()
+
+    ascii_name = archive.filename.encode("ascii", "ignore").decode("ascii")
+    encoded_filename = urllib.parse.quote(archive.filename, encoding="utf-8")
+    metrics.incr("download_zip")
+    return StreamingResponse(archive.iter_chunks(), media_type="application/zip", headers={
+        "Content-Disposition": f'attachment; filename="{ascii_name}"; filename*=UTF-8\'\'{encoded_filename}',
+        "Cache-Control": "private, no-cache",
+    })
+
+
+@fastapi_app.get("/thumbnail", summary="图片缩略图")
+async def thumbnail(request: Request, file_id: int, v: str | None = None):
+    """图片附件的缩略图（见 utils/thumbnail.py），缓存规则同 view_file
+
+    还没有生成的在这里生成（惰性回填旧附件），无法生成时（没有安装 Pillow、旧数据还没有迁移、图片损坏）重定向到原图
+    """
+    async with AttachmentService() as service:
+        result = await service.get(file_id)
+        if result.is_err():
+            raise HTTPException(status_code=400, detail=f"file {file_id} not found")
+        file = result.unwrap()
+
+    if not (file.mimetype or "").startswith("image/"):
+        raise HTTPException(status_code=400, detail=f"file {file_id} is not an image")
+
+    original_url = request.url_for("view_file").include_query_params(file_id=file_id)
+    if file.content_hash is None or not thumbnails.is_supported(file.mimetype):
+        return RedirectResponse(original_url, status_code=307)
+
+    etag = f'"{file.content_hash}-{thumbnails.size}"'
+    immutable = v is not None and file.content_hash.startswith(v) and len(v) >= 8
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable" if immutable else "private, no-cache",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        metrics.incr("thumbnail.not_modified")
+        return Response(status_code=304, headers=headers)
+
+    path = await thumbnails.ensure(file.content_hash)
+    if path is None:
+        return RedirectResponse(original_url, status_code=307)
+    return FileResponse(path, media_type=thumbnails.mimetype, headers=headers)
 
 
 @fastapi_app.post("/speech_recognition", summary="语音识别，文件上传", response_model=SuccessResponse)
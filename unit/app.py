@@ -10,8 +10,8 @@ from nicegui import ui, app
 # 在 main.py 中项目的包建议放在最下面执行，这样最稳当（比如 .env 导入，nicegui 环境变量设置等）
 import settings
 from api import fastapi_app
-from models import init_db, auto_upgrade_db
-from utils import cleanup
+from models import init_db, auto_upgrade_db, database
+from utils import cleanup, WriteCoalescer
 from services import UserConfigService
 from settings import dynamic_settings
 from pages import register_pages
@@ -42,6 +42,8 @@ async def shutdown_event():
     # fixme: 通过进程启动然后终止，app.on_shutdown 似乎无法正常执行，也就是说清理工作无法执行？
     logger.info("🔚 app - shutdown")
     await cleanup.stop()
+    await WriteCoalescer.flush_all()  # 合并写入中还没有写入的访问次数、自动保存、用户配置
+    await database.close()
 
 
 @app.on_exception
@@ -0,0 +1,280 @@
+"""
+读写分离：一个专用的写连接（写队列 + 组提交）+ N 个只读连接（WAL 模式下读写互不阻塞），对 Service 透明
+
+    写：  会话第一次写入（flush、INSERT/UPDATE/DELETE）时向写队列申请写连接，排到后通过 SAVEPOINT 加入写连接上的事务，
+          会话 commit 时 RELEASE SAVEPOINT，等待写队列的物理 COMMIT 完成后才返回（提交返回即已提交）
+    读：  会话在写入之前的查询都走只读连接池（PRAGMA query_only），写入之后的查询走写连接（能读到自己未提交的修改）
+
+组提交：写队列处理完一个会话后，如果还有会话在排队，就在同一个物理事务中继续处理（每个会话一个 SAVEPOINT，
+        回滚只影响自己），直到队列为空、达到 max_batch 个会话或者超过 max_batch_delay，再统一 COMMIT 一次。
+        并发写入时多个会话共享一次 COMMIT（fsync），单个会话写入时与原来一样立即提交。
+
+Details:
+    1. sqlite 同一时刻只能有一个写事务，原来各个会话在 sqlite 的锁上竞争（busy_timeout 忙等），现在在 asyncio 队列中排队
+    2. 同一个任务在持有写连接（已写入、未提交）时再用另一个会话写入（如嵌套的 Service 调用），不排队，直接复用写连接上的事务：
+       内层会话通过自己的 SAVEPOINT 加入，commit 时 RELEASE SAVEPOINT 后立即返回，随外层会话一起物理提交（外层回滚时一并回滚）；
+       内层会话需要先于外层会话结束。其他任务仍然排队；持有写连接的任务创建的子任务（asyncio.gather/create_task 等，
+       会复制 ContextVar）写入时立即抛出 RuntimeError，因为外层等待子任务就是等待自己（排队只会等到 acquire_timeout 超时）。
+       子任务需要写入时，先提交再创建子任务；不需要等待的后台任务用空的上下文创建（见 utils/write_coalescer.py）
+    3. 物理 COMMIT 失败时，同一批的所有会话的 commit 都会抛出异常
+    4. pysqlite 默认的事务处理与 SAVEPOINT 不兼容，写连接关闭驱动的自动事务（isolation_level = None），
+       由 begin 事件显式执行 BEGIN IMMEDIATE（见 models.py）
+
+"""
+import asyncio
+import re
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from sqlalchemy import event, Engine, TextClause
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+
+from log import logger
+
+_READ_STATEMENT_PATTERN = re.compile(r"^\s*(SELECT|WITH|EXPLAIN)\b|^\s*PRAGMA\s+\w+\s*(\(|;|$)", re.IGNORECASE)
+
+
+def is_write_statement(clause: Any) -> bool:
+    """INSERT/UPDATE/DELETE，以及不是查询的原生 SQL（如 text("DELETE FROM note_fts")）"""
+    if clause is None:
+        return False
+    if getattr(clause, "is_dml", False):
+        return True
+    if isinstance(clause, TextClause):
+        return not _READ_STATEMENT_PATTERN.match(clause.text)
+    return False
+
+
+def _incr_metric(name: str, value: int = 1):
+    # 【循环依赖】utils 导入 models，models 导入当前模块，用到时 utils 早已导入完毕
+    from utils.metrics import metrics
+    metrics.incr(name, value)
+
+
+class _Lease:
+    """一个会话对写连接的一次占用（从第一次写入到提交/回滚）"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, parent: "_Lease | None" = None):
+        self.owner = asyncio.current_task()
+        self.parent = parent  # 嵌套写入时为外层会话的 lease（见 WriteQueue.acquire）
+        self.connection = None  # 写连接（同步 Connection），排到之后才有值
+        self.granted = loop.create_future()
+        self.finished = loop.create_future()  # 会话结束：True 提交 / False 回滚
+        self.durable = loop.create_future()  # 物理 COMMIT 完成
+        # 不是每个提交都会等待 durable（如 session.begin() 上下文提交），避免 "exception was never retrieved"
+        self.durable.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+_held_lease: ContextVar[_Lease | None] = ContextVar("_held_lease", default=None)
+"""当前任务持有的写连接（最外层的 lease），子任务复制上下文后也能看到，见 WriteQueue.acquire"""
+
+
+class WriteQueue:
+    """单写连接的写队列
+
+    Usage:
+        write_queue = WriteQueue(write_engine)  # write_engine 的连接池只需要一个连接
+        AsyncSessionLocal = async_sessionmaker(class_=RoutingAsyncSession, sync_session_class=RoutingSession,
+                                               write_queue=write_queue, read_bind=read_engine.sync_engine,
+                                               join_transaction_mode="create_savepoint")
+
+        @app.on_shutdown
+        async def shutdown_event():
+            await write_queue.close()
+
+    """
+
+    max_batch = 32  # 一次物理提交最多合并的会话数
+    max_batch_delay = 0.05  # 一批从开始到提交的最长时间（秒），限制先完成的会话等待提交的时间
+    acquire_timeout = 30  # 等待写连接的超时（秒）
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._active: _Lease | None = None  # 当前占用写连接的 lease
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            # 第一次使用，或者换了事件循环（测试中多次 asyncio.run），旧的任务已经随旧的事件循环结束
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run(self._queue))
+        return loop
+
+    async def acquire(self) -> _Lease:
+        """排队等待写连接，当前任务已经持有写连接时直接复用（嵌套写入）"""
+        loop = self._ensure_started()
+        active = self._active
+        if active is not None and active.owner is asyncio.current_task() and not active.finished.done():
+            lease = _Lease(loop, parent=active)
+            lease.connection = active.connection
+            lease.granted.set_result(None)
+            _incr_metric("write_queue.nested")
+            return lease
+        held = _held_lease.get()
+        if held is not None and held.owner is not asyncio.current_task() and not held.finished.done():
+            raise RuntimeError("父任务持有写连接（已写入、未提交）时子任务不能写入：父任务等待子任务会等待自己，"
+                               "请先提交再创建子任务，或者在同一个任务中写入")
+        lease = _Lease(loop)
+        self._queue.put_nowait(lease)
+        try:
+            await asyncio.wait_for(asyncio.shield(lease.granted), self.acquire_timeout)
+        except TimeoutError:
+            if not lease.granted.done():
+                lease.granted.cancel()  # 写队列排到时跳过
+                raise TimeoutError(f"等待写连接超过 {self.acquire_timeout} 秒（持有写连接时等待其他任务写入？）") from None
+        _held_lease.set(lease)  # get_bind 在当前任务的上下文中等待 acquire，之后创建的子任务会复制这个值
+        return lease
+
+    @staticmethod
+    def release(lease: _Lease, committed: bool) -> asyncio.Future | None:
+        """会话结束时调用（同步），提交时返回物理 COMMIT 的 future（嵌套写入随外层提交，返回 None）"""
+        if lease.parent is not None:
+            return None
+        if not lease.finished.done():
+            lease.finished.set_result(committed)
+        return lease.durable if committed else None
+
+    async def close(self):
+        """处理完已经排队的写入后停止（app.on_shutdown）"""
+        if self._task is None or self._task.done() or self._loop is not asyncio.get_running_loop():
+            return
+        self._queue.put_nowait(None)
+        await self._task
+
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            lease = await queue.get()
+            if lease is None:
+                return
+            if lease.granted.cancelled():
+                continue
+            try:
+                lease = await self._run_batch(queue, lease)
+            except Exception as e:  # noqa: 连接出错，这一批已经通知到各个会话，继续处理后面的
+                logger.error("[WriteQueue] {}", e)
+                continue
+            if lease is None:  # 批处理中取到了 close 的标记
+                return
+
+    async def _run_batch(self, queue: asyncio.Queue, lease: _Lease) -> _Lease | bool:
+        """在一个物理事务中依次处理排队的会话，返回 None 表示收到了 close 标记"""
+        committed: list[_Lease] = []
+        started = time.perf_counter()
+        next_lease: _Lease | bool = True
+        async with self.engine.connect() as conn:
+            try:
+                await conn.begin()
+            except Exception as e:
+                lease.granted.set_exception(e)
+                raise
+            try:
+                while True:
+                    lease.connection = conn.sync_connection
+                    lease.granted.set_result(None)
+                    self._active = lease
+                    try:
+                        if await lease.finished:
+                            committed.append(lease)
+                    finally:
+                        self._active = None
+                    lease = None
+                    while lease is None and not queue.empty() and len(committed) < self.max_batch \
+                            and time.perf_counter() - started < self.max_batch_delay:
+                        lease = queue.get_nowait()
+                        if lease is None:
+                            next_lease = None
+                            break
+                        if lease.granted.cancelled():
+                            lease = None
+                    if lease is None:
+                        break
+                await conn.commit()
+            except BaseException as e:
+                for item in committed:
+                    if not item.durable.done():
+                        item.durable.set_exception(e if isinstance(e, Exception) else RuntimeError(str(e)))
+                if lease is not None and not lease.granted.done():
+                    lease.granted.set_exception(RuntimeError(f"写连接出错：{e}"))
+                raise
+        for item in committed:
+            item.durable.set_result(None)
+        _incr_metric("write_queue.batches")
+        _incr_metric("write_queue.commits", len(committed))
+        return next_lease
+
+
+class RoutingSession(Session):
+    """按语句类型路由：写入前读只读连接池，第一次写入时从写队列取得写连接，之后都走写连接"""
+
+    def __init__(self, *args, write_queue: WriteQueue, read_bind: Engine, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_queue = write_queue
+        self.read_bind = read_bind
+        self._writer_lease: _Lease | None = None
+        self._writer_committed = False
+        self._writer_durable: asyncio.Future | None = None
+
+    def get_bind(self, mapper=None, *, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        if self._writer_lease is None and (self._flushing or is_write_statement(clause)):
+            # get_bind 在 AsyncSession 的 greenlet 中执行，可以用 await_only 等待协程
+            self._writer_lease = await_only(self.write_queue.acquire())
+            self._writer_committed = False
+        if self._writer_lease is not None:
+            return self._writer_lease.connection
+        return self.read_bind
+
+    def pop_writer_durable(self) -> asyncio.Future | None:
+        durable, self._writer_durable = self._writer_durable, None
+        return durable
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _on_commit(session: RoutingSession):
+    session._writer_committed = True  # noqa
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _on_transaction_end(session: RoutingSession, transaction):
+    # 只处理最外层事务（begin_nested 的 SAVEPOINT 结束时还不能释放写连接）
+    if transaction.parent is not None or session._writer_lease is None:  # noqa
+        return
+    lease, session._writer_lease = session._writer_lease, None  # noqa
+    session._writer_durable = session.write_queue.release(lease, session._writer_committed)  # noqa
+
+
+class RoutingAsyncSession(AsyncSession):
+    """commit 等待写队列的物理 COMMIT 完成后才返回"""
+
+    sync_session: RoutingSession
+
+    @property
+    def holds_writer(self) -> bool:
+        """已经写入、还没有提交/回滚（持有写连接）"""
+        return self.sync_session._writer_lease is not None  # noqa
+
+    async def renew_read_snapshot(self) -> None:
+        """只读事务重新开始（新的读快照），之后的查询能读到其他会话已经提交的写入
+
+        不提交/回滚会话：会话中的对象和未 flush 的修改都保留（已经读取的对象需要调用方自己 expire）；
+        持有写连接时查询走写连接，本来就是最新的数据，不需要处理
+        """
+        if self.holds_writer or not self.in_transaction():
+            return
+        connection = await self.connection()
+        await connection.exec_driver_sql("COMMIT")
+        await connection.exec_driver_sql("BEGIN")
+
+    async def commit(self) -> None:
+        await super().commit()
+        durable = self.sync_session.pop_writer_durable()
+        if durable is not None:
+            await durable
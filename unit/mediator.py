@@ -1,3 +1,8 @@
 def get_user_config_service():
     from services import UserConfigService
     return UserConfigService
+
+
+def get_attachment_service():
+    from services import AttachmentService
+    return AttachmentService
@@ -2,6 +2,7 @@ from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
+from sqlalchemy import event
 
 from alembic import context
 
@@ -22,6 +23,7 @@ if config.config_file_name is not None:
 # region - template
 
 from models import Base
+from tokenizer import register_sqlite_functions
 target_metadata = Base.metadata
 render_as_batch = config.get_main_option("sqlalchemy.url").startswith("sqlite")
 """
@@ -81,6 +83,8 @@ def run_migrations_online() -> None:
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
     )
+    # 迁移脚本中的触发器/回填语句会用到分词函数 nms_tokenize
+    event.listen(connectable, "connect", lambda dbapi_connection, _: register_sqlite_functions(dbapi_connection))
 
     with connectable.connect() as connection:
         context.configure(
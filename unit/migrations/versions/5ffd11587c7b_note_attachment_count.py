@@ -0,0 +1,62 @@
+"""note.attachment_count 冗余字段 + 触发器
+
+Revision ID: 5ffd11587c7b
+Revises: 9efc500d1bd9
+Create Date: 2026-10-16 16:20:05.731942
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5ffd11587c7b'
+down_revision: Union[str, Sequence[str], None] = '9efc500d1bd9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 不使用 batch_alter_table：ADD COLUMN（NOT NULL + 默认值）sqlite 原生支持，
+    # 而 batch 模式会重建 note 表，导致 note_fts 的触发器被删除
+    op.add_column('note', sa.Column('attachment_count', sa.Integer(), server_default='0', nullable=False,
+                                    comment='附件数量'))
+    op.create_index('ix_note_attachment_count', 'note', ['attachment_count'], unique=False)
+
+    # 触发器维护 note.attachment_count，note_id 为 NULL（临时附件）时 UPDATE 不会命中任何行
+    op.execute("""
+    CREATE TRIGGER attachment_count_ai AFTER INSERT ON attachment BEGIN
+        UPDATE note SET attachment_count = attachment_count + 1 WHERE id = new.note_id;
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER attachment_count_ad AFTER DELETE ON attachment BEGIN
+        UPDATE note SET attachment_count = attachment_count - 1 WHERE id = old.note_id;
+    END
+    """)
+    # 附件换了所属笔记，包括 update_by_temporary_uuid 把临时附件（note_id 为 NULL）挂到笔记上
+    op.execute("""
+    CREATE TRIGGER attachment_count_au AFTER UPDATE OF note_id ON attachment
+    WHEN old.note_id IS NOT new.note_id BEGIN
+        UPDATE note SET attachment_count = attachment_count - 1 WHERE id = old.note_id;
+        UPDATE note SET attachment_count = attachment_count + 1 WHERE id = new.note_id;
+    END
+    """)
+
+    # 回填已有数据
+    op.execute("""
+    UPDATE note SET attachment_count = (SELECT count(*) FROM attachment WHERE attachment.note_id = note.id)
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS attachment_count_au")
+    op.execute("DROP TRIGGER IF EXISTS attachment_count_ad")
+    op.execute("DROP TRIGGER IF EXISTS attachment_count_ai")
+    op.drop_index('ix_note_attachment_count', table_name='note')
+    # sqlite >= 3.35 支持 DROP COLUMN，同样不使用 batch 模式
+    op.drop_column('note', 'attachment_count')
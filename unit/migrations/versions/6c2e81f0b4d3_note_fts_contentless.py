@@ -0,0 +1,105 @@
+"""note_fts 改为 contentless 表 + 拉丁字母也按 n-gram 分词
+
+Revision ID: 6c2e81f0b4d3
+Revises: a47a06ddd5e4
+Create Date: 2026-10-16 21:37:12.604381
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6c2e81f0b4d3'
+down_revision: Union[str, Sequence[str], None] = 'a47a06ddd5e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def note_fts_exists() -> bool:
+    """9efc500d1bd9 在 sqlite 未编译 FTS5 时不会创建 note_fts，这里同样跳过"""
+    bind = op.get_bind()
+    return bind.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'note_fts'"
+    ).scalar() is not None
+
+
+def drop_note_fts() -> None:
+    op.execute("DROP TRIGGER IF EXISTS note_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS note_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS note_fts_ai")
+    op.execute("DROP TABLE IF EXISTS note_fts")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not note_fts_exists():
+        return
+    drop_note_fts()
+
+    # content='' 即 contentless：只存倒排索引，不再存一份分词后的标题和正文
+    # 代价是删除时需要提供与写入时相同的分词结果（'delete' 命令），所以切换分词器后必须立即重建索引
+    op.execute("""
+    CREATE VIRTUAL TABLE note_fts USING fts5(
+        title, content,
+        content='',
+        tokenize='unicode61'
+    )
+    """)
+
+    # 注意：batch_alter_table 若触发重建 note 表（move and copy），这些触发器会被一并删除，需要在对应迁移中重新创建
+    op.execute("""
+    CREATE TRIGGER note_fts_ai AFTER INSERT ON note BEGIN
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, nms_tokenize(new.title), nms_tokenize(new.content));
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_ad AFTER DELETE ON note BEGIN
+        INSERT INTO note_fts(note_fts, rowid, title, content)
+        VALUES ('delete', old.id, nms_tokenize(old.title), nms_tokenize(old.content));
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_au AFTER UPDATE OF title, content ON note BEGIN
+        INSERT INTO note_fts(note_fts, rowid, title, content)
+        VALUES ('delete', old.id, nms_tokenize(old.title), nms_tokenize(old.content));
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, nms_tokenize(new.title), nms_tokenize(new.content));
+    END
+    """)
+
+    # 按新的分词规则（拉丁字母也切成 n-gram）回填
+    op.execute("INSERT INTO note_fts(rowid, title, content) SELECT id, nms_tokenize(title), nms_tokenize(content) FROM note")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not note_fts_exists():
+        return
+    drop_note_fts()
+
+    # 恢复 9efc500d1bd9 的普通 FTS5 表（索引按当前分词器回填，降级代码后需要 rebuild_search_index）
+    op.execute("""
+    CREATE VIRTUAL TABLE note_fts USING fts5(
+        title, content,
+        tokenize='unicode61'
+    )
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_ai AFTER INSERT ON note BEGIN
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, nms_tokenize(new.title), nms_tokenize(new.content));
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_ad AFTER DELETE ON note BEGIN
+        DELETE FROM note_fts WHERE rowid = old.id;
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_au AFTER UPDATE OF title, content ON note BEGIN
+        DELETE FROM note_fts WHERE rowid = old.id;
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, nms_tokenize(new.title), nms_tokenize(new.content));
+    END
+    """)
+    op.execute("INSERT INTO note_fts(rowid, title, content) SELECT id, nms_tokenize(title), nms_tokenize(content) FROM note")
@@ -0,0 +1,52 @@
+"""note 复合索引 + tag.note_id 索引 + 删除无用索引
+
+Revision ID: 830c3777a7a7
+Revises: 5ffd11587c7b
+Create Date: 2026-10-16 17:42:18.204519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '830c3777a7a7'
+down_revision: Union[str, Sequence[str], None] = '5ffd11587c7b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# INTEGER PRIMARY KEY 就是 rowid，主键上的普通索引完全多余；attachment 的 filename/mimetype/size 没有查询使用
+# 注意：ix_attachment_content（BLOB 上的索引）已经在 d33ff4160e7f 中删除
+USELESS_INDEXES = [
+    ("ix_note_id", "note", ["id"]),
+    ("ix_tag_id", "tag", ["id"]),
+    ("ix_user_config_id", "user_config", ["id"]),
+    ("ix_attachment_id", "attachment", ["id"]),
+    ("ix_attachment_filename", "attachment", ["filename"]),
+    ("ix_attachment_mimetype", "attachment", ["mimetype"]),
+    ("ix_attachment_size", "attachment", ["size"]),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 直接 CREATE/DROP INDEX，不使用 batch_alter_table（会重建表，导致 note 上的触发器被删除）
+    op.create_index("ix_note_note_type_updated_at", "note", ["note_type", "updated_at"], unique=False)
+    op.create_index("ix_note_note_type_created_at", "note", ["note_type", "created_at"], unique=False)
+    # 删除笔记时级联加载 tag 按 note_id 查询
+    op.create_index("ix_tag_note_id", "tag", ["note_id"], unique=False)
+
+    for name, table_name, _ in USELESS_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, table_name, columns in USELESS_INDEXES:
+        op.create_index(name, table_name, columns, unique=False)
+
+    op.drop_index("ix_tag_note_id", table_name="tag")
+    op.drop_index("ix_note_note_type_created_at", table_name="note")
+    op.drop_index("ix_note_note_type_updated_at", table_name="note")
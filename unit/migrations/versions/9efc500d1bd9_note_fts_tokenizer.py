@@ -0,0 +1,112 @@
+"""Note 全文索引改用 Python 分词器（中文 n-gram）
+
+Revision ID: 9efc500d1bd9
+Revises: ba4b3b95717a
+Create Date: 2026-10-16 14:03:47.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9efc500d1bd9'
+down_revision: Union[str, Sequence[str], None] = 'ba4b3b95717a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def fts5_available() -> bool:
+    """探测当前 sqlite 是否编译了 FTS5（分词交给 nms_tokenize，不再需要 trigram 分词器）"""
+    bind = op.get_bind()
+    try:
+        bind.exec_driver_sql("CREATE VIRTUAL TABLE temp.nms_fts5_probe USING fts5(x)")
+        bind.exec_driver_sql("DROP TABLE temp.nms_fts5_probe")
+        return True
+    except Exception:  # noqa: sqlite3.OperationalError: no such module: fts5
+        return False
+
+
+def drop_note_fts() -> None:
+    op.execute("DROP TRIGGER IF EXISTS note_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS note_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS note_fts_ai")
+    op.execute("DROP TABLE IF EXISTS note_fts")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    drop_note_fts()
+
+    if not fts5_available():
+        return
+
+    # 写入的是 nms_tokenize 分好词、空格分隔的文本，unicode61 只负责按空格切分
+    # 不再使用 external content 表：索引存的不是原文，删除时也只需要按 rowid 删除，切换分词器后不会删不干净
+    op.execute("""
+    CREATE VIRTUAL TABLE note_fts USING fts5(
+        title, content,
+        tokenize='unicode61'
+    )
+    """)
+
+    # 注意：batch_alter_table 若触发重建 note 表（move and copy），这些触发器会被一并删除，需要在对应迁移中重新创建
+    op.execute("""
+    CREATE TRIGGER note_fts_ai AFTER INSERT ON note BEGIN
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, nms_tokenize(new.title), nms_tokenize(new.content));
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_ad AFTER DELETE ON note BEGIN
+        DELETE FROM note_fts WHERE rowid = old.id;
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_au AFTER UPDATE OF title, content ON note BEGIN
+        DELETE FROM note_fts WHERE rowid = old.id;
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, nms_tokenize(new.title), nms_tokenize(new.content));
+    END
+    """)
+
+    # 回填已有数据
+    op.execute("INSERT INTO note_fts(rowid, title, content) SELECT id, nms_tokenize(title), nms_tokenize(content) FROM note")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_note_fts()
+
+    # 恢复 ba4b3b95717a 的 trigram 索引
+    bind = op.get_bind()
+    try:
+        bind.exec_driver_sql("CREATE VIRTUAL TABLE temp.nms_fts5_probe USING fts5(x, tokenize='trigram')")
+        bind.exec_driver_sql("DROP TABLE temp.nms_fts5_probe")
+    except Exception:  # noqa: no such module: fts5 / no such tokenizer: trigram
+        return
+
+    op.execute("""
+    CREATE VIRTUAL TABLE note_fts USING fts5(
+        title, content,
+        content='note', content_rowid='id',
+        tokenize='trigram'
+    )
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_ai AFTER INSERT ON note BEGIN
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_ad AFTER DELETE ON note BEGIN
+        INSERT INTO note_fts(note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END
+    """)
+    op.execute("""
+    CREATE TRIGGER note_fts_au AFTER UPDATE OF title, content ON note BEGIN
+        INSERT INTO note_fts(note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """)
+    op.execute("INSERT INTO note_fts(note_fts) VALUES ('rebuild')")
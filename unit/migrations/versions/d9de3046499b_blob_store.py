@@ -0,0 +1,121 @@
+"""附件内容寻址存储：blob 表 + attachment.content_hash + 引用计数触发器
+
+Revision ID: d9de3046499b
+Revises: 830c3777a7a7
+Create Date: 2026-10-16 18:35:41.270315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9de3046499b'
+down_revision: Union[str, Sequence[str], None] = '830c3777a7a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 与 UtcDateTime 写入的格式一致（UTC，6 位微秒）
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'"
+
+# 见 5ffd11587c7b，attachment 表重建后需要重新创建
+ATTACHMENT_COUNT_TRIGGERS = [
+    """
+    CREATE TRIGGER attachment_count_ai AFTER INSERT ON attachment BEGIN
+        UPDATE note SET attachment_count = attachment_count + 1 WHERE id = new.note_id;
+    END
+    """,
+    """
+    CREATE TRIGGER attachment_count_ad AFTER DELETE ON attachment BEGIN
+        UPDATE note SET attachment_count = attachment_count - 1 WHERE id = old.note_id;
+    END
+    """,
+    """
+    CREATE TRIGGER attachment_count_au AFTER UPDATE OF note_id ON attachment
+    WHEN old.note_id IS NOT new.note_id BEGIN
+        UPDATE note SET attachment_count = attachment_count - 1 WHERE id = old.note_id;
+        UPDATE note SET attachment_count = attachment_count + 1 WHERE id = new.note_id;
+    END
+    """,
+]
+
+BLOB_REF_TRIGGERS = [
+    f"""
+    CREATE TRIGGER blob_ref_ai AFTER INSERT ON attachment WHEN new.content_hash IS NOT NULL BEGIN
+        INSERT INTO blob (hash, size, ref_count, created_at, updated_at)
+        VALUES (new.content_hash, new.size, 1, {NOW}, {NOW})
+        ON CONFLICT (hash) DO UPDATE SET ref_count = ref_count + 1, updated_at = {NOW};
+    END
+    """,
+    f"""
+    CREATE TRIGGER blob_ref_ad AFTER DELETE ON attachment WHEN old.content_hash IS NOT NULL BEGIN
+        UPDATE blob SET ref_count = ref_count - 1, updated_at = {NOW} WHERE hash = old.content_hash;
+    END
+    """,
+    # 旧数据迁移（content_hash 由 NULL 变为有值）也走这个触发器
+    f"""
+    CREATE TRIGGER blob_ref_au AFTER UPDATE OF content_hash ON attachment
+    WHEN old.content_hash IS NOT new.content_hash BEGIN
+        UPDATE blob SET ref_count = ref_count - 1, updated_at = {NOW} WHERE hash = old.content_hash;
+        INSERT INTO blob (hash, size, ref_count, created_at, updated_at)
+        SELECT new.content_hash, new.size, 1, {NOW}, {NOW} WHERE new.content_hash IS NOT NULL
+        ON CONFLICT (hash) DO UPDATE SET ref_count = ref_count + 1, updated_at = {NOW};
+    END
+    """,
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('blob',
+                    sa.Column('hash', sa.String(length=64), nullable=False, comment='SHA-256'),
+                    sa.Column('size', sa.Integer(), nullable=False, comment='文件大小，单位字节'),
+                    sa.Column('ref_count', sa.Integer(), server_default='0', nullable=False,
+                              comment='引用该内容的附件数量'),
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('hash'))
+    op.create_index('ix_blob_unreferenced', 'blob', ['updated_at'], unique=False,
+                    sqlite_where=sa.text('ref_count = 0'))
+
+    # content 改为可空需要重建 attachment 表（sqlite 不支持 ALTER COLUMN），重建会删除表上的触发器，之后重新创建
+    # 注意：note 表不受影响，note_fts 的触发器还在
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True,
+                                      comment='内容寻址存储中的 SHA-256（见 utils/blob_store.py）'))
+        batch_op.alter_column('content', existing_type=sa.BLOB(), nullable=True,
+                              comment='文件二进制内容（旧数据，已迁移的为 NULL）')
+        batch_op.create_index('ix_attachment_content_hash', ['content_hash'], unique=False)
+
+    for sql in ATTACHMENT_COUNT_TRIGGERS + BLOB_REF_TRIGGERS:
+        op.execute("DROP TRIGGER IF EXISTS " + sql.split()[2])
+        op.execute(sql)
+
+    # 旧数据的内容不在这里搬迁（数据量可能很大），由 AttachmentService.migrate_legacy_contents 分批迁移，可中断、可重复执行
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    conn = op.get_bind()
+    migrated = conn.execute(sa.text("SELECT count(*) FROM attachment WHERE content IS NULL")).scalar()
+    if migrated:
+        raise RuntimeError(f"{migrated} 个附件的内容已经迁移到内容寻址存储中，降级前请先把内容写回 attachment.content")
+
+    for sql in BLOB_REF_TRIGGERS:
+        op.execute("DROP TRIGGER IF EXISTS " + sql.split()[2])
+
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.drop_index('ix_attachment_content_hash')
+        batch_op.alter_column('content', existing_type=sa.BLOB(), nullable=False, comment='文件二进制内容')
+        batch_op.drop_column('content_hash')
+
+    for sql in ATTACHMENT_COUNT_TRIGGERS:
+        op.execute("DROP TRIGGER IF EXISTS " + sql.split()[2])
+        op.execute(sql)
+
+    op.drop_index('ix_blob_unreferenced', table_name='blob', sqlite_where=sa.text('ref_count = 0'))
+    op.drop_table('blob')
@@ -1,20 +1,26 @@
+import asyncio
 import contextlib
+import functools
 import re
 import enum
 import urllib.parse
 from datetime import datetime
-from typing import Any, TypedDict, Literal, List, Dict
+from typing import Any, TypedDict, Literal, List, Dict, Callable, Awaitable
 
 from alembic import command
 from alembic.config import Config
 from contextvars import ContextVar
-from sqlalchemy import Column, DateTime, func, Integer, String, Text, ForeignKey, BLOB, Enum, JSON, UniqueConstraint
+from sqlalchemy import Column, DateTime, func, Integer, String, Text, ForeignKey, BLOB, Enum, JSON, table, column, UniqueConstraint, Index
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.ext.asyncio import async_sessionmaker, async_scoped_session, AsyncSession
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, declared_attr, relationship
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, declared_attr, relationship, query_expression, deferred
 from sqlalchemy_utc import UtcDateTime, utcnow
 
 from log import logger
+from db_routing import WriteQueue, RoutingSession, RoutingAsyncSession
+from settings import dynamic_settings
+from tokenizer import register_sqlite_functions
 
 
 # region - template
@@ -36,18 +42,148 @@ def _get_async_database_url(sync_url: str) -> str:
     return sync_url
 
 
+# sqlite 连接参数（PRAGMA），在每个新建的连接上执行（见 _on_connect），通过 settings.toml 的 sqlite_profile 选择预设，
+# sqlite_pragmas 覆盖单个参数。按顺序执行：busy_timeout 要先于 journal_mode（切换 WAL 需要拿锁）
+SQLITE_PROFILES: Dict[str, Dict[str, Any]] = {
+    # 读多写少（默认）：WAL 读写互不阻塞；WAL 下 synchronous=NORMAL 只在 checkpoint 时 fsync，断电可能丢失最后几个事务但不会损坏；
+    # 64MB 页缓存 + 256MB mmap，列表/搜索少走 read 系统调用
+    "read_heavy": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64 * 1024,  # 负数表示 KiB
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    },
+    # 持久性优先：每次提交都 fsync WAL，提交返回即落盘；不使用 mmap（进程内的野指针写坏映射页会直接写坏数据库）
+    "durable": {
+        "busy_timeout": 10000,
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16 * 1024,
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    },
+    # 不设置任何参数（sqlite 编译时的默认值），只用于基准测试对比
+    "default": {},
+}
+_PRAGMA_VALUE_PATTERN = re.compile(r"^-?[A-Za-z0-9_]+$")
+
+
+def get_sqlite_pragmas(profile: str, overrides: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """预设 + 覆盖项，未知的预设或者参数直接报错（启动时暴露配置错误）"""
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"unknown sqlite profile: {profile!r}, available: {list(SQLITE_PROFILES)}")
+    pragmas = {**SQLITE_PROFILES[profile], **(overrides or {})}
+    allowed = set(SQLITE_PROFILES["read_heavy"])
+    for name, value in pragmas.items():
+        if name not in allowed or not _PRAGMA_VALUE_PATTERN.match(str(value)):
+            raise ValueError(f"invalid sqlite pragma: {name}={value!r}")
+    return pragmas
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: Dict[str, Any]):
+    """在连接上执行 PRAGMA（值已经在 get_sqlite_pragmas 中校验过，可以直接拼接）"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
 alembic_cfg = Config("alembic.ini")
 sync_database_url = alembic_cfg.get_main_option("sqlalchemy.url")
 async_database_url = _get_async_database_url(sync_database_url)
-async_engine = create_async_engine(
-    async_database_url,
-    echo=False,  # 生产设为 False
-)
-AsyncSessionLocal = async_sessionmaker(
-    bind=async_engine,
-    expire_on_commit=False,  # 避免提交后对象失效
-    autoflush=False,  # 手动控制 flush
-)
+
+
+class Database:
+    """读写分离（见 db_routing.py）的一组连接：engine 是唯一的写连接，由写队列串行使用；read_engine 是只读连接池
+
+    Usage:
+        database = Database("sqlite+aiosqlite:///notes.db", get_sqlite_pragmas("read_heavy"), read_connections=4)
+        async with database.session_maker() as session:
+            ...
+        await database.close()
+
+    Details:
+        1. 模块级的 AsyncSessionLocal 等就是 Database(alembic.ini 中的数据库) 的属性，测试用同样的方式连接临时数据库（tests/conftest.py）
+        2. 每个新建的连接都会注册分词函数 nms_tokenize（note_fts 的触发器依赖它）并执行连接参数（见 SQLITE_PROFILES）
+
+    """
+
+    def __init__(self, async_url: str, pragmas: Dict[str, Any], read_connections: int):
+        self.pragmas = pragmas
+        self.engine = create_async_engine(
+            async_url,
+            echo=False,  # 生产设为 False
+            pool_size=1,
+            max_overflow=0,
+        )
+        self.read_engine = create_async_engine(
+            async_url,
+            echo=False,
+            pool_size=read_connections,
+            max_overflow=0,
+        )
+        self.write_queue = WriteQueue(self.engine)
+        self.session_maker = async_sessionmaker(
+            class_=RoutingAsyncSession,
+            sync_session_class=RoutingSession,
+            write_queue=self.write_queue,
+            read_bind=self.read_engine.sync_engine,
+            join_transaction_mode="create_savepoint",  # 每个会话在写连接的事务中是一个 SAVEPOINT（组提交）
+            expire_on_commit=False,  # 避免提交后对象失效
+            autoflush=False,  # 手动控制 flush
+        )
+        event.listen(self.engine.sync_engine, "connect", self._on_connect)
+        event.listen(self.engine.sync_engine, "begin", self._on_begin)
+        event.listen(self.read_engine.sync_engine, "connect", self._on_read_connect)
+        event.listen(self.read_engine.sync_engine, "begin", self._on_read_begin)
+
+    async def close(self):
+        """处理完已经排队的写入后关闭所有连接（app.on_shutdown）"""
+        await self.write_queue.close()
+        await self.engine.dispose()
+        await self.read_engine.dispose()
+
+    def _on_connect(self, dbapi_connection, connection_record):  # noqa: connection_record 是 event 回调的固定参数
+        """写连接：注册分词函数，执行连接参数"""
+        register_sqlite_functions(dbapi_connection)
+        apply_sqlite_pragmas(dbapi_connection, self.pragmas)
+        # pysqlite 自己管理事务时不支持 SAVEPOINT，改为由 _on_begin 显式开始事务
+        dbapi_connection.isolation_level = None
+
+    @staticmethod
+    def _on_begin(conn):
+        # IMMEDIATE：开始事务时就拿写锁，不会在事务中途因为升级锁失败（只有一个写连接，通常不会等待）
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def _on_read_connect(self, dbapi_connection, connection_record):  # noqa
+        """只读连接：除了 _on_connect 的设置，禁止写入（写入必须经过写队列）"""
+        register_sqlite_functions(dbapi_connection)
+        apply_sqlite_pragmas(dbapi_connection, self.pragmas)
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA query_only = ON")
+        finally:
+            cursor.close()
+        # pysqlite 不会为 SELECT 开始事务，每条查询各自一个快照，改为由 _on_read_begin 显式开始事务
+        dbapi_connection.isolation_level = None
+
+    @staticmethod
+    def _on_read_begin(conn):
+        # 一个 session 的所有查询在同一个读事务中（WAL 下是同一个快照），直到提交/回滚/关闭
+        conn.exec_driver_sql("BEGIN")
+
+
+sqlite_pragmas = get_sqlite_pragmas(dynamic_settings.sqlite_profile, dynamic_settings.sqlite_pragmas)
+database = Database(async_database_url, sqlite_pragmas, dynamic_settings.sqlite_read_connections)
+async_engine, read_engine = database.engine, database.read_engine
+write_queue = database.write_queue
+AsyncSessionLocal = database.session_maker
 
 
 async def init_db():
@@ -77,12 +213,27 @@ async def auto_upgrade_db():
         raise e
 
 
-_current_session: ContextVar[AsyncSession | None] = ContextVar("_current_session", default=None)
+# 当前工作单元的 (session, 创建它的任务)，见 db_session
+_current_session: ContextVar[tuple[AsyncSession, asyncio.Task | None] | None] = ContextVar("_current_session", default=None)
+
+
+def get_ambient_session() -> AsyncSession | None:
+    """当前工作单元（db_session/unit_of_work）的 session，不在工作单元中返回 None
+
+    Details:
+        1. 子任务（asyncio.create_task、gather、nicegui 的事件回调）会复制 ContextVar，但同一个 session 不能被多个任务并发使用，
+           所以只在创建它的任务中生效，子任务中返回 None（各自创建 session）
+
+    """
+    scope = _current_session.get()
+    if scope is None or scope[1] is not asyncio.current_task():
+        return None
+    return scope[0]
 
 
 @contextlib.asynccontextmanager
 async def db_session():
-    """
+    """工作单元：其中的 Service 共用同一个 session（同一个连接、同一个读快照），结束时提交
 
     Usage:
         async def get_note(note_id: int) -> Optional[Note]:
@@ -91,22 +242,61 @@ async def db_session():
 
         async with db_session():
             note = await get_note(1)
+            async with NoteService() as service:  # 加入当前的 session，不再单独创建
+                ...
+
+    Details:
+        1. 可以嵌套，内层直接使用外层的 session（不提交、不关闭）
+        2. Service 的方法中的 commit 会提交整个 session 到目前为止的修改，之后的查询是新的读快照
 
     """
+    session = get_ambient_session()
+    if session is not None:
+        yield session
+        return
+
     session = AsyncSessionLocal()
-    token = _current_session.set(session)
     try:
-        yield session
-        await session.commit()
+        with ambient_session(session):
+            yield session
+            await session.commit()
     except Exception as e:
         logger.error(e)
         await session.rollback()
         raise
     finally:
         await session.close()
+
+
+@contextlib.contextmanager
+def ambient_session(session: AsyncSession):
+    """在 with 块中（当前任务）把 session 设为工作单元的 session，不负责提交和关闭（Service 单独创建 session 时使用）"""
+    token = _current_session.set((session, asyncio.current_task()))
+    try:
+        yield session
+    finally:
         _current_session.reset(token)  # 清理上下文，防止内存泄漏
 
 
+def unit_of_work(func: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """页面函数装饰器：整个页面的渲染是一个工作单元（见 db_session），放在 @ui.page 下面
+
+    Usage:
+        @ui.page("/")
+        @unit_of_work
+        async def page_main(request: Request):
+            ...
+
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async with db_session():
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
 def get_db_session() -> AsyncSession:
     """协程安全的 session 上下文，在任意地方安全获取当前 session
 
@@ -115,7 +305,7 @@ def get_db_session() -> AsyncSession:
         2. 当前函数会自动从 _current_session 获取 session，不存在则出错，因为未提前执行 db_session 初始化 _current_session
 
     """
-    session = _current_session.get()
+    session = get_ambient_session()
     if session is None:
         raise RuntimeError(
             "No active database session. "
@@ -133,7 +323,8 @@ class Base(DeclarativeBase):
         3. 时间属性从数据库读取并实例化时，转为本地时间（不带时区和微秒数）的 datetime 的实例
 
     """
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    # INTEGER PRIMARY KEY 就是 rowid 本身，不需要再建索引（index=True 只会多维护一份一模一样的 B-tree）
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
     created_at: Mapped[datetime] = mapped_column(UtcDateTime, default=utcnow(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(UtcDateTime, default=utcnow(), onupdate=utcnow(), nullable=False)
 
@@ -241,6 +432,10 @@ class Note(Base):
     #       default 和 server_default 字段用起来很奇怪，
     #       目前的看法是，建表时无所谓，新增字段时，没有 server_default 旧数据肯定都是 NULL 了
     visit = Column(Integer, comment="访问次数", server_default="0")
+    # 冗余字段，由 attachment 表上的触发器维护（见迁移脚本 attachment_count），应用层不要直接修改
+    attachment_count = Column(Integer, comment="附件数量", nullable=False, server_default="0", index=True)
+    # 非数据库字段，预览查询时由数据库截取的正文开头（见 NoteService.get_notes(preview=True)），其余查询为 None
+    preview: Mapped[str | None] = query_expression()
 
     # [knowledge] backref 可以只在一个表中定义，另一个表会自动创建
     attachments = relationship("Attachment", back_populates="note", cascade="all, delete-orphan", lazy="select")
@@ -253,16 +448,34 @@ class Note(Base):
 
     tags = relationship("Tag", back_populates="note", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # 列表查询：WHERE note_type = ? ORDER BY updated_at/created_at DESC, id DESC
+        # sqlite 的索引末尾隐含 rowid（即 id），所以同样覆盖了 id 这一排序键
+        Index("ix_note_note_type_updated_at", "note_type", "updated_at"),
+        Index("ix_note_note_type_created_at", "note_type", "created_at"),
+    )
+
     # todo: 新增 metadata 字段，json 格式，用于存储一些自定义的额外信息！
 
 
+note_fts = table("note_fts", column("rowid", Integer), column("title", Text), column("content", Text))
+"""Note 的 FTS5 全文索引虚拟表
+
+Details:
+    1. 由迁移脚本创建，并通过 note 表上的触发器保持同步，所以不是 ORM 模型，只用于构建查询语句
+    2. sqlite 未编译 FTS5 时，迁移脚本不会创建该表，NoteService 会退回 LIKE 搜索
+    3. 写入的是 tokenizer.py 分好词的文本（空格分隔），contentless 表，只有索引，不能 SELECT title/content
+
+"""
+
+
 class Tag(Base):
     name = Column(String(200), comment="标签名", unique=True, nullable=False)
     # 如何和 enum 绑定在一起啊？
     source = Column(String(200), comment="标签来源", server_default=TagSourceEnum.AUTO.value)
     # SQLite + Alembic 的组合在 batch 模式下不允许匿名约束，必须显式命名，理由未知（可能是新增列）
     # 说实在的，不如用原生 sql 进行版本管理... 否则要么是踩坑、要么是阅读文档、要么是阅读源代码...
-    note_id = Column(Integer, ForeignKey("note.id", name="fk_tag_note_id"), comment="特别使用，允许为空")
+    note_id = Column(Integer, ForeignKey("note.id", name="fk_tag_note_id"), comment="特别使用，允许为空", index=True)
     note = relationship("Note", back_populates="tags", lazy="select")
 
     __table_args__ = (
@@ -279,14 +492,37 @@ class Attachment(Base):
         大于 100KB 的文件依旧不能存在 sqlite 数据库中！
 
     """
-    filename = Column(String(255), comment="原始文件名", nullable=False, index=True)
-    content = Column(BLOB, comment="文件二进制内容", nullable=False)
-    mimetype = Column(String(100), comment="MIME类型（如 application/pdf）", nullable=False, index=True)
-    size = Column(Integer, comment="文件大小，单位字节", nullable=False, index=True)
+    # filename/mimetype/size 没有任何查询按它们过滤，不建索引（只会拖慢写入）
+    filename = Column(String(255), comment="原始文件名", nullable=False)
+    # 旧数据的二进制内容，新上传的附件存放在内容寻址存储中（content 为 NULL），读取请使用 AttachmentService.read_content
+    # 延迟加载：查询附件默认不读取 BLOB，未加载时访问直接报错（raiseload），需要时显式 undefer（见 AttachmentService.get）
+    content = deferred(Column(BLOB, comment="文件二进制内容（旧数据，已迁移的为 NULL）", nullable=True), raiseload=True)
+    content_hash = Column(String(64), comment="内容寻址存储中的 SHA-256（见 utils/blob_store.py）", index=True)
+    mimetype = Column(String(100), comment="MIME类型（如 application/pdf）", nullable=False)
+    size = Column(Integer, comment="文件大小，单位字节", nullable=False)
     temporary_uuid = Column(String(64), comment="临时使用的标识，能模拟临时表效果的字段，也允许为空", index=True)
     note_id = Column(Integer, ForeignKey("note.id"), comment="特别使用，允许为空", index=True)  # [2025-11-23] 外键加索引
     note = relationship("Note", back_populates="attachments")
 
+    __table_args__ = (
+        # 清理服务分批删除过期的临时附件：WHERE note_id IS NULL AND created_at <= ?，只索引临时附件，体积很小
+        Index("ix_attachment_orphan_created_at", "created_at", sqlite_where=note_id.is_(None)),
+    )
+
+
+class Blob(Base):
+    """内容寻址存储中的文件，ref_count 由 attachment 表上的触发器维护（见迁移脚本 blob_store），应用层不要直接修改
+
+    ref_count 归零后不立刻删除文件，由清理服务过了宽限期（以 updated_at 为准）后删除
+    """
+    hash = Column(String(64), comment="SHA-256", unique=True, nullable=False)
+    size = Column(Integer, comment="文件大小，单位字节", nullable=False)
+    ref_count = Column(Integer, comment="引用该内容的附件数量", nullable=False, server_default="0")
+
+    __table_args__ = (
+        Index("ix_blob_unreferenced", "updated_at", sqlite_where=ref_count == 0),
+    )
+
 
 # todo: 分表，将大文件单独存储在另一张表中，然后给 id 建立索引（勉强算分表吧！）
 #       真正的分表：1. 按某字段值的范围切分，如：User0 User1 User2 等，每张表 1000 万条数据 2. 对字段值做 hash 再取模来决定落在哪张表中
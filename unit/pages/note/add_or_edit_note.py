@@ -12,7 +12,7 @@ from nicegui import ui
 from nicegui.events import GenericEventArguments, ValueChangeEventArguments
 from fastapi import Request
 
-from models import NoteTypeMaskedEnum
+from models import NoteTypeMaskedEnum, unit_of_work
 from views import HeaderView, build_footer, see_attachment
 from utils import go_main, go_get_note, DeepSeekClient, register_find_button_and_click, RateLimiter, build_ai_chain, \
     go_edit_note
@@ -26,6 +26,7 @@ class PageAddOrEditNoteController(Controller["PageAddOrEditNoteView"]):
     def __init__(self, view: "PageAddOrEditNoteView"):
         super().__init__(view)
         self.save_note_rate_limter = RateLimiter(dynamic_settings.save_note_cooldown)
+        self.auto_save_future: asyncio.Future | None = None  # 最近一次自动保存的写入结果
         self._create_initial_values()
 
     def _create_initial_values(self):
@@ -321,6 +322,16 @@ class PageAddOrEditNoteController(Controller["PageAddOrEditNoteView"]):
                     ui.notify("保存笔记成功！", type="positive")
                     # 建议直接跳转到编辑页面（使用发现，直接跳转 + 跳转后 notify 更好...）
                     ui.timer(0.5, lambda: go_edit_note(note_id=instance.id), once=True)
+            elif auto_save:
+                # 自动保存合并写入（见 NoteService.update_later），不等待写入完成，写入完成后再显示结果（_on_auto_save_done）
+                future = NoteService.update_later(self.view.note_id,
+                                                  title=self.view.title.value,
+                                                  content=self.view.content.value)
+                future.add_done_callback(self._on_auto_save_done)
+                self.auto_save_future = future
+                self._sync_initial_values(title=self.view.title.value, content=self.view.content.value)
+                self.view.tip_label.text = "（自动保存中...）"
+                return
             else:
                 async with NoteService() as service:
                     result = await service.update(self.view.note_id,
@@ -347,6 +358,21 @@ class PageAddOrEditNoteController(Controller["PageAddOrEditNoteView"]):
                 # [note] datetime.now() 自动获取当地时间（但是数据库必须存储 UTC 时间，拿到后自动转当地时间）
                 self.view.tip_label.text = f"（自动保存于 {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}）"
 
+    def _on_auto_save_done(self, future: asyncio.Future):
+        # 在 WriteCoalescer 的写入任务中回调，没有 slot 上下文，ui.notify 需要 with 元素
+        if future.cancelled():
+            return
+        if future.exception() is None:
+            if future is not self.auto_save_future:  # 之后又提交了自动保存（下一批），仍然在保存中
+                return
+            self.view.tip_label.text = f"（自动保存于 {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}）"
+            return
+        # 写入失败：清空初始值，下一次自动保存会重新提交
+        self._sync_initial_values(title=None, content=None)
+        self.view.tip_label.text = f"（自动失败保存于 {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}）"
+        with self.view.tip_label:
+            ui.notify(f"自动保存失败，原因：{future.exception()}", type="negative")
+
     async def get_note_content_rows(self) -> int:
         async with UserConfigService() as user_config_service:
             return await user_config_service.get_value("note_content_rows")
@@ -597,6 +623,9 @@ class PageAddOrEditNoteView(View["PageAddOrEditNoteController"]):
             if not self.is_add_note_page:
                 ui.separator()
                 ui.menu_item("导出为文件", auto_close=False, on_click=self.controller.show_export_dialog)
+                ui.menu_item("打包下载附件", on_click=lambda: ui.navigate.to(
+                    f"/api/download_zip?note_id={self.note_id}&with_note=true", new_tab=True)) \
+                    .tooltip("所有附件和笔记正文（markdown）打包为 zip 下载")
 
                 # ui.separator()
                 # import_file = ui.menu_item("导入文件", auto_close=False)
@@ -620,6 +649,7 @@ class PageAddOrEditNoteView(View["PageAddOrEditNoteController"]):
 
 
 @ui.page("/add_or_edit_note", title="新增或编辑笔记")
+@unit_of_work
 async def page_add_or_edit_note(request: Request, temporary_uuid: str, note_id: int = None,
                                 source: Literal["home_edit"] | None = None):
     """
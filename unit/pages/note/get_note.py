@@ -5,7 +5,7 @@ from nicegui import ui
 from nicegui.events import GenericEventArguments, ValueChangeEventArguments
 from fastapi.requests import Request
 
-from models import Note, Attachment, NoteDetailRenderTypeEnum, NoteTypeMaskedEnum
+from models import Note, Attachment, NoteDetailRenderTypeEnum, NoteTypeMaskedEnum, unit_of_work
 from utils import refresh_page, register_find_button_and_click, go_main, go_add_note, go_edit_note, go_get_note
 from services import NoteService, AttachmentService, UserConfigService
 from views import View, Controller, delete_note, HeaderView, build_footer, see_attachment
@@ -13,6 +13,7 @@ from settings import dynamic_settings, ENV
 from log import logger
 
 @ui.page("/get_note", title="笔记详情")
+@unit_of_work
 async def page_get_note(request: Request, note_id: int, notify_from: str = None):
     # [question] 新增 page 导致点击时页面需要刷新，有没有更流畅的办法呢？有的，定义一个 div，然后通过调用 clear 方法，重新构建 div
 
@@ -6,9 +6,9 @@ from typing import List, Dict, Tuple
 import pyperclip
 from nicegui import ui
 
-from models import Note
+from models import Note, unit_of_work
 from views import HeaderView, View, Controller, build_softmenu
-from services import NoteService, AttachmentService, UserConfigService
+from services import NoteService, UserConfigService
 from log import logger
 
 # [note] v1.1.3 版已完成，本文件是在它之后开发的。开始考虑页面样式和代码逻辑如何组织了。
@@ -34,14 +34,8 @@ from log import logger
 
 class HyperlinkNoteController(Controller["HyperlinkNoteView"]):
     async def list_note_and_attachment_count(self, page: int | None = None) -> List[Tuple[Note, int]]:
-        res = []
         async with NoteService() as note_service:
-            notes = await note_service.get_notes(page=page)
-        for note in notes:
-            async with AttachmentService() as attachment_service:
-                attachment_count = (await attachment_service.count_attachment(note.id)).unwrap()
-                res.append((note, attachment_count))
-        return res
+            return await note_service.get_notes_with_attachment_count(page=page, preview=True)
 
     async def get_total_pages(self):
         async with UserConfigService() as user_config_service:
@@ -52,6 +46,13 @@ class HyperlinkNoteController(Controller["HyperlinkNoteView"]):
 
     async def choose_note(self, note: Note):
         logger.debug("[choose_note] note.id: {}", note.id)
+        # 列表中的 note 是预览查询的结果，没有加载正文，选中时再查询完整的笔记
+        async with NoteService() as note_service:
+            result = await note_service.get(note.id)
+        if result.is_err():
+            ui.notify(f"笔记不存在，原因：{result.err()}", type="negative")
+            return
+        note = result.unwrap()
         self.view.title_input.value = note.title
         self.view.content_input.value = note.content
 
@@ -188,7 +189,7 @@ class HyperlinkNoteView(View["HyperlinkNoteController"]):
             note_and_attachment_count_list = await self.controller.list_note_and_attachment_count(
                 page=current_page)
             for note, attachment_count in note_and_attachment_count_list:
-                summary = note.content[:50]
+                summary = note.preview[:50]
                 # todo: 解决固定 px 的弊端，响应式才正确，w 暂时解决不了，但是 h 呢？还是说可能需要涉及计算...
                 # todo: 分页组件如何才能固定在一个位置啊？其实也不能说 nicegui 不适合复杂项目，
                 #       而是如果真要复杂项目你至少懂前端吧？那如果懂前端，为什么要使用 nicegui？！
@@ -213,6 +214,7 @@ class HyperlinkNoteView(View["HyperlinkNoteController"]):
 
 
 @ui.page("/note/index")
+@unit_of_work
 async def page_get_hyperlink_note():
     ui.add_head_html("""
     <link rel="stylesheet" href="/static/materialdesignicons.min.css" />
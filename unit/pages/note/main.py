@@ -1,3 +1,5 @@
+import contextlib
+import html
 import math
 import re
 import cProfile
@@ -10,13 +12,13 @@ from nicegui import ui
 from nicegui.events import GenericEventArguments, ValueChangeEventArguments
 from fastapi.requests import Request
 
-from models import Note, NoteTypeMaskedEnum
+from models import Note, NoteTypeMaskedEnum, unit_of_work
 from utils import (
     show_config_dialog, go_edit_note, go_get_note, refresh_page,
-    get_async_runner, RateLimiter, print_interval_time, IntervalTimer,
+    get_async_runner, print_interval_time, IntervalTimer, LatestTaskRunner,
     extract_urls, extract_bracketed_content
 )
-from services import NoteService, AttachmentService, UserConfigService, TagService
+from services import NoteService, UserConfigService, TagService
 from views import View, Controller, delete_note, HeaderView, build_footer
 from log import logger
 
@@ -24,7 +26,8 @@ from log import logger
 class PageMainController(Controller["PageMainView"]):
     def __init__(self, view: "PageMainView"):
         super().__init__(view)
-        self.search_input_rate_limter = RateLimiter(cooldown_seconds=2)
+        # 搜索框的输入、回车、清空都通过它触发搜索，新的搜索会取消旧的，只渲染最新一次的结果
+        self.search_runner = LatestTaskRunner("search", debounce_seconds=0.3)
 
     async def get_current_page(self):
         async with UserConfigService() as service:
@@ -47,10 +50,8 @@ class PageMainController(Controller["PageMainView"]):
         logger.debug("[on_clear_icon_click] start")
         if not self.view.search_input.value:
             return
+        # 修改 value 会触发 on_search_input_change，由它提交搜索
         self.view.search_input.value = ""
-        async with UserConfigService() as service:
-            await service.set_value("search_content", self.view.search_input.value)
-        await self.view.rebuild_table()
 
     async def new_generate_tags(self):
         # [2025-12-11] make it work! -> 将 Tag 存储于 Tag 表中，并更新 note_id 字段
@@ -87,13 +88,16 @@ class PageMainController(Controller["PageMainView"]):
         else:
             ui.notify("生成标签成功，但是没有新标签", type="positive")
 
-    async def on_search_input_keydown_enter(self):
-        if not self.search_input_rate_limter.allow():
-            ui.notify(f"操作太频繁，请稍后再试", type="negative")
-            return
-        await self.set_search_content(self.view.search_input.value)
+    async def _search(self, search_content: str):
+        """搜索任务（由 search_runner 调度，随时可能被取消）"""
+        # 搜索内容没变时，不需要再写一次数据库
+        if search_content != await self.get_search_content():
+            await self.set_search_content(search_content)
         await self.view.rebuild_table()
 
+    async def on_search_input_keydown_enter(self):
+        self.search_runner.submit(partial(self._search, self.view.search_input.value or ""), debounce=False)
+
     async def on_select_change(self, e: ValueChangeEventArguments):
         # todo: 实现 value 切换导致下面的 table 刷新（说起 table，nicegui 有 table 扩展库诶）
         # todo: 尝试使用 bind_value 函数 + 使用那个双向绑定库？
@@ -118,11 +122,9 @@ class PageMainController(Controller["PageMainView"]):
             await user_config_service.set_value("search_content", search_content)
 
     async def on_search_input_change(self, e: ValueChangeEventArguments):
-        # 注意，目前是直接尝试刷数据库，只要搜索框内容变了就刷数据库
-        # 而且也正是基于这一点，搜索框内容我没有传递，而是直接读数据库
-        # await self.set_search_content(e.value)
-        # [2025-12-01] 按下回车的时候设置比较好
-        pass
+        # 边输入边搜索：防抖期间的输入合并成一次，执行中的旧搜索会被取消
+        # 搜索框内容依旧通过 user_config 的 search_content 传递给 rebuild_table
+        self.search_runner.submit(partial(self._search, e.value or ""))
 
     async def get_note_number(self):
         async with UserConfigService() as user_config_service:
@@ -264,7 +266,29 @@ class PageMainView(View["PageMainController"]):
                 ui.separator()
                 ui.menu_item("清空标签", on_click=self._clear_tags).tooltip("清空现在生成的所有标签")
 
-    async def _create_table_card(self, note: Note, attachment_count: int) -> ui.card:
+    @staticmethod
+    def _to_highlighted_html(text: str, highlights: List[Tuple[int, int]]) -> str:
+        """按高亮区间（NoteService.search_notes 返回）给文本加上 <mark>，其余部分转义"""
+        parts = []
+        cursor = 0
+        for start, end in highlights:
+            parts.append(html.escape(text[cursor:start]))
+            parts.append(f'<mark class="bg-yellow-200 rounded-sm">{html.escape(text[start:end])}</mark>')
+            cursor = end
+        parts.append(html.escape(text[cursor:]))
+        return "".join(parts)
+
+    async def _create_table_card(self,
+                                 note: Note,
+                                 attachment_count: int,
+                                 visit: int,
+                                 search_hit: NoteService.NoteSearchHit | None = None) -> ui.card:
+        """
+
+        :param visit: 访问次数（NoteService.get_visits 一次查出整页的）
+        :param search_hit: 相关度搜索的结果，此时摘要显示命中位置附近的片段并高亮（note 未加载 content）
+        """
+
         def create_abstract_element():
             """使用 -webkit-line-clamp 实现真正的多行省略
 
@@ -289,7 +313,11 @@ class PageMainView(View["PageMainController"]):
                  justify-content: flex-start;
              """) as abstract_element:
                 # markdown 会渲染一些东西，摘要页面原始一点比较好
-                ui.label(note.content).style("""
+                if search_hit is not None:
+                    abstract = ui.html(self._to_highlighted_html(search_hit.snippet, search_hit.snippet_highlights))
+                else:
+                    abstract = ui.label(note.preview)
+                abstract.style("""
                     display: -webkit-box;
                     -webkit-line-clamp: {lines};
                     -webkit-box-orient: vertical;
@@ -315,8 +343,11 @@ class PageMainView(View["PageMainController"]):
             with ui.column().classes("w-full p-4"):
                 # flex-nowrap -> 不允许换行 | truncate min-w-0 -> 允许收缩，但最小为 0，配合 truncate 实现弹性截断
                 with ui.row().classes("w-full items-center justify-between mb-2 whitespace-nowrap flex-nowrap "):
-                    ui.label(note.title).classes("text-base font-semibold text-gray-800 ""truncate min-w-0 ") \
-                        .tooltip(note.title)
+                    if search_hit is not None:
+                        title = ui.html(self._to_highlighted_html(note.title, search_hit.title_highlights))
+                    else:
+                        title = ui.label(note.title)
+                    title.classes("text-base font-semibold text-gray-800 ""truncate min-w-0 ").tooltip(note.title)
                     ui.button(icon="filter").props("flat dense size=12px color=black") \
                         .tooltip("筛选标签").on("click", partial(show_filter_dialog, title=note.title))
 
@@ -344,13 +375,10 @@ class PageMainView(View["PageMainController"]):
                         ui.label(f"{note.updated_at}").tooltip("上次编辑时间")
                     with ui.row().classes("items-center justify-between gap-x-0 flex-nowrap"):
                         # --- 查看按钮
-                        eye_btn = ui.button(icon="mdi-eye-outline") \
+                        ui.button(icon="mdi-eye-outline") \
                             .on_click(partial(self.controller.on_eye_btn_click, note_id=note.id)) \
-                            .props("flat round dense").classes("text-gray-500 hover:text-blue-600 ")
-
-                        async with NoteService() as service:
-                            visit = await service.get_visit(note.id)
-                            eye_btn.tooltip(f"访问次数：{visit}")
+                            .props("flat round dense").classes("text-gray-500 hover:text-blue-600 ") \
+                            .tooltip(f"访问次数：{visit}")
 
                         # --- 编辑按钮
                         ui.button(icon="mdi-square-edit-outline") \
@@ -376,8 +404,16 @@ class PageMainView(View["PageMainController"]):
 
         return card
 
-    async def _create_paging_control(self, current_page: int, total_pages: int):
-        """分页控件，可能具有普遍性"""
+    async def _create_paging_control(self,
+                                     current_page: int,
+                                     total_pages: int,
+                                     prev_cursor: str | None = None,
+                                     next_cursor: str | None = None):
+        """分页控件，可能具有普遍性
+
+        :param prev_cursor: 上一页的游标，翻页时不再依赖 offset（见 NoteService.get_note_page）
+        :param next_cursor: 下一页的游标
+        """
         with ui.row().classes("w-full justify-center items-center gap-2 mt-2"):
             prev_btn = ui.button(icon="mdi-arrow-left").classes(
                 "px-4 py-2 text-gray-800 "
@@ -398,7 +434,7 @@ class PageMainView(View["PageMainController"]):
 
                 # 在分页组件中进行用户数据更新
                 await self.controller.set_current_page(next_page)
-                await self.rebuild_table(current_page=next_page)
+                await self.rebuild_table(current_page=next_page, cursor=prev_cursor)
 
             prev_btn.on_click(on_prev_btn_click)
 
@@ -440,10 +476,22 @@ class PageMainView(View["PageMainController"]):
                     return
                 # 在分页组件中进行用户数据更新
                 await self.controller.set_current_page(next_page)
-                await self.rebuild_table(current_page=next_page)
+                await self.rebuild_table(current_page=next_page, cursor=next_cursor)
 
             next_btn.on_click(on_next_btn_click)
 
+            # --- 跳页（没有游标，NoteService 会通过稀疏页边界索引定位）
+            async def on_jump_input_enter():
+                target_page = int(jump_input.value or 0)
+                if not 1 <= target_page <= total_pages or target_page == current_page:
+                    return
+                await self.controller.set_current_page(target_page)
+                await self.rebuild_table(current_page=target_page)
+
+            jump_input = ui.number(placeholder="跳至", min=1, max=total_pages, precision=0) \
+                .props("dense outlined").classes("w-20")
+            jump_input.on("keydown.enter", on_jump_input_enter)
+
     async def _create_hyperlink_table(self, parent: ui.element, notes: Sequence[Note]):
         with parent, ui.grid(columns=2).classes("w-full mx-auto"):
             for note in notes:
@@ -471,14 +519,36 @@ class PageMainView(View["PageMainController"]):
                                 #     .props("flat round dense").classes("text-gray-500 hover:text-blue-600 ") \
                                 #     .tooltip("查看详情")
 
+    @contextlib.asynccontextmanager
+    async def _replace_table(self):
+        """在隐藏的容器中构建新的 table，构建完成后再替换旧的
+
+        搜索由 controller.search_runner 在后台任务中执行：任务中没有 slot 上下文，新的搜索随时会取消旧的。
+        所以所有 ui 调用都在 with self.table/staging 下，被取消或者出错时丢弃新的内容，旧的 table 保持不变（不会半空半满）
+        """
+        with self.table:
+            staging = ui.column().classes("w-full")
+        staging.set_visibility(False)
+        try:
+            yield staging
+        except BaseException:
+            self.table.remove(staging)
+            raise
+        for child in list(self.table):
+            if child is not staging:
+                self.table.remove(child)
+        staging.set_visibility(True)
+
     @print_interval_time
     async def rebuild_table(self,
                             current_page: int | None = None,
-                            filters: Dict | None = None):
+                            filters: Dict | None = None,
+                            cursor: str | None = None):
         """
 
         :param current_page: 当前页号
         :param filters: 更多过滤，未来可能会删除重构
+        :param cursor: 翻页游标，此时 current_page 只用于显示页号
         :return:
         """
         # [2025-11-23] 点击返回按钮到主页时，延迟感很明显，想知道为什么...
@@ -488,7 +558,15 @@ class PageMainView(View["PageMainController"]):
         #              但是我没能看到有什么优化的可能...
         #              优化完成！Attachment 表存二进制数据的原因！通过添加索引的方式暂时解决了！未来绝不允许在数据库中添加大于 100KB 的二进制数据！
 
-        self.table.clear()
+        async with self._replace_table() as staging:
+            await self._build_table(staging, current_page, filters, cursor)
+
+    async def _build_table(self,
+                           parent: ui.element,
+                           current_page: int | None,
+                           filters: Dict | None,
+                           cursor: str | None):
+        """rebuild_table 的实现，新的 table 构建在 parent 中"""
         await self.controller.refresh_note_number_label()
 
         # 从 user.profile 中取值
@@ -506,6 +584,7 @@ class PageMainView(View["PageMainController"]):
         # [clear + rebuild 可能存在的问题](https://lxblog.com/qianwen/share?shareId=4f727c46-84a9-436d-801b-2ccfac158908)
         # - 视觉闪烁、位置跳动
         # - 用户快速点击时可能触发多次异步操作（竞态条件）
+        #   -> 搜索触发的 rebuild_table 已经交给 controller.search_runner 调度，新的会取消旧的
 
         # region - build search_filter
         search_filter = {}
@@ -530,6 +609,12 @@ class PageMainView(View["PageMainController"]):
         is_hyperlink = note_type == NoteTypeMaskedEnum.HYPERLINK
         is_bookmark = note_type == NoteTypeMaskedEnum.BOOKMARK
 
+        # 默认模式下有搜索内容时，按相关度分页展示（摘要在数据库中截取），过滤条件与普通列表相同
+        search_content = search_filter.get("search_content")
+        if is_default and search_content:
+            await self._rebuild_ranked_table(parent, search_filter, current_page, page_size)
+            return
+
         async with NoteService() as service:
             result = await service.count_note(search_filter=search_filter)
             total_pages = max(1, math.ceil(result.unwrap() / page_size))
@@ -537,44 +622,80 @@ class PageMainView(View["PageMainController"]):
             # 目前只有用户选择翻页时才会更新 profile 中的 current_page 值，其余情况按下面这样处理
             if total_pages < current_page:
                 current_page = 1
-            notes = await service.get_notes(
-                page=current_page,
-                search_filter=search_filter,
-                to_paginate=is_default
-            )
+                cursor = None
+            if is_default:
+                note_page = await service.get_note_page(page=current_page, search_filter=search_filter, cursor=cursor,
+                                                        preview=True)
+                notes = note_page.notes
+            else:
+                # 超链接模式需要从完整正文中提取链接，其余模式只需要预览
+                note_page = None
+                notes = await service.get_notes(page=current_page, search_filter=search_filter, to_paginate=False,
+                                                preview=not is_hyperlink)
+            # 卡片上显示的访问次数，整页一次查询
+            visits = {} if is_hyperlink or is_bookmark else await service.get_visits([note.id for note in notes])
 
         # 超链接模式重构 table
         if is_hyperlink:
-            await self._create_hyperlink_table(self.table, notes)
+            await self._create_hyperlink_table(parent, notes)
             return
         elif is_bookmark:
             # todo: 参考火狐的书签，实现一个类似的功能
             return
 
-        with self.table:
+        with parent:
             profiler = cProfile.Profile()
             profiler.enable()
             with IntervalTimer() as timer_outer:
                 # with ui.grid(columns=3).classes("w-full gap-4"):
                 with ui.element("div").classes("grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4"):
-                    async with AttachmentService() as attachment_service:
-                        # [note][2025-11-23] 测试发现，最耗时的在这里 -> 进一步发现是 count_attachment 的问题 -> 添加索引
-                        for note in notes:
-                            with IntervalTimer(log_enabled=False) as timer:
-                                result = await attachment_service.count_attachment(note.id)
-                                attachment_count = result.unwrap()
-                                await self._create_table_card(note, attachment_count)
-                                timer.print(prefix="for note in notes", suffix=f"note.id: {note.id}")
+                    # [note][2025-11-23] 测试发现，最耗时的在这里 -> 进一步发现是 count_attachment 的问题 -> 添加索引
+                    #                    -> 改为读取 note.attachment_count 冗余字段（触发器维护）
+                    for note in notes:
+                        with IntervalTimer(log_enabled=False) as timer:
+                            await self._create_table_card(note, note.attachment_count, visits.get(note.id, 0))
+                            timer.print(prefix="for note in notes", suffix=f"note.id: {note.id}")
                 timer_outer.print(prefix="build ui.grid")
             profiler.disable()
             stats = pstats.Stats(profiler)
             stats.sort_stats("cumtime")  # ncalls/tottime/percall/cumtime/percall 排序用
             stats.print_stats(10)  # 不传参代表全部输出，传参代表前 X 行
 
+            await self._create_paging_control(current_page, total_pages,
+                                              prev_cursor=note_page.prev_cursor if note_page else None,
+                                              next_cursor=note_page.next_cursor if note_page else None)
+
+    async def _rebuild_ranked_table(self, parent: ui.element, search_filter: Dict, current_page: int, page_size: int):
+        async with NoteService() as service:
+            total = (await service.count_note(search_filter=search_filter)).unwrap_or(0)
+            total_pages = max(1, math.ceil(total / page_size))
+            if total_pages < current_page:
+                current_page = 1
+            result = await service.search_notes(search_filter["search_content"], page=current_page,
+                                                page_size=page_size, search_filter=search_filter)
+            visits = await service.get_visits([hit.note.id for hit in result.unwrap_or([])])
+        if result.is_err():
+            with parent:  # 在后台任务中执行，ui.notify 需要 slot 上下文
+                ui.notify(f"搜索失败，原因：{result.err()}", type="negative")
+            return
+        hits = result.unwrap()
+
+        with parent:
+            if not hits:
+                ui.label("没有找到相关笔记").classes("w-full text-center text-gray-500 py-8")
+                return
+            with ui.element("div").classes("grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4"):
+                for hit in hits:
+                    await self._create_table_card(hit.note, hit.note.attachment_count, visits.get(hit.note.id, 0),
+                                                  search_hit=hit)
+            order = "按相关度排序" if "order_by" not in search_filter else "按所选顺序排序"
+            ui.label(f"共 {total} 条结果，{order}").classes("w-full text-center text-sm text-gray-500 mt-2")
+            # 搜索结果按页号分页（相关度没有稳定的游标键），跳页同样可用
             await self._create_paging_control(current_page, total_pages)
 
 
 @ui.page("/", title="笔记管理系统")
+@unit_of_work
 async def page_main(request: Request, search_content: str = "", notify_from: str = None):
     # ====== 开始构建 ui（我将使用 `[step]` 详细记录自己的开发过程，step 代指我在编写这段代码，行动上做了什么） ====== #
 
@@ -48,3 +48,17 @@ class ErrorResponse(BaseModel):
         }
 
 # endregion
+
+
+class ChunkedUploadInitRequest(BaseModel):
+    """分块上传：创建会话（见 utils/chunked_upload.py）"""
+    filename: str = Field(..., description="原始文件名")
+    mimetype: str | None = Field(None, description="MIME类型")
+    size: int = Field(..., description="文件大小，单位字节")
+    chunk_size: int | None = Field(None, description="分块大小，为空时使用服务端默认值")
+    temporary_uuid: str | None = Field(None, description="新增/编辑笔记页面的临时标识")
+
+
+class ChunkedUploadFinalizeRequest(BaseModel):
+    """分块上传：完成上传"""
+    content_hash: str | None = Field(None, description="整个文件的 SHA-256，为空时不校验")
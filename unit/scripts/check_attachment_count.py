@@ -0,0 +1,71 @@
+__all__ = ["check_attachment_count"]
+
+import argparse
+import json
+import sqlite3
+import sys
+import traceback
+from typing import List, Dict
+
+# note.attachment_count 是由 attachment 表上的触发器维护的冗余字段，
+# 正常情况下不会不一致，但是绕过触发器修改数据（如 DB Browser 中关闭触发器、手动导入数据）后需要检查一下
+
+
+def log(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def check_attachment_count(database: str, fix: bool = False) -> List[Dict]:
+    """返回 attachment_count 与实际附件数量不一致的笔记，fix 为 True 时顺便修正
+
+    :param database: sqlite 数据库文件路径
+    :param fix: 是否修正
+    :return: [{"id": 笔记 id, "attachment_count": 冗余字段的值, "actual": 实际数量}, ...]
+    """
+    conn = sqlite3.connect(database)
+    try:
+        rows = conn.execute("""
+        SELECT note.id, note.attachment_count, count(attachment.id) AS actual
+        FROM note LEFT JOIN attachment ON attachment.note_id = note.id
+        GROUP BY note.id
+        HAVING note.attachment_count != actual
+        """).fetchall()
+        mismatches = [{"id": id_, "attachment_count": count, "actual": actual} for id_, count, actual in rows]
+        if fix and mismatches:
+            with conn:
+                conn.executemany("UPDATE note SET attachment_count = ? WHERE id = ?",
+                                 [(item["actual"], item["id"]) for item in mismatches])
+        return mismatches
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查 note.attachment_count 与 attachment 表是否一致")
+
+    parser.add_argument("database", type=str, nargs="?", default="./notes.db", help="sqlite 数据库文件（默认: ./notes.db）")
+    parser.add_argument("--fix", action="store_true", default=False, help="修正不一致的数据")
+    parser.add_argument("--json", action="store_true", default=False, help="以 JSON 格式输出结果（便于程序解析）")
+
+    args = parser.parse_args()
+
+    log("[INFO] 开始检查 note.attachment_count...")
+    try:
+        mismatches = check_attachment_count(args.database, fix=args.fix)
+    except Exception as e:
+        log(f"{type(e).__name__} - {e}\n{traceback.format_exc()}============")
+        sys.exit(2)
+
+    if args.json:
+        print(json.dumps({"data": mismatches, "fixed": args.fix and bool(mismatches)}))
+    else:
+        for item in mismatches:
+            print(f"note {item['id']}: attachment_count={item['attachment_count']}, actual={item['actual']}")
+        log(f"[INFO] 不一致的笔记数量：{len(mismatches)}{'，已修正' if args.fix and mismatches else ''}")
+
+    # 存在不一致且未修正时返回非 0，方便在脚本/定时任务中使用
+    sys.exit(1 if mismatches and not args.fix else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,33 @@
 import asyncio
+import base64
+import contextlib
+import hashlib
+import json
+import operator
+import re
 from collections import namedtuple
-from typing import Any, Sequence, TypeVar, Type, Dict, TypedDict, Annotated, List
+from datetime import datetime, timedelta, timezone
+from typing import Any, Sequence, TypeVar, Type, Dict, TypedDict, Annotated, List, Literal, Tuple, Callable, Awaitable, \
+    Iterator
 
 from result import Ok, Err, Result
-from sqlalchemy import select, update, insert, or_, desc, and_, func, exists, delete
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy import select, update, insert, or_, desc, and_, func, exists, delete, text, literal_column, literal, \
+    bindparam, type_coerce, String, DateTime
 from sqlalchemy.orm import Bundle
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import DeclarativeMeta
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import selectinload, load_only, with_expression, undefer
 from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy_utc import UtcDateTime
 
 from models import (
-    AsyncSessionLocal, NoteTypeMaskedEnum, TagSourceEnum,
-    Note, Attachment, UserConfig, Tag
+    AsyncSessionLocal, get_ambient_session, ambient_session, NoteTypeMaskedEnum, TagSourceEnum,
+    Note, Attachment, UserConfig, Tag, Blob, note_fts
 )
-from utils import print_interval_time
+from utils import print_interval_time, blob_store, thumbnails, chunked_uploads, ZipStream, WriteCoalescer
+from tokenizer import get_tokenizer
 from log import logger
 
 # [note] 项目较小时，services.py 多半是累赘，基础的 CRUD 本就不需要抽成单独的函数，当然如果多次使用，自然也是 ok 的
@@ -35,15 +47,27 @@ class Service[M]:
 
     def __init__(self):
         self.db: AsyncSession | None = None
+        self._owns_db = True
+        self._scope = contextlib.ExitStack()
 
     async def __aenter__(self) -> "Service":
-        self.db = AsyncSessionLocal()
+        # 在工作单元（models.db_session/unit_of_work）或者另一个 Service 中时加入当前的 session，否则单独创建
+        self.db = get_ambient_session()
+        self._owns_db = self.db is None
+        if self._owns_db:
+            self.db = AsyncSessionLocal()
+            # 嵌套在其中的 Service（如 build_filter_statement 中的 UserConfigService）共用这个 session
+            self._scope.enter_context(ambient_session(self.db))
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.db:
+        if self.db and self._owns_db:
+            self._scope.close()
             # 如果有异常，会自动回滚（SQLAlchemy 会处理）
             await self.db.close()
+        elif self.db and not self.db.is_active:
+            # 共用的 session 在方法中出错（flush/commit 失败，方法返回 Err）后需要回滚，否则工作单元中后续的 Service 都不能用
+            await self.db.rollback()
         # 返回 False 表示不抑制异常
         return False
 
@@ -100,6 +124,70 @@ class Service[M]:
             logger.error(e)
             return Err(str(e))
 
+    # region - RETURNING fast paths
+
+    # [note] create/update 依赖 ORM 的 unit of work：update 是 get + setattr + commit（flush）+ refresh 三次往返，
+    #        create 是 commit（flush）+ refresh 两次往返，下面的方法一条 INSERT/UPDATE ... RETURNING 完成，见 tests/bench_service_returning.py
+
+    def _column_values(self, kwargs: Dict) -> Dict:
+        """只保留模型的列（与 update 一样忽略不存在的字段）"""
+        columns = sa_inspect(self.model).column_attrs.keys()
+        return {key: value for key, value in kwargs.items() if key in columns}
+
+    async def create_returning(self, **kwargs) -> Result[M, str]:
+        """C - INSERT ... RETURNING：插入并取回数据库生成的值（主键、默认值），不需要 refresh"""
+        try:
+            stmt = insert(self.model).values(**kwargs).returning(self.model)
+            instance = (await self.db.execute(stmt)).scalar_one()
+            await self.db.commit()
+            return Ok(instance)
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
+    async def update_returning(self, ident: int, **kwargs) -> Result[M, str]:
+        """U - UPDATE ... RETURNING：一条语句更新并取回更新后的记录，不需要 get 和 refresh"""
+        return await self._update_returning(ident, self._column_values(kwargs))
+
+    async def patch(self, ident: int, **kwargs) -> Result[M, str]:
+        """U - 只在值发生变化时写入：UPDATE ... WHERE id = :id AND (a IS NOT :a OR ...) RETURNING
+
+        Details:
+            1. 值都没有变化时不修改任何行：updated_at 不变，不触发触发器（如 note_fts），sqlite 也不会写入 WAL
+            2. 比较发生在写连接上（看到的是最新提交的值），不会因为读快照过期而漏掉写入
+
+        """
+        values = self._column_values(kwargs)
+        if not values:
+            return await self.get(ident)
+        changed = or_(*[getattr(self.model, key).is_distinct_from(value) for key, value in values.items()])
+        return await self._update_returning(ident, values, changed)
+
+    async def _update_returning(self, ident: int, values: Dict, *where) -> Result[M, str]:
+        if not values:
+            return await self.get(ident)
+        try:
+            primary_key = sa_inspect(self.model).primary_key[0]
+            stmt = (
+                update(self.model)
+                .where(primary_key == ident, *where)
+                .values(**values)
+                .returning(self.model)
+                # 用返回的行覆盖 session 中已有的对象（共用 session 时，之前加载的对象也是最新的值）
+                .execution_options(populate_existing=True, synchronize_session=False)
+            )
+            instance = (await self.db.execute(stmt)).scalar_one_or_none()
+            await self.db.commit()
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+        if instance is None:
+            # 记录不存在，或者（patch）值都没有变化
+            return await self.get(ident) if where else Err(f"{self.model.__name__} {ident} doesn't exist")
+        return Ok(instance)
+
+    # endregion
+
     def parse_to_order_by_field(self, order_by: str):
         """解析得到排序字段"""
         is_desc = False
@@ -143,10 +231,378 @@ class NoteService(Service[Note]):
     def __init__(self) -> None:
         super().__init__()
 
+    # region - count cache
+
+    count_cache: Dict[tuple, int] = {}
+    """count_note 的结果缓存（类属性缓存，同 UserConfigService.shared_cache）
+
+    Details:
+        1. 键为 (note_type, tag_select, has_attachment)，有搜索内容时不缓存
+        2. 只按 note_type 过滤的计数（基础计数）在 create/delete/修改类型时增减，其余带过滤条件的计数在写入时直接失效
+        3. 只有经过 NoteService/AttachmentService 的写入会维护缓存，其他途径修改数据后需要调用 clear_count_cache
+
+    """
+
+    data_version = 0
+    """笔记/附件每发生一次写入加 1，页边界索引等派生缓存用它判断是否过期（不用再查一次数据库）"""
+
+    @staticmethod
+    def _get_count_cache_key(search_filter: Dict | None) -> tuple | None:
+        search_filter = search_filter or {}
+        if search_filter.get("search_content"):
+            return None
+        note_type = search_filter.get("note_type", None)
+        return (
+            NoteTypeMaskedEnum.DEFAULT if note_type is None else note_type,  # 与 execute 的默认值一致
+            search_filter.get("tag_select", "(null)"),
+            search_filter.get("has_attachment", None),
+        )
+
+    @classmethod
+    def _is_base_count_key(cls, key: tuple) -> bool:
+        return key[1:] == ("(null)", None)
+
+    @classmethod
+    def _on_notes_changed(cls, note_type: str | None, delta: int = 0):
+        """某个类型的笔记发生了写入：基础计数增减 delta，该类型带过滤条件的计数失效"""
+        cls.data_version += 1
+        note_type = NoteTypeMaskedEnum.DEFAULT if note_type is None else note_type
+        for key in list(cls.count_cache):
+            if key[0] != note_type:
+                continue
+            if cls._is_base_count_key(key):
+                cls.count_cache[key] += delta
+            else:
+                del cls.count_cache[key]
+
+    @classmethod
+    def on_attachments_changed(cls):
+        """附件发生了写入：带 has_attachment 过滤条件的计数失效"""
+        cls.data_version += 1
+        for key in list(cls.count_cache):
+            if key[2] is not None:
+                del cls.count_cache[key]
+
+    @classmethod
+    def clear_count_cache(cls):
+        cls.data_version += 1
+        cls.count_cache.clear()
+
+    async def _get_note_type(self, ident: int) -> str | None:
+        return (await self.db.execute(select(Note.note_type).where(Note.id == ident))).scalar_one_or_none()
+
+    async def create(self, **kwargs) -> Result[Note, str]:
+        return await self._create_with(super().create, **kwargs)
+
+    async def create_returning(self, **kwargs) -> Result[Note, str]:
+        return await self._create_with(super().create_returning, **kwargs)
+
+    async def _create_with(self, create: Callable[..., Awaitable[Result[Note, str]]], **kwargs) -> Result[Note, str]:
+        result = await create(**kwargs)
+        if result.is_ok():
+            self._on_notes_changed(result.unwrap().note_type, 1)
+        return result
+
+    async def get(self, ident: int) -> Result[Note, str]:
+        await self._flush_pending_autosave(ident)
+        return await super().get(ident)
+
+    async def update(self, ident: int, **kwargs) -> Result[Note, str]:
+        return await self._update_with(super().update, ident, **kwargs)
+
+    async def update_returning(self, ident: int, **kwargs) -> Result[Note, str]:
+        return await self._update_with(super().update_returning, ident, **kwargs)
+
+    async def patch(self, ident: int, **kwargs) -> Result[Note, str]:
+        return await self._update_with(super().patch, ident, **kwargs)
+
+    async def _update_with(self, update_: Callable[..., Awaitable[Result[Note, str]]], ident: int,
+                           **kwargs) -> Result[Note, str]:
+        # 合并还没有写入的自动保存（参数中的值更新），正在写入的等待写完
+        pending = self.autosave_coalescer.take(ident, {})
+        await self._flush_pending_autosave(ident)
+        kwargs = {**pending, **kwargs}
+        old_note_type = await self._get_note_type(ident)
+        result = await update_(ident, **kwargs)
+        if result.is_ok():
+            new_note_type = result.unwrap().note_type
+            if new_note_type != old_note_type:
+                self._on_notes_changed(old_note_type, -1)
+                self._on_notes_changed(new_note_type, 1)
+            else:
+                # 标题变化会影响标签过滤的计数
+                self._on_notes_changed(new_note_type, 0)
+        return result
+
+    async def delete(self, ident: int) -> Result[bool, str]:
+        note_type = await self._get_note_type(ident)
+        result = await super().delete(ident)
+        if result.is_ok():
+            self._on_notes_changed(note_type, -1)
+            # 级联删除了附件
+            self.on_attachments_changed()
+            self.autosave_coalescer.take(ident)
+            NoteService.visit_written.pop(ident, None)
+        return result
+
+    # endregion
+
+    # region - write coalescing
+
+    visit_coalescer = WriteCoalescer("note.visit", flush=lambda deltas: NoteService._flush_visits(deltas),
+                                     merge=operator.add, delay=5)
+    """访问次数的增量 {note_id: 增量}，5 秒内的多次访问合并成一次写入（见 incr_visit）"""
+
+    autosave_coalescer = WriteCoalescer("note.autosave", flush=lambda updates: NoteService._flush_autosaves(updates),
+                                        merge=lambda old, new: {**old, **new}, delay=10)
+    """自动保存 {note_id: {字段: 值}}，10 秒内的多次自动保存合并成一次写入（见 update_later）"""
+
+    visit_written: Dict[int, int] = {}
+    """_flush_visits 写入后的访问次数 {note_id: visit}（类属性缓存），见 get_visits"""
+
+    @classmethod
+    async def _flush_visits(cls, deltas: Dict[int, int]):
+        # 数据库层面计算：visit = visit + 增量，executemany 一条语句；增加访问次数我不想 updated_at 修改，保持原值
+        table = Note.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_note_id"))
+            .values(visit=table.c.visit + bindparam("b_delta"), updated_at=table.c.updated_at)
+        )
+        async with NoteService() as service:
+            await service.db.execute(stmt, [dict(b_note_id=note_id, b_delta=delta) for note_id, delta in deltas.items()])
+            result = await service.db.execute(select(Note.id, Note.visit).where(Note.id.in_(deltas)))
+            written = dict(result.all())
+            previous = {note_id: cls.visit_written.get(note_id) for note_id in written}
+            cls.visit_written.update(written)
+            cls.visit_coalescer.mark_written()
+            try:
+                await service.db.commit()
+            except Exception:
+                for note_id, visit in previous.items():  # 没有写入，恢复原来的值
+                    if visit is None:
+                        cls.visit_written.pop(note_id, None)
+                    else:
+                        cls.visit_written[note_id] = visit
+                raise
+
+    @classmethod
+    async def _flush_autosaves(cls, updates: Dict[int, Dict]):
+        note_types = []
+        async with NoteService() as service:
+            for note_id, values in updates.items():
+                stmt = (
+                    update(Note)
+                    .where(Note.id == note_id)
+                    .values(**values)
+                    .returning(Note.note_type)
+                    .execution_options(synchronize_session=False)
+                )
+                note_types.append((await service.db.execute(stmt)).scalar_one_or_none())
+            await service.db.commit()
+        if any("note_type" in values for values in updates.values()):
+            cls.clear_count_cache()
+            return
+        for note_type in note_types:
+            if note_type is not None:  # 笔记已经被删除
+                cls._on_notes_changed(note_type, 0)
+
+    @classmethod
+    def update_later(cls, ident: int, **kwargs) -> asyncio.Future:
+        """合并写入的 update（自动保存用），最多 autosave_coalescer.delay 秒后写入，返回写入完成的 future（可以不等待）"""
+        return cls.autosave_coalescer.submit(ident, kwargs)
+
+    async def _flush_pending_autosave(self, ident: int):
+        """读取/修改笔记之前，先写入它还没有写入的自动保存（读到最新的内容，并且保证写入顺序）
+
+        不提交当前会话（可能是调用方的工作单元）：自动保存由 flush 单独提交，当前会话换一个新的读快照；
+        当前会话已经写入（持有写连接）时单独的写入要等它提交，等待会死锁，此时待写入的部分在当前事务中写入
+        """
+        values = self.autosave_coalescer.peek(ident)
+        if values is None:
+            return
+        if self.db.holds_writer:
+            pending = self.autosave_coalescer.take(ident)
+            if pending:
+                stmt = update(Note).where(Note.id == ident).values(**pending)
+                await self.db.execute(stmt.execution_options(synchronize_session=False))
+        else:
+            await self.autosave_coalescer.flush()
+            await self.db.renew_read_snapshot()
+        note = self.db.identity_map.get(self.db.identity_key(Note, ident))
+        if note is not None:  # 会话中已经读取过这条笔记，重新读取写入的字段
+            await self.db.refresh(note, list(values))
+
+    # endregion
+
+    fts_enabled: bool | None = None  # note_fts 全文索引表是否存在（类属性缓存，进程内只探测一次）
+
+    async def _is_fts_enabled(self) -> bool:
+        if NoteService.fts_enabled is None:
+            stmt = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'note_fts'")
+            NoteService.fts_enabled = (await self.db.execute(stmt)).scalar() is not None
+            logger.debug("[_is_fts_enabled] fts_enabled: {}", NoteService.fts_enabled)
+        return NoteService.fts_enabled
+
+    async def build_search_condition(self, search_content: str):
+        """构建搜索标题和正文的条件：整个搜索内容（包括空格）是标题或正文的子串（LIKE，% 和 _ 按字面匹配）
+
+        Details:
+            1. 优先走 note_fts 全文索引，避免 LIKE '%x%' 对每条笔记正文的全表扫描
+            2. 查询语句由当前分词器生成（与建索引时的分词规则一致），见 tokenizer.py
+            3. 索引只用来筛选候选，命中的笔记再用同一个 LIKE 条件复核（_substring_condition），结果与不走索引时完全一致
+            4. 分词器无法回答（如单个汉字）或者 sqlite 不支持 FTS5（未创建 note_fts）时，只用 LIKE
+
+        """
+        fts_query = await self._build_match_query(search_content)
+        if fts_query is not None:
+            matched_ids = select(note_fts.c.rowid).where(literal_column("note_fts").match(fts_query))
+            return and_(Note.id.in_(matched_ids), self._substring_condition(search_content))
+        return self._substring_condition(search_content)
+
+    @staticmethod
+    def _substring_condition(search_content: str):
+        # search_content 为 "" 时，contains 可以忽略，即全部匹配
+        return or_(Note.title.contains(search_content, autoescape=True),
+                   Note.content.contains(search_content, autoescape=True))
+
+    async def _build_match_query(self, search_content: str) -> str | None:
+        """返回 None 代表无法走全文索引"""
+        if not search_content or not await self._is_fts_enabled():
+            return None
+        return get_tokenizer().build_match_query(search_content)
+
+    NoteSearchHit = namedtuple("NoteSearchHit", ["note", "snippet", "snippet_highlights", "title_highlights", "rank"])
+    """搜索结果
+
+    Details:
+        1. note 只加载了 id/title/note_type/created_at/updated_at/visit/attachment_count，不要访问 note.content（会触发懒加载）
+        2. snippet_highlights/title_highlights 是 [(start, end), ...]，即命中词在 snippet/title 中的区间（左闭右开）
+        3. rank 是 bm25 得分（越小越相关），未走全文索引时为 None
+
+    """
+
+    snippet_length = 120  # 摘要长度（字符数）
+    snippet_context = 30  # 摘要中命中词前面保留的字符数
+    title_weight = 10.0  # bm25 中标题列的权重（正文为 1.0）
+
+    @staticmethod
+    def _find_highlights(text_: str, terms: List[str]) -> List[tuple[int, int]]:
+        """在（较短的）文本中找出所有命中词的区间，重叠区间会合并"""
+        lowered = text_.lower()
+        spans = []
+        for term in terms:
+            start = lowered.find(term)
+            while start != -1:
+                spans.append((start, start + len(term)))
+                start = lowered.find(term, start + len(term))
+        merged = []
+        for start, end in sorted(spans):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    async def search_notes(self,
+                           search_content: str,
+                           *,
+                           page: int = 1,
+                           page_size: int | None = None,
+                           search_filter: Dict | None = None) -> Result[List[NoteSearchHit], str]:
+        """按相关度（bm25）分页返回搜索结果，附带命中位置附近的摘要和高亮区间
+
+        Details:
+            1. 摘要由数据库截取（instr 定位第一个命中词 + substr），不会把笔记正文整体加载到 Python
+            2. note_fts 存的是分词后的文本，snippet()/highlight() 辅助函数给出的是分词结果而非原文，所以不用它们
+            3. search_filter 与 get_notes 相同（note_type/has_attachment/tag_select），总数用 count_note 统计
+            4. search_filter 中指定了 order_by 时按它排序，否则按相关度；无法走全文索引时退回 LIKE 过滤，按 updated_at 倒序
+            5. page_size 默认取用户配置的每页数量
+
+        """
+        logger.debug("[search_notes] start")
+        try:
+            tokenizer = get_tokenizer()
+            terms = tokenizer.highlight_terms(search_content)
+
+            # 摘要起点：第一个能在正文中找到的命中词的位置，前面保留 snippet_context 个字符
+            lowered_content = func.lower(Note.content)
+            match_positions = [func.nullif(func.instr(lowered_content, term), 0) for term in terms]
+            match_position = func.coalesce(*match_positions, 1) if match_positions else literal(1)
+            snippet_start = func.max(match_position - self.snippet_context, 1)
+            snippet = func.substr(Note.content, snippet_start, self.snippet_length)
+            content_length = func.length(Note.content)
+
+            search_filter = search_filter or {}
+            fts_query = await self._build_match_query(search_content)
+            if fts_query is not None and "order_by" not in search_filter:
+                # 用 rank 列 + `rank MATCH 'bm25(...)'` 设置权重，由 FTS5 直接按相关度输出，
+                # 写成 ORDER BY bm25(note_fts, ...) 会多一次临时 B-tree 排序
+                rank = literal_column("note_fts.rank")
+                stmt = (
+                    select(Note, snippet, snippet_start, content_length, rank)
+                    .join(note_fts, note_fts.c.rowid == Note.id)
+                    .where(literal_column("note_fts").match(fts_query))
+                    .where(rank.match(f"bm25({self.title_weight}, 1.0)"))
+                    .where(self._substring_condition(search_content))
+                    .order_by(rank)
+                )
+            else:
+                stmt = (
+                    select(Note, snippet, snippet_start, content_length, literal_column("NULL"))
+                    .where(await self.build_search_condition(search_content))
+                    .order_by(*self._keyset_order_by(search_filter.get("order_by", "-updated_at")))
+                )
+
+            if page_size is None:
+                async with UserConfigService() as user_config_service:
+                    page_size = await user_config_service.get_page_size()
+            stmt = stmt.options(load_only(Note.id, Note.title, Note.note_type,
+                                          Note.created_at, Note.updated_at, Note.visit, Note.attachment_count))
+            stmt = stmt.where(Note.note_type == (search_filter.get("note_type") or NoteTypeMaskedEnum.DEFAULT))
+            stmt = self._apply_search_filter(stmt, search_filter)
+            stmt = stmt.offset((max(page, 1) - 1) * page_size).limit(page_size)
+
+            hits = []
+            for note, snippet_text, start, length, score in (await self.db.execute(stmt)).all():
+                snippet_text = snippet_text or ""
+                # 首尾被截断时补上省略号，高亮区间基于补完后的摘要计算
+                if start > 1:
+                    snippet_text = "…" + snippet_text
+                if start - 1 + self.snippet_length < length:
+                    snippet_text = snippet_text + "…"
+                hits.append(self.NoteSearchHit(
+                    note=note,
+                    snippet=snippet_text,
+                    snippet_highlights=self._find_highlights(snippet_text, terms),
+                    title_highlights=self._find_highlights(note.title, terms),
+                    rank=score,
+                ))
+            logger.debug("[search_notes] fts_query: {}, hits: {}", fts_query, len(hits))
+            return Ok(hits)
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
+    async def rebuild_search_index(self) -> Result[int, str]:
+        """按当前分词器重建 note_fts 索引（切换分词器后需要调用），返回重建的笔记数"""
+        if not await self._is_fts_enabled():
+            return Err("note_fts 不存在，当前 sqlite 不支持 FTS5")
+        # contentless 表不支持 DELETE，用 delete-all 命令清空
+        await self.db.execute(text("INSERT INTO note_fts(note_fts) VALUES ('delete-all')"))
+        result = await self.db.execute(text(
+            "INSERT INTO note_fts(rowid, title, content) "
+            "SELECT id, nms_tokenize(title), nms_tokenize(content) FROM note"
+        ))
+        await self.db.commit()
+        logger.info("[rebuild_search_index] tokenizer: {}, rowcount: {}", get_tokenizer().name, result.rowcount)
+        return Ok(result.rowcount)
+
     async def build_filter_statement(self,
                                      page: int | None = 1,
                                      search_filter: Dict | None = None,
-                                     select_field=Note):
+                                     select_field=Note,
+                                     cursor: str | None = None):
         """构建过滤语句（临时不完美方案，饭要一口一口吃）
 
         一步一步来，先实践，写小函数，需求复杂后完善，再考虑抽成类（所以啊，编程就是要多练习...）
@@ -155,6 +611,7 @@ class NoteService(Service[Note]):
             page: 页号，page 为 None，代表不进行分页
             search_filter: 自定义过滤 Dict（易变）
             select_field: select(...) 中传递的参数，暂不够明确
+            cursor: 游标（get_note_page 返回的 next_cursor/prev_cursor），传递时忽略 page，按游标翻页
 
         """
         async with UserConfigService() as user_config_service:
@@ -164,35 +621,39 @@ class NoteService(Service[Note]):
         logger.debug("search_filter: {}", search_filter)
         search_filter = search_filter or {}
         search_content = search_filter.get("search_content", None)
-        has_attachment = search_filter.get("has_attachment", None)
-        tag_select = search_filter.get("tag_select", "(null)")
         order_by = search_filter.get("order_by", "-updated_at")  # 默认按 updated_at 倒叙排列
 
         stmt = select(select_field)
 
         # 自定义格式 - 搜索标题和正文
         if search_content is not None:
-            # search_content 为 "" 时，contains 可以忽略，即全部匹配
-            stmt = stmt.filter(or_(Note.title.contains(search_content), Note.content.contains(search_content)))
+            stmt = stmt.filter(await self.build_search_condition(search_content))
 
-        # 自定义格式 - 有附件（无附件暂时就不处理了，True/False/None 三进制）
-        if has_attachment is True:  # noqa
-            stmt = stmt.where(exists().where(Attachment.note_id == Note.id))
-        elif has_attachment is False:  # noqa
-            stmt = stmt.where(~exists().where(Attachment.note_id == Note.id))
+        stmt = self._apply_search_filter(stmt, search_filter)
 
-        # 自定义格式 - 标题标签筛选
-        if tag_select != "(null)":
-            stmt = stmt.filter(Note.title.contains(f"【{tag_select}】"))
+        if page is None and cursor is None:
+            return stmt.order_by(*self._keyset_order_by(order_by))
 
-        order_by_field = self.parse_to_order_by_field(order_by)
+        # 游标翻页：WHERE (order_by 字段, id) 在游标之后 ORDER BY ... LIMIT，不需要扫描并跳过前面的行
+        decoded = self._decode_cursor(cursor, order_by) if cursor else None
+        if decoded is not None:
+            key, direction = decoded
+            backward = direction == "prev"
+            stmt = stmt.where(self._keyset_condition(order_by, key, backward=backward))
+            return stmt.order_by(*self._keyset_order_by(order_by, reverse=backward)).limit(page_size)
 
-        stmt = stmt.order_by(order_by_field)
+        stmt = stmt.order_by(*self._keyset_order_by(order_by))
+        page = page or 1
 
-        if page is None:
-            return stmt
+        # 跳页：从稀疏页边界索引中找到不超过目标页的最近边界，从边界开始只需要 offset 很少的行
+        offset = (page - 1) * page_size
+        boundary = await self._find_page_boundary(search_filter, offset, page_size)
+        if boundary is not None:
+            boundary_offset, key = boundary
+            stmt = stmt.where(self._keyset_condition(order_by, key, inclusive=True))
+            offset -= boundary_offset
 
-        stmt = stmt.offset((page - 1) * page_size).limit(page_size)
+        stmt = stmt.offset(offset).limit(page_size)
         """结合 offset 实现分页
 
         # 跳过前 20 条，取 10 条（第 3 页，每页 10 条）
@@ -202,6 +663,155 @@ class NoteService(Service[Note]):
 
         return stmt
 
+    @staticmethod
+    def _apply_search_filter(stmt, search_filter: Dict):
+        """搜索内容以外的过滤条件（build_filter_statement 和 search_notes 共用）"""
+        has_attachment = search_filter.get("has_attachment", None)
+        tag_select = search_filter.get("tag_select", "(null)")
+
+        # 自定义格式 - 有附件（无附件暂时就不处理了，True/False/None 三进制）
+        # attachment_count 由触发器维护并且有索引，不需要对每条笔记执行 EXISTS 子查询
+        if has_attachment is True:  # noqa
+            stmt = stmt.where(Note.attachment_count > 0)
+        elif has_attachment is False:  # noqa
+            stmt = stmt.where(Note.attachment_count == 0)
+
+        # 自定义格式 - 标题标签筛选
+        if tag_select not in ("(null)", None):
+            stmt = stmt.filter(Note.title.contains(f"【{tag_select}】"))
+        return stmt
+
+    # region - keyset pagination
+
+    def _parse_order_by(self, order_by: str) -> tuple[str, bool]:
+        """返回 (字段名, 是否倒序)"""
+        is_desc = order_by.startswith("-")
+        name = order_by.lstrip("-")
+        if not hasattr(self.model, name):
+            raise AttributeError(f"{name}({self.model.__name__}) doesn't exist")
+        return name, is_desc
+
+    def _keyset_columns(self, order_by: str) -> list:
+        """游标的键：order_by 字段 + id（保证唯一，排序值相同时也能稳定翻页）"""
+        name, _ = self._parse_order_by(order_by)
+        if name == "id":
+            return [Note.id]
+        return [getattr(Note, name), Note.id]
+
+    def _keyset_key_columns(self, order_by: str) -> list:
+        """查询游标的键时使用：时间字段按数据库中存储的原始文本取出（不经过 UtcDateTime 转换）
+
+        created_at/updated_at 有两种存储格式：utcnow() 写入的毫秒 "2026-01-01 00:00:00.123"，python 写入的微秒 ".123000"，
+        转成 datetime 再绑定回去会统一成微秒格式，与毫秒格式的原值按文本比较时不相等（翻页会重复或者漏掉一行）。
+        ORDER BY 比较的是原始文本，游标的键也用原始文本比较，两者一致；type_coerce 只影响结果/参数的转换，生成的 SQL 不变（仍然走索引）
+        """
+        return [
+            type_coerce(column, String).label(column.key) if isinstance(column.type, (DateTime, UtcDateTime)) else column
+            for column in self._keyset_columns(order_by)
+        ]
+
+    def _keyset_order_by(self, order_by: str, reverse: bool = False) -> list:
+        _, is_desc = self._parse_order_by(order_by)
+        is_desc = is_desc != reverse
+        return [desc(column) if is_desc else column for column in self._keyset_columns(order_by)]
+
+    def _keyset_condition(self, order_by: str, key: Sequence, *, backward: bool = False, inclusive: bool = False):
+        """排序方向上位于 key 之后（backward 为 True 时之前）的行，key 为 _keyset_key_columns 取出的值
+
+        (a, b) > (x, y) 展开为 a > x OR (a = x AND b > y)，时间字段按原始文本比较（见 _keyset_key_columns）
+        """
+        _, is_desc = self._parse_order_by(order_by)
+        after = is_desc == backward  # 正序向后翻 / 倒序向前翻 -> 取更大的值
+        columns = [
+            type_coerce(column, String) if isinstance(column.type, (DateTime, UtcDateTime)) else column
+            for column in self._keyset_columns(order_by)
+        ]
+        condition = None
+        for i in reversed(range(len(columns))):
+            column, value = columns[i], key[i]
+            if i == len(columns) - 1:
+                if inclusive:
+                    current = column >= value if after else column <= value
+                else:
+                    current = column > value if after else column < value
+            else:
+                current = or_(column > value if after else column < value, and_(column == value, condition))
+            condition = current
+        return condition
+
+    @staticmethod
+    def _encode_cursor(order_by: str, key: Sequence, direction: Literal["next", "prev"]) -> str:
+        payload = json.dumps({"o": order_by, "k": list(key), "d": direction}, ensure_ascii=False, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor: str, order_by: str) -> tuple[list, str] | None:
+        """游标无效或者排序方式已经改变时返回 None（调用方退回页号分页）"""
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if payload["o"] != order_by or payload["d"] not in ("next", "prev"):
+                return None
+            key = payload["k"]
+            if not all(isinstance(value, (str, int, float)) for value in key):  # 旧格式的游标（时间是 {"dt": ...}）
+                return None
+            return key, payload["d"]
+        except Exception as e:
+            logger.warning("[_decode_cursor] invalid cursor: {}, {}", cursor, e)
+            return None
+
+    page_boundary_stride = 10  # 稀疏页边界索引每隔多少页记录一个边界
+    page_boundary_cache: Dict[tuple, tuple[int, list]] = {}  # (过滤条件, page_size) -> (data_version, 边界键列表)
+    page_boundary_cache_size = 32
+
+    async def _find_page_boundary(self, search_filter: Dict, offset: int, page_size: int) -> tuple[int, list] | None:
+        """返回 (边界所在的行号, 边界行的键)，offset 在第一段内时返回 None"""
+        span = page_size * self.page_boundary_stride
+        index = offset // span
+        if index == 0:
+            return None
+        boundaries = await self._get_page_boundaries(search_filter, page_size)
+        if index >= len(boundaries):
+            return None
+        return index * span, boundaries[index]
+
+    async def _get_page_boundaries(self, search_filter: Dict, page_size: int) -> list:
+        """稀疏页边界索引：第 0、span、2*span... 行的键（span = page_size * page_boundary_stride）
+
+        Details:
+            1. 一条只读排序键的窗口函数查询得到，不读取正文
+            2. 按 (过滤条件, page_size) 缓存，data_version 变化时重建
+            3. 外层不排序（会产生临时 B-tree），边界按行号在 Python 中排序
+        """
+        order_by = search_filter.get("order_by", "-updated_at")
+        cache_key = (json.dumps(search_filter, sort_keys=True, ensure_ascii=False, default=str), page_size)
+        version = self.data_version
+        cached = self.page_boundary_cache.get(cache_key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        columns = self._keyset_key_columns(order_by)
+        row_number = func.row_number().over(order_by=self._keyset_order_by(order_by)).label("row_number")
+        inner_stmt = await self.build_filter_statement(page=None, search_filter=search_filter,
+                                                       select_field=row_number)
+        inner_stmt = inner_stmt.add_columns(*columns).order_by(None)
+        inner_stmt = inner_stmt.where(Note.note_type == (search_filter.get("note_type") or NoteTypeMaskedEnum.DEFAULT))
+        inner = inner_stmt.subquery()
+        span = page_size * self.page_boundary_stride
+        stmt = (
+            select(inner.c.row_number, *[inner.c[column.key] for column in columns])
+            .where((inner.c.row_number - 1) % span == 0)
+        )
+        rows = sorted((await self.db.execute(stmt)).all(), key=lambda row: row[0])
+        boundaries = [list(row[1:]) for row in rows]
+
+        if len(self.page_boundary_cache) >= self.page_boundary_cache_size:
+            self.page_boundary_cache.pop(next(iter(self.page_boundary_cache)))
+        self.page_boundary_cache[cache_key] = (version, boundaries)
+        logger.debug("[_get_page_boundaries] rebuild, boundaries: {}", len(boundaries))
+        return boundaries
+
+    # endregion
+
     async def execute(self, stmt, note_type: str | None = None):
         # fixme: 这个方法不对，因为总是需要考虑调用点是否正确！
         try:
@@ -216,35 +826,51 @@ class NoteService(Service[Note]):
             result = await self.db.execute(stmt)
         return result
 
-    NotePreview = namedtuple("NotePreview", ["id", "title", "content"])
+    preview_length = 200  # 预览查询截取的正文长度（字符数）
+
+    def _preview_options(self) -> list:
+        """预览查询：只加载列表展示需要的列，正文由数据库截取开头 preview_length 个字符放到 note.preview
 
-    async def get_no_content_notes(self, note_type: str | None = None) -> List[NotePreview]:
-        stmt = select(Note.id, Note.title, Note.content)
+        注意，此时 note.content 没有加载，访问会触发懒加载（异步环境下会报错）
+        """
+        return [
+            load_only(Note.id, Note.title, Note.note_type, Note.created_at, Note.updated_at,
+                      Note.visit, Note.attachment_count),
+            with_expression(Note.preview, func.substr(Note.content, 1, self.preview_length)),
+        ]
+
+    async def get_no_content_notes(self, note_type: str | None = None) -> Sequence[Note]:
+        """所有笔记的预览（见 _preview_options），用于标题视图"""
+        stmt = select(Note).options(*self._preview_options()).order_by(Note.id)
         if note_type:
             stmt = stmt.where(Note.note_type == note_type)
         result = await self.db.execute(stmt)
-        rows = result.mappings().all()
-        note_previews = [self.__class__.NotePreview(**row) for row in rows]
-        return note_previews
+        return result.scalars().all()
 
     async def incr_visit(self, node_id: int) -> int:
-        """增加访问次数"""
-        # 数据库层面计算：visit = visit + 1
-        # 增加访问次数我不想 updated_at 修改，故更新时再改回去
-        stmt = (
-            update(Note)
-            .where(Note.id == node_id)
-            .values(visit=Note.visit + 1, updated_at=Note.updated_at)
-            .returning(Note.visit)
-        )
-        result = await self.db.execute(stmt)
-        await self.db.commit()
-        return result.scalar_one()
+        """增加访问次数（合并写入，见 visit_coalescer），返回增加后的访问次数"""
+        visit = await self.get_visit(node_id)  # 笔记不存在时抛出异常
+        self.visit_coalescer.submit(node_id, 1)
+        return visit + 1
 
     async def get_visit(self, node_id: int) -> int:
-        stmt = select(Note.visit).where(Note.id == node_id)
-        result = await self.db.execute(stmt)
-        return result.scalar_one()
+        """访问次数：数据库中的值 + 还没有写入的增量（见 get_visits）"""
+        return (await self.get_visits([node_id]))[node_id]
+
+    async def get_visits(self, note_ids: Sequence[int]) -> Dict[int, int]:
+        """一页笔记的访问次数 {note_id: visit}，一次查询（页面渲染时不要对每条笔记调用 get_visit）
+
+        数据库中的值 + 还没有写入的增量（peek）：当前会话的读快照可能早于已经写入的增量，
+        访问次数只增不减，所以取数据库中的值与写入后的值（visit_written）中大的那个，已经写入的增量就不会漏算或者重复计算
+        """
+        if not note_ids:
+            return {}
+        stmt = select(Note.id, Note.visit).where(Note.id.in_(note_ids))
+        result = (await self.db.execute(stmt)).all()
+        # 以下是同步代码，visit_written 和 peek 是同一时刻的状态
+        written = NoteService.visit_written
+        return {note_id: max(visit, written.get(note_id, visit)) + self.visit_coalescer.peek(note_id, 0)
+                for note_id, visit in result}
 
     async def get_notes(
             self,
@@ -252,17 +878,58 @@ class NoteService(Service[Note]):
             page: Annotated[int | None, "页号，None 代表不分页"] = 1,
             search_filter: Dict | None = None,
             no_content: bool = False,
-            to_paginate: bool = True
+            to_paginate: bool = True,
+            cursor: str | None = None,
+            preview: bool = False
     ) -> Sequence[Note]:
-        """在有过滤和分页的情况下获取 Note List"""
+        """在有过滤和分页的情况下获取 Note List（cursor 见 get_note_page，preview 见 _preview_options）"""
         # todo: 该方法亟待优化（很尴尬，虽然 web 和业务强相关，但是只要是代码，又怎么不需要理解和阅读，又怎么不是业务强相关呢）
         logger.debug("[get_notes] start")
         if not to_paginate:
             page = None
-        stmt = await self.build_filter_statement(page=page, search_filter=search_filter)
+        stmt = await self.build_filter_statement(page=page, search_filter=search_filter, cursor=cursor)
+        if preview:
+            stmt = stmt.options(*self._preview_options())
         note_type = None if not search_filter else search_filter.get("note_type", None)
         result = await self.execute(stmt, note_type=note_type)
-        return result.scalars().all()
+        notes = result.scalars().all()
+        # 向前翻页时是倒着查的，需要还原顺序
+        if cursor and (decoded := self._decode_cursor(cursor, (search_filter or {}).get("order_by", "-updated_at"))):
+            if decoded[1] == "prev":
+                notes = list(reversed(notes))
+        return notes
+
+    async def _get_note_keys(self, notes: Sequence[Note], order_by: str) -> dict[int, list]:
+        """笔记的游标键（数据库中的原值，见 _keyset_key_columns），一次查询"""
+        if not notes:
+            return {}
+        stmt = select(Note.id, *self._keyset_key_columns(order_by)).where(Note.id.in_([note.id for note in notes]))
+        result = await self.db.execute(stmt)
+        return {row[0]: list(row[1:]) for row in result}
+
+    NotePage = namedtuple("NotePage", ["notes", "prev_cursor", "next_cursor"])
+    """一页笔记 + 前后翻页的游标（不透明字符串，传给 get_note_page/get_notes 的 cursor 参数）"""
+
+    async def get_note_page(self,
+                            *,
+                            page: int = 1,
+                            search_filter: Dict | None = None,
+                            cursor: str | None = None,
+                            preview: bool = False) -> NotePage:
+        """获取一页笔记和前后翻页的游标
+
+        Details:
+            1. 有 cursor 时按游标翻页（keyset pagination），没有时按页号（跳页走稀疏页边界索引）
+            2. prev_cursor/next_cursor 只表示“从这一页往前/往后翻”，是否还有上一页/下一页需要调用方结合页号判断
+        """
+        notes = await self.get_notes(page=page, search_filter=search_filter, cursor=cursor, preview=preview)
+        if not notes:
+            return self.NotePage(notes, None, None)
+        order_by = (search_filter or {}).get("order_by", "-updated_at")
+        keys = await self._get_note_keys([notes[0], notes[-1]], order_by)
+        prev_cursor = self._encode_cursor(order_by, keys[notes[0].id], "prev")
+        next_cursor = self._encode_cursor(order_by, keys[notes[-1].id], "next")
+        return self.NotePage(notes, prev_cursor, next_cursor)
 
     async def get_titles(self) -> List[str]:
         try:
@@ -276,6 +943,7 @@ class NoteService(Service[Note]):
         """获得有附件的 Note"""
         logger.debug("[get_note_with_attachments] start")
         try:
+            await self._flush_pending_autosave(ident)
             stmt = select(Note).where(Note.id == ident)
             if selectinload_enable:
                 stmt = stmt.options(selectinload(Note.attachments))
@@ -288,10 +956,19 @@ class NoteService(Service[Note]):
             logger.error(e)
             return Err(str(e))
 
+    async def get_notes_with_attachment_count(self, **kwargs) -> List[Tuple[Note, int]]:
+        """get_notes + 每条笔记的附件数量（读取 note.attachment_count 冗余字段，只有一次查询），参数同 get_notes"""
+        notes = await self.get_notes(**kwargs)
+        return [(note, note.attachment_count) for note in notes]
+
     async def count_note(self, search_filter: Dict | None = None) -> Result[int, str]:
-        """在有过滤的情况下，统计 Note 数量"""
+        """在有过滤的情况下，统计 Note 数量（没有搜索内容时走 count_cache）"""
         logger.debug("[count_note] start")
         try:
+            cache_key = self._get_count_cache_key(search_filter)
+            if cache_key is not None and cache_key in NoteService.count_cache:
+                return Ok(NoteService.count_cache[cache_key])
+
             stmt = await self.build_filter_statement(page=None,
                                                      search_filter=search_filter,
                                                      select_field=func.count(Note.id))
@@ -301,6 +978,8 @@ class NoteService(Service[Note]):
             if not isinstance(count, int):
                 raise TypeError(f"{count} is not int")
             logger.debug("count_note: {}, search_filter: {}", count, search_filter)
+            if cache_key is not None:
+                NoteService.count_cache[cache_key] = count
             return Ok(count)
         except Exception as e:
             logger.error(e)
@@ -310,6 +989,344 @@ class NoteService(Service[Note]):
 class AttachmentService(Service[Attachment]):
     model = Attachment
 
+    # 附件挂到笔记上/从笔记上移除会影响 has_attachment 过滤的笔记计数（临时附件 note_id 为 NULL，不影响）
+
+    # region - blob store
+
+    # 附件内容存放在内容寻址存储中（utils/blob_store.py），attachment 表只记录 content_hash，
+    # 调用方仍然传入 content=bytes，读取请使用 read_content（旧数据的内容还在 attachment.content 中）
+
+    blob_gc_grace_seconds = 10 * 60  # 引用计数归零多久后删除文件
+    upload_chunk_size = 256 * 1024  # 流式上传每次读取/写入的字节数，即每个上传的内存占用上限
+    legacy_migration_batch_size = 20  # 旧数据迁移每批的附件数量（每批一个事务）
+
+    @staticmethod
+    async def _store_content(kwargs: Dict) -> Dict:
+        """把 kwargs 中的 content 写入内容寻址存储，替换为 content_hash"""
+        content = kwargs.get("content")
+        if content is None:
+            return kwargs
+        kwargs = dict(kwargs)
+        compress = blob_store.should_compress(kwargs.get("mimetype"), kwargs.get("filename"))
+        kwargs["content_hash"] = await asyncio.to_thread(blob_store.put, content, compress)
+        kwargs["content"] = None
+        kwargs["size"] = len(content)
+        return kwargs
+
+    async def _write_stream(self, read: Callable[[int], Awaitable[bytes]],
+                            mimetype: str | None, filename: str | None) -> tuple[str, int]:
+        """分块读取并写入内容寻址存储，返回 (content_hash, size)"""
+        writer = await asyncio.to_thread(blob_store.open_writer, blob_store.should_compress(mimetype, filename))
+        try:
+            while chunk := await read(self.upload_chunk_size):
+                await asyncio.to_thread(writer.write, chunk)
+            return await asyncio.to_thread(writer.commit)
+        finally:
+            await asyncio.to_thread(writer.abort)
+
+    async def create_from_stream(self, read: Callable[[int], Awaitable[bytes]], **kwargs) -> Result[Attachment, str]:
+        """流式创建附件：分块读取并写入内容寻址存储，size 和 content_hash 边写边算
+
+        :param read: 读取函数，如 UploadFile.read，返回空 bytes 表示读完
+        :param kwargs: 除 content/size 以外的字段
+        """
+        try:
+            content_hash, size = await self._write_stream(read, kwargs.get("mimetype"), kwargs.get("filename"))
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+        return await self.create(content_hash=content_hash, size=size, **kwargs)
+
+    async def bulk_create_from_streams(
+            self, files: Sequence[Tuple[Callable[[int], Awaitable[bytes]], Dict]]
+    ) -> Result[List[Result[int, str]], str]:
+        """批量流式创建附件：内容逐个写入存储，记录在一个事务中一次 INSERT（executemany）
+
+        :param files: [(read, kwargs), ...]，同 create_from_stream
+        :return: 每个文件的结果（Ok(附件 id) / Err(失败原因)），顺序与 files 一致；事务失败时返回 Err
+        """
+        statuses: List[Result[int, str]] = []
+        rows = []
+        for read, kwargs in files:
+            try:
+                content_hash, size = await self._write_stream(read, kwargs.get("mimetype"), kwargs.get("filename"))
+            except Exception as e:
+                logger.error("[bulk_create_from_streams] {} - {}", kwargs.get("filename"), e)
+                statuses.append(Err(str(e)))
+                continue
+            statuses.append(Ok(len(rows)))  # 先记下在 rows 中的下标，插入后换成 id
+            rows.append({**kwargs, "content_hash": content_hash, "size": size})
+        if not rows:
+            return Ok(statuses)
+
+        try:
+            stmt = insert(Attachment).returning(Attachment.id, sort_by_parameter_order=True)
+            ids = (await self.db.execute(stmt, rows)).scalars().all()
+            await self.db.commit()
+        except Exception as e:
+            logger.error(e)
+            await self.db.rollback()
+            return Err(str(e))
+
+        if any(row.get("note_id") is not None for row in rows):
+            NoteService.on_attachments_changed()
+        for row in rows:
+            if thumbnails.is_supported(row.get("mimetype")):
+                thumbnails.submit(row["content_hash"])
+        return Ok([Ok(ids[status.unwrap()]) if status.is_ok() else status for status in statuses])
+
+    async def create_from_upload(self, upload_id: str, content_hash: str | None = None,
+                                 **kwargs) -> Result[Attachment, str]:
+        """分块上传完成：校验整个文件的 hash，移入内容寻址存储并创建附件记录（见 utils/chunked_upload.py）
+
+        记录创建成功后才删除上传会话，失败时可以用同一个 upload_id 重试
+        :param content_hash: 客户端计算的 SHA-256，为 None 时不校验（只依赖分块校验）
+        :param kwargs: 覆盖会话中记录的字段，如 note_id
+        """
+        try:
+            content_hash, size, session = await asyncio.to_thread(chunked_uploads.finalize, upload_id, content_hash)
+        except (KeyError, ValueError) as e:
+            logger.warning("[create_from_upload] {} - {}", upload_id, e)
+            return Err(f"upload {upload_id} not found" if isinstance(e, KeyError) else str(e))
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+        fields = dict(filename=session.filename, mimetype=session.mimetype or "application/octet-stream",
+                      note_id=None, temporary_uuid=session.temporary_uuid)
+        result = await self.create(content_hash=content_hash, size=size, **{**fields, **kwargs})
+        if result.is_ok():
+            await asyncio.to_thread(chunked_uploads.discard, upload_id)
+        return result
+
+    AttachmentContent = namedtuple("AttachmentContent", ["content_hash", "size", "iter_range"])
+    """附件内容的元信息 + 读取函数 iter_range(start, length) -> Iterator[bytes]（同步迭代器，按需读取，不会一次读完）"""
+
+    async def _load_legacy_content(self, attachment: Attachment) -> bytes:
+        """旧数据的内容在 attachment.content 中，默认不加载（见 models.Attachment.content），这里按需单独查询"""
+        if "content" not in sa_inspect(attachment).unloaded:
+            return attachment.content
+        stmt = select(Attachment.content).where(Attachment.id == attachment.id)
+        return (await self.db.execute(stmt)).scalar_one()
+
+    async def open_content(self, attachment: Attachment, chunk_size: int = 64 * 1024) -> Result[AttachmentContent, str]:
+        """打开附件内容用于流式/分段读取（兼容还没有迁移的旧数据，旧数据的 hash 现算）"""
+        try:
+            if attachment.content_hash is None:
+                content = await self._load_legacy_content(attachment)
+                content_hash = await asyncio.to_thread(lambda: hashlib.sha256(content).hexdigest())
+                return Ok(self.AttachmentContent(content_hash, len(content),
+                                                 lambda start, length: iter([content[start:start + length]])))
+            content_hash = attachment.content_hash
+            size = await asyncio.to_thread(blob_store.size_of, content_hash)
+            return Ok(self.AttachmentContent(content_hash, size, lambda start, length: blob_store.iter_chunks(
+                content_hash, chunk_size=chunk_size, start=start, length=length)))
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
+    NoteArchive = namedtuple("NoteArchive", ["filename", "iter_chunks"])
+    """笔记附件压缩包：下载时的文件名 + 生成函数 iter_chunks() -> Iterator[bytes]（同步生成器，边压缩边输出）"""
+
+    async def open_note_archive(self, note_id: int, with_note: bool = False) -> Result[NoteArchive, str]:
+        """把笔记的所有附件打包为 ZIP（见 utils/zip_stream.py），with_note 为 True 时附带笔记正文（markdown）
+
+        附件内容在这里全部打开（blob 只读取大小，还没有迁移的旧数据会加载到内存中），压缩在迭代时进行
+        """
+        try:
+            note = (await self.db.execute(select(Note.title, Note.content, Note.updated_at)
+                                          .where(Note.id == note_id))).one_or_none()
+            if note is None:
+                return Err(f"Note {note_id} doesn't exist")
+            attachments = (await self.get_attachments_by_note_id(note_id)).unwrap()
+            contents = []
+            for attachment in attachments:
+                contents.append((attachment, (await self.open_content(attachment)).unwrap()))
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
+        # 文件名中不能出现的字符（Windows 最严格）
+        title = re.sub(r'[\\/:*?"<>|\r\n\t]', "_", note.title or "").strip() or f"note-{note_id}"
+
+        def iter_chunks() -> Iterator[bytes]:
+            zip_stream = ZipStream()
+            if with_note:
+                markdown = f"# {note.title}\n\n{note.content or ''}".encode("utf-8")
+                yield from zip_stream.add_bytes(f"{title}.md", markdown, date_time=note.updated_at)
+            for attachment, content in contents:
+                # 已经压缩过的格式（图片、音视频、压缩包等）使用存储模式，判断规则与 blob 存储的透明压缩一致
+                yield from zip_stream.add(attachment.filename, content.iter_range(0, content.size), content.size,
+                                          compress=blob_store.should_compress(attachment.mimetype, attachment.filename),
+                                          date_time=attachment.updated_at)
+            yield zip_stream.close()
+
+        return Ok(self.NoteArchive(f"{title}.zip", iter_chunks))
+
+    async def read_content(self, attachment: Attachment) -> Result[bytes, str]:
+        """读取附件内容（兼容还没有迁移的旧数据）"""
+        try:
+            if attachment.content_hash is None:
+                return Ok(await self._load_legacy_content(attachment))
+            return Ok(await asyncio.to_thread(blob_store.read, attachment.content_hash))
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
+    async def migrate_legacy_contents(self, batch_size: int | None = None) -> Result[int, str]:
+        """把旧数据 attachment.content 中的内容分批搬到内容寻址存储，返回本次迁移的数量
+
+        Details:
+            1. 每批一个事务：先写文件，再 UPDATE content_hash + 清空 content，中途退出不会丢数据，重新执行会从未迁移的继续
+            2. 按 id 游标推进，每批只读取 batch_size 个 BLOB
+        """
+        batch_size = batch_size or self.legacy_migration_batch_size
+        migrated = 0
+        last_id = 0
+        try:
+            while True:
+                stmt = (
+                    select(Attachment.id, Attachment.content, Attachment.mimetype, Attachment.filename)
+                    .where(Attachment.id > last_id, Attachment.content_hash.is_(None), Attachment.content.is_not(None))
+                    .order_by(Attachment.id)
+                    .limit(batch_size)
+                )
+                rows = (await self.db.execute(stmt)).all()
+                if not rows:
+                    break
+                for ident, content, mimetype, filename in rows:
+                    compress = blob_store.should_compress(mimetype, filename)
+                    content_hash = await asyncio.to_thread(blob_store.put, content, compress)
+                    await self.db.execute(update(Attachment).where(Attachment.id == ident)
+                                          .values(content_hash=content_hash, content=None, size=len(content)))
+                await self.db.commit()
+                migrated += len(rows)
+                last_id = rows[-1][0]
+                logger.info("[migrate_legacy_contents] migrated: {}, last_id: {}", migrated, last_id)
+            return Ok(migrated)
+        except Exception as e:
+            logger.error(e)
+            await self.db.rollback()
+            return Err(str(e))
+
+    async def storage_stats(self) -> Result[Dict, str]:
+        """存储统计，用于观察压缩效果和数据库瘦身情况
+
+        Returns:
+            blob_store: 内容寻址存储的统计（见 BlobStore.stats），其中 ratio = 磁盘占用 / 原始大小
+            legacy: 还没有迁移的旧数据（内容仍在 attachment.content 中）的数量和字节数
+            database: 数据库文件大小，free_bytes 为空闲页（VACUUM 可以回收）
+        """
+        try:
+            legacy_count, legacy_bytes = (await self.db.execute(
+                select(func.count(Attachment.id), func.coalesce(func.sum(func.length(Attachment.content)), 0))
+                .where(Attachment.content_hash.is_(None))
+            )).one()
+            page_size = (await self.db.execute(text("PRAGMA page_size"))).scalar()
+            page_count = (await self.db.execute(text("PRAGMA page_count"))).scalar()
+            freelist_count = (await self.db.execute(text("PRAGMA freelist_count"))).scalar()
+            return Ok({
+                "blob_store": await asyncio.to_thread(blob_store.stats),
+                "legacy": {"attachments": legacy_count, "bytes": legacy_bytes},
+                "database": {"bytes": page_size * page_count, "free_bytes": page_size * freelist_count},
+            })
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
+    async def collect_garbage_blobs(self, grace_seconds: float | None = None) -> Result[int, str]:
+        """删除引用计数归零超过宽限期的 blob，返回删除的数量
+
+        Details:
+            1. 先删文件再删记录：上传可能去重到一个引用计数为 0 的 blob 上，附件记录提交之前引用计数还是 0，
+               blob_store.collect 不会删除租约内（刚写入/去重过）的文件，这些 blob 的记录也保留
+            2. 文件删除之后又上传了相同的内容：会重新写入文件，附件记录提交后引用计数不再是 0，删除记录时再判断一次 ref_count
+        """
+        grace_seconds = self.blob_gc_grace_seconds if grace_seconds is None else grace_seconds
+        try:
+            deadline = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+            stmt = select(Blob.hash).where(Blob.ref_count == 0, Blob.updated_at <= deadline)
+            candidates = (await self.db.execute(stmt)).scalars().all()
+            hashes = [content_hash for content_hash in candidates
+                      if await asyncio.to_thread(blob_store.collect, content_hash)]
+            if not hashes:
+                return Ok(0)
+            await self.db.execute(delete(Blob).where(Blob.hash.in_(hashes), Blob.ref_count == 0))
+            await self.db.commit()
+            for content_hash in hashes:
+                await asyncio.to_thread(thumbnails.remove, content_hash)
+            logger.info("[collect_garbage_blobs] removed: {}", len(hashes))
+            return Ok(len(hashes))
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
+    # endregion
+
+    async def create(self, **kwargs) -> Result[Attachment, str]:
+        return await self._create_with(super().create, **kwargs)
+
+    async def create_returning(self, **kwargs) -> Result[Attachment, str]:
+        return await self._create_with(super().create_returning, **kwargs)
+
+    async def _create_with(self, create: Callable[..., Awaitable[Result[Attachment, str]]],
+                           **kwargs) -> Result[Attachment, str]:
+        content = kwargs.get("content")
+        try:
+            kwargs = await self._store_content(kwargs)
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+        result = await create(**kwargs)
+        if result.is_ok() and content is not None and not blob_store.exists(kwargs["content_hash"]):
+            # 极端情况：写入时内容已存在（没有重复写），但在插入记录前被垃圾回收删除了，补写一次
+            await asyncio.to_thread(blob_store.put, content,
+                                    blob_store.should_compress(kwargs.get("mimetype"), kwargs.get("filename")))
+        if result.is_ok() and kwargs.get("content_hash") and thumbnails.is_supported(kwargs.get("mimetype")):
+            thumbnails.submit(kwargs["content_hash"])  # 后台生成缩略图，不等待
+        if result.is_ok() and kwargs.get("note_id") is not None:
+            NoteService.on_attachments_changed()
+        return result
+
+    async def update(self, ident: int, **kwargs) -> Result[Attachment, str]:
+        return await self._update_with(super().update, ident, **kwargs)
+
+    async def update_returning(self, ident: int, **kwargs) -> Result[Attachment, str]:
+        return await self._update_with(super().update_returning, ident, **kwargs)
+
+    async def patch(self, ident: int, **kwargs) -> Result[Attachment, str]:
+        return await self._update_with(super().patch, ident, **kwargs)
+
+    async def _update_with(self, update_: Callable[..., Awaitable[Result[Attachment, str]]], ident: int,
+                           **kwargs) -> Result[Attachment, str]:
+        try:
+            kwargs = await self._store_content(kwargs)
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+        result = await update_(ident, **kwargs)
+        if result.is_ok() and "note_id" in kwargs:
+            NoteService.on_attachments_changed()
+        return result
+
+    async def delete(self, ident: int) -> Result[bool, str]:
+        result = await super().delete(ident)
+        if result.is_ok():
+            NoteService.on_attachments_changed()
+        return result
+
+    async def get(self, ident: int, with_content: bool = False) -> Result[Attachment, str]:
+        """R - 根据主键获取附件，默认不加载 content（BLOB），with_content 为 True 时一起加载"""
+        if not with_content:
+            return await super().get(ident)
+        try:
+            instance = await self.db.get(Attachment, ident, options=[undefer(Attachment.content)], populate_existing=True)
+            if instance is None:
+                return Err(f"{self.model.__name__} {ident} doesn't exist")
+            return Ok(instance)
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
     async def get_by_filename(self, ident: int, filename: str) -> Result[Attachment, str]:
         try:
             result = await self.db.execute(select(Attachment).filter(and_(
@@ -331,6 +1348,8 @@ class AttachmentService(Service[Attachment]):
             stmt = update(Attachment).where(Attachment.temporary_uuid == _uuid).values(**kwargs)
             result = await self.db.execute(stmt)
             await self.db.commit()
+            if "note_id" in kwargs:
+                NoteService.on_attachments_changed()
             return Ok(result.rowcount)  # noqa
         except Exception as e:
             logger.error(e)
@@ -358,6 +1377,28 @@ class AttachmentService(Service[Attachment]):
             logger.error(e)
             return Err(str(e))
 
+    @staticmethod
+    def build_count_by_note_ids_statement(note_ids: Sequence[int]):
+        """SELECT note_id, count(id) FROM attachment WHERE note_id IN (...) GROUP BY note_id（走 note_id 索引）"""
+        return (
+            select(Attachment.note_id, func.count(Attachment.id))
+            .where(Attachment.note_id.in_(note_ids))
+            .group_by(Attachment.note_id)
+        )
+
+    async def count_attachments(self, note_ids: Sequence[int]) -> Result[Dict[int, int], str]:
+        """批量统计附件数量（一条 GROUP BY 查询），返回 {note_id: count}，没有附件的 note_id 为 0"""
+        try:
+            counts = dict.fromkeys(note_ids, 0)
+            if not counts:
+                return Ok(counts)
+            result = await self.db.execute(self.build_count_by_note_ids_statement(list(counts)))
+            counts.update((note_id, count) for note_id, count in result.all())
+            return Ok(counts)
+        except Exception as e:
+            logger.error(e)
+            return Err(str(e))
+
     async def count_attachment_by_temporary_uuid(self, temporary_uuid: str) -> Result[int, str]:
         try:
             stmt = select(func.count(Attachment.id)).filter(Attachment.temporary_uuid == temporary_uuid)
@@ -369,9 +1410,12 @@ class AttachmentService(Service[Attachment]):
             logger.error(e)
             return Err(str(e))
 
-    async def get_attachments_by_note_id(self, note_id: int) -> Result[Sequence[Attachment], str]:
+    async def get_attachments_by_note_id(self, note_id: int, with_content: bool = False) -> Result[Sequence[Attachment], str]:
+        """笔记的所有附件，默认不加载 content（BLOB），with_content 为 True 时一起加载（导出等需要字节的场景）"""
         try:
             stmt = select(Attachment).filter(Attachment.note_id == note_id)
+            if with_content:
+                stmt = stmt.options(undefer(Attachment.content))
             result = await self.db.execute(stmt)
             attachments = result.scalars().all()
             logger.debug("[get_attachments_by_note_id] attachments: {}", attachments)
@@ -381,11 +1425,17 @@ class AttachmentService(Service[Attachment]):
             return Err(str(e))
 
 
+_MISSING = object()  # UserConfigService.get_value 区分没有待写入的值和待写入的值为 None
+
+
 class UserConfigService(Service[UserConfig]):
     model = UserConfig
 
     shared_cache = dict()  # service 委托层的好处，减少了数据库访问的次数（写入没有处理，似乎也没什么处理的必要）
 
+    value_coalescer = WriteCoalescer("user_config", flush=lambda values: UserConfigService._flush_values(values), delay=1)
+    """set_value 的合并写入 {key: value}，1 秒内的多次修改（连续翻页、切换选项）合并成一次写入"""
+
     # todo: 内存缓存可参考的三方库：https://lxblog.com/qianwen/share?shareId=02502627-7e8f-4724-a995-206c43310eaa
     # todo: 嵌入式 memcached
 
@@ -426,6 +1476,9 @@ class UserConfigService(Service[UserConfig]):
     async def get_value(self, key: str) -> Any | None:
         """唯一 read 入口函数"""
         if key not in UserConfigService.shared_cache:
+            pending = self.value_coalescer.peek(key, _MISSING)
+            if pending is not _MISSING:  # 还没有写入数据库
+                return pending
             config = await self._get_user_config()
             value = config.profile.get(key)
             logger.debug("[get_value] config.profile[{}]: {}", key, value)
@@ -439,18 +1492,23 @@ class UserConfigService(Service[UserConfig]):
             del UserConfigService.shared_cache[key]
 
     async def set_value(self, key: str, value):
-        """唯一 update 入口函数"""
+        """唯一 update 入口函数（缓存立即更新，数据库合并写入，见 value_coalescer）"""
         if await self.get_value(key) == value:
             logger.debug("[set_value] key={}, the value hasn't changed.)", key)
             return
-        self._clear_cache(key)
-        config = await self._get_user_config()
-        config.profile[key] = value
+        UserConfigService.shared_cache[key] = value
         logger.debug("[set_value] config.profile[{}]: {}", key, value)
-        # 显式标记 profile 字段已修改
-        flag_modified(config, "profile")
-        # SQLAlchemy 检测到变更，自动替换为 UPDATE 语句
-        await self.db.commit()
+        self.value_coalescer.submit(key, value)
+
+    @staticmethod
+    async def _flush_values(values: Dict[str, Any]):
+        async with UserConfigService() as service:
+            config = await service._get_user_config()
+            config.profile.update(values)
+            # 显式标记 profile 字段已修改
+            flag_modified(config, "profile")
+            # SQLAlchemy 检测到变更，自动替换为 UPDATE 语句
+            await service.db.commit()
 
     async def get_page_size(self):
         page_size = await self.get_value("page_size")
@@ -1,7 +1,7 @@
 import sys
 import tomllib
 from pathlib import Path
-from typing import List
+from typing import List, Dict
 
 import portpicker
 from pydantic_settings import BaseSettings
@@ -24,6 +24,10 @@ class DynamicSettings(BaseSettings):
     host: str
     version: str
     export_dir: str = "exports"
+    attachment_store_dir: str = "attachments"  # 附件内容寻址存储目录（见 utils/blob_store.py）
+    sqlite_profile: str = "read_heavy"  # sqlite 连接参数预设：read_heavy / durable（见 models.SQLITE_PROFILES）
+    sqlite_pragmas: Dict[str, int | str] = {}  # 覆盖预设中的单个参数，如 {"synchronous": "FULL"}
+    sqlite_read_connections: int = 4  # 只读连接池大小（写入只有一个连接，见 db_routing.py）
     prefix_import_values: List[str]
 
     @classmethod
@@ -1,12 +1,116 @@
+// 小于这个大小的文件一次性上传（多个文件一个请求），大于的走分块上传（可续传，见 utils/chunked_upload.py）
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const CHUNKED_UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024;  // 与后端 ChunkedUploadStore.max_size 一致
+const CHUNK_RETRY_NUM = 3;
+// 整个文件的 hash 需要把文件读进内存（SubtleCrypto 不支持增量计算），只对不太大的文件计算，大文件依赖分块 hash 校验
+const FILE_HASH_MAX_SIZE = 256 * 1024 * 1024;
+
+async function sha256Hex(blob) {
+    // SubtleCrypto 只在安全上下文（https、localhost）中可用，不可用时不校验
+    if (!(window.crypto && window.crypto.subtle)) return null;
+    const digest = await window.crypto.subtle.digest("SHA-256", await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, "0")).join("");
+}
+
+async function requestJson(url, options) {
+    const response = await fetch(url, options);
+    if (!response.ok) {
+        const error = new Error(`${response.status} ${await response.text()}`);
+        error.status = response.status;
+        throw error;
+    }
+    return response.json();
+}
+
+async function withRetry(func, retryNum) {
+    for (let i = 0; ; i++) {
+        try {
+            return await func();
+        } catch (error) {
+            // 4xx 是参数问题，重试也没用
+            if (i >= retryNum || (error.status >= 400 && error.status < 500)) throw error;
+            console.warn(`[withRetry] 第 ${i + 1} 次重试，原因：${error}`);
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** i));
+        }
+    }
+}
+
+/**
+ * 分块上传一个文件，upload_id 记录在 localStorage 中，上传中断（断网、刷新页面、重启程序）后重新拖入同一个文件会从断点继续
+ */
+async function uploadFileChunked(file, temporary_uuid) {
+    const storageKey = `nms_upload:${temporary_uuid}:${file.name}:${file.size}:${file.lastModified}`;
+    let upload = null;
+
+    const upload_id = localStorage.getItem(storageKey);
+    if (upload_id !== null) {
+        try {
+            upload = await requestJson(`/api/upload/chunked/${upload_id}`);
+            console.log(`[uploadFileChunked] 续传 ${file.name}，已上传 ${upload.received.length}/${upload.chunk_count}`);
+        } catch (error) {
+            console.log(`[uploadFileChunked] 会话 ${upload_id} 已失效，重新上传：${error}`);
+        }
+    }
+    if (upload === null) {
+        upload = await requestJson("/api/upload/chunked", {
+            method: "POST",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify({
+                filename: file.name, mimetype: file.type || null, size: file.size, temporary_uuid: temporary_uuid
+            })
+        });
+        localStorage.setItem(storageKey, upload.upload_id);
+    }
+
+    const received = new Set(upload.received);
+    for (let index = 0; index < upload.chunk_count; index++) {
+        if (received.has(index)) continue;
+        const start = index * upload.chunk_size;
+        const chunk = file.slice(start, Math.min(start + upload.chunk_size, file.size));
+        const chunkHash = await sha256Hex(chunk);
+        await withRetry(() => requestJson(`/api/upload/chunked/${upload.upload_id}/${index}`, {
+            method: "PUT",
+            headers: chunkHash === null ? {} : {"X-Chunk-Sha256": chunkHash},
+            body: chunk
+        }), CHUNK_RETRY_NUM);
+        console.log(`[uploadFileChunked] ${file.name} ${index + 1}/${upload.chunk_count}`);
+    }
+
+    const contentHash = file.size <= FILE_HASH_MAX_SIZE ? await sha256Hex(file) : null;
+    try {
+        const result = await withRetry(() => requestJson(`/api/upload/chunked/${upload.upload_id}/finalize`, {
+            method: "POST",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify({content_hash: contentHash})
+        }), CHUNK_RETRY_NUM);
+        localStorage.removeItem(storageKey);
+        return result;
+    } catch (error) {
+        // hash 不一致时服务端已经删除了会话，下次从头上传
+        if (error.status === 400) localStorage.removeItem(storageKey);
+        throw error;
+    }
+}
+
+async function uploadFilesAtOnce(files, temporary_uuid) {
+    // 创建 FormData 用于上传
+    const formData = new FormData();
+    files.forEach(file => formData.append("files", file));
+
+    // 发送 POST 请求到后端
+    return requestJson("/api/upload" + `?temporary_uuid=${temporary_uuid}`, {
+        method: "POST",
+        body: formData
+    });
+}
+
 function uploadFile(files, on_response_ok) {
     console.log(`[uploadFile] ${files}`)
 
     // 限制单个文件的上传大小（前端限制）
-    const maxMbNum = 10
-    const maxFileSize = maxMbNum * 1024 * 1024;
     for (const file of files) {
-        if (file.size > maxFileSize) {
-            alert(`文件大于 ${maxMbNum}MB，无法上传`)
+        if (file.size > CHUNKED_UPLOAD_MAX_SIZE) {
+            alert(`文件 ${file.name} 大于 ${CHUNKED_UPLOAD_MAX_SIZE / 1024 / 1024 / 1024}GB，无法上传`)
             return
         }
     }
@@ -21,23 +125,30 @@ function uploadFile(files, on_response_ok) {
         return;
     }
 
-    // 创建 FormData 用于上传
-    const formData = new FormData();
-    files.forEach(file => formData.append("files", file));
+    const smallFiles = files.filter(file => file.size <= CHUNKED_UPLOAD_THRESHOLD);
+    const largeFiles = files.filter(file => file.size > CHUNKED_UPLOAD_THRESHOLD);
 
-    let url = "/api/upload" + `?temporary_uuid=${temporary_uuid}`;
-
-    // 发送 POST 请求到后端
-    fetch(url, {
-        method: "POST",
-        body: formData
-    }).then(response => {
-        if (response.ok) {
+    (async () => {
+        if (smallFiles.length > 0) {
+            await uploadFilesAtOnce(smallFiles, temporary_uuid);
+        }
+        // 大文件逐个上传，一个文件失败不影响其他文件
+        const failed = [];
+        for (const file of largeFiles) {
+            try {
+                await uploadFileChunked(file, temporary_uuid);
+            } catch (error) {
+                console.error(`[uploadFile] ${file.name} 上传失败:`, error);
+                failed.push(`${file.name}（${error.message}）`);
+            }
+        }
+        if (failed.length > 0) {
+            alert(`以下文件上传失败，重新拖入可以继续上传：\n${failed.join("\n")}`);
+        }
+        if (failed.length < files.length) {
             on_response_ok();
-        } else {
-            alert("文件上传失败，response.ok !== true");
         }
-    }).catch(error => {
+    })().catch(error => {
         console.error("上传错误:", error);
         alert(`上传过程中发生错误，原因：${error}`);
     });
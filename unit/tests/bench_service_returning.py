@@ -0,0 +1,125 @@
+"""
+Service 模板的 RETURNING 快速路径（create_returning/update_returning/patch）与 create/update 的基准测试，10 万行的 note 表
+
+运行（需要在 unit 目录下；文件名不是 test_ 开头，pytest 不会收集）：
+
+    cd unit && python -m tests.bench_service_returning
+    cd unit && python -m tests.bench_service_returning --rows 100000 --rounds 500 --dir D:/tmp
+
+Details:
+    1. 直接测量 Service 模板的方法（_NoteTemplateService），不包括 NoteService 维护计数缓存等额外的查询
+    2. 每项操作统计平均执行的 SQL 语句数（before_cursor_execute + COMMIT），即与 sqlite 的往返次数；
+       与生产环境一样经过写队列（tests/conftest.py 的 TempDatabase），写入的 SAVEPOINT/RELEASE 也计算在内
+    3. 每次操作一个新的 Service（一个 session），与页面中的用法一致；随机选择笔记，避免只命中同一页缓存
+    4. update/patch (no-op)：写入与原值相同的标题，patch 不会修改任何行（updated_at、note_fts 触发器都不会变）
+
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, insert
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Database, Note, get_sqlite_pragmas
+from services import Service
+from tests.conftest import TempDatabase
+
+
+class _NoteTemplateService(Service[Note]):
+    model = Note
+
+
+def _summary(latencies: list, statements: int) -> str:
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    return (f"p50 {statistics.median(latencies):7.3f} ms  p95 {p95:7.3f} ms  "
+            f"SQL/次 {statements / len(latencies):4.1f}")
+
+
+async def _bench(db: Database, row_num: int, rounds: int) -> dict:
+    statements = [0]
+
+    def _on_execute(*_):
+        statements[0] += 1
+
+    for engine in (db.engine, db.read_engine):
+        event.listen(engine.sync_engine, "before_cursor_execute", _on_execute)
+        event.listen(engine.sync_engine, "commit", _on_execute)
+
+    session_maker = db.session_maker
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    batch_size = 10000
+    async with session_maker() as session:
+        for start in range(1, row_num + 1, batch_size):
+            await session.execute(insert(Note), [
+                dict(title=f"【标签{i % 5}】笔记{i}", content=f"第 {i} 条笔记 python 内容" * 5, note_type="default",
+                     created_at=base + timedelta(minutes=i), updated_at=base + timedelta(minutes=i))
+                for i in range(start, min(start + batch_size, row_num + 1))
+            ])
+        await session.commit()
+
+    async def create():
+        async with _NoteTemplateService() as service:
+            (await service.create(title="新笔记", content="内容")).unwrap()
+
+    async def create_returning():
+        async with _NoteTemplateService() as service:
+            (await service.create_returning(title="新笔记", content="内容")).unwrap()
+
+    def updating(method: str, same_value: bool = False):
+        async def run():
+            note_id = random.randint(1, row_num)
+            title = f"【标签{note_id % 5}】笔记{note_id}" if same_value else f"标题 {time.perf_counter()}"
+            async with _NoteTemplateService() as service:
+                (await getattr(service, method)(note_id, title=title)).unwrap()
+
+        return run
+
+    operations = {
+        "create": create,
+        "create_returning": create_returning,
+        "update": updating("update"),
+        "update_returning": updating("update_returning"),
+        "patch": updating("patch"),
+        "update (no-op)": updating("update", same_value=True),
+        "patch (no-op)": updating("patch", same_value=True),
+    }
+    for operation in operations.values():  # 预热（建立连接、编译语句缓存）
+        for _ in range(max(rounds // 10, 1)):
+            await operation()
+
+    result = {}
+    for name, operation in operations.items():
+        latencies = []
+        statements[0] = 0
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await operation()
+            latencies.append((time.perf_counter() - start) * 1000)
+        result[name] = (latencies, statements[0])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dir", default=None, help="数据库所在目录，默认系统临时目录")
+    parser.add_argument("--rows", type=int, default=100000, help="note 表的行数")
+    parser.add_argument("--rounds", type=int, default=500, help="每项测量的次数")
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        database = TempDatabase(os.path.join(directory, "bench_returning.db"), get_sqlite_pragmas("read_heavy"))
+        result = database.run(lambda db: _bench(db, args.rows, args.rounds))
+        print(f"[note: {args.rows} 行]")
+        for name, (latencies, statements) in result.items():
+            print(f"    {name:<20} {_summary(latencies, statements)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+sqlite 连接参数预设（models.SQLITE_PROFILES）的基准测试：列表页、保存笔记，以及保存的同时读列表页的延迟
+
+运行（需要在 unit 目录下；文件名不是 test_ 开头，pytest 不会收集）：
+
+    cd unit && python -m tests.bench_sqlite_profile
+    cd unit && python -m tests.bench_sqlite_profile --dir D:/tmp --notes 20000  # 放在真实磁盘上（/tmp 可能是内存文件系统，fsync 几乎没有开销）
+
+Details:
+    1. 每个预设使用一个新建的临时数据库（alembic upgrade head + 批量插入笔记），互不影响（journal_mode 会写入数据库文件）
+    2. 列表：随机页号的 get_note_page（preview）+ count_note，每次清空计数缓存，保证真的发出查询
+    3. 保存：update 一条笔记的正文（一次提交，包括 note_fts 触发器）
+    4. 读写并发：后台不停保存，同时测量列表的延迟（DELETE 日志模式下读会被写阻塞，WAL 不会）
+
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Database, Note, SQLITE_PROFILES, get_sqlite_pragmas
+from services import NoteService, UserConfigService
+from tests.conftest import TempDatabase
+
+DEFAULT_FILTER = {"note_type": "default"}
+
+
+def _summary(latencies: list) -> str:
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    return f"p50 {statistics.median(latencies):7.2f} ms  p95 {p95:7.2f} ms"
+
+
+async def _timed(func) -> float:
+    start = time.perf_counter()
+    await func()
+    return (time.perf_counter() - start) * 1000
+
+
+async def _list_page(page_num: int):
+    NoteService.clear_count_cache()
+    async with NoteService() as service:
+        await service.get_note_page(page=random.randint(1, page_num), search_filter=DEFAULT_FILTER, preview=True)
+        await service.count_note(DEFAULT_FILTER)
+
+
+async def _save_note(note_num: int):
+    async with NoteService() as service:
+        note_id = random.randint(1, note_num)
+        (await service.update(note_id, content=f"第 {note_id} 条笔记，保存于 {time.time()}" * 20)).unwrap()
+
+
+async def _bench_profile(db: Database, note_num: int, rounds: int) -> dict:
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    async with db.session_maker() as session:
+        await session.execute(insert(Note), [
+            dict(title=f"【标签{i % 5}】笔记{i}", content=f"第 {i} 条笔记 python 内容" * 20, note_type="default",
+                 created_at=base + timedelta(minutes=i), updated_at=base + timedelta(minutes=i))
+            for i in range(1, note_num + 1)
+        ])
+        await session.commit()
+    UserConfigService.shared_cache.clear()
+    async with UserConfigService() as service:
+        await service.init_user_config()
+    page_num = note_num // 20
+
+    for _ in range(max(rounds // 10, 1)):  # 预热（建立连接、编译语句缓存、填充页缓存）
+        await _list_page(page_num)
+        await _save_note(note_num)
+    result = {
+        "list": [await _timed(lambda: _list_page(page_num)) for _ in range(rounds)],
+        "save": [await _timed(lambda: _save_note(note_num)) for _ in range(rounds)],
+    }
+
+    stop = asyncio.Event()
+
+    async def writer():
+        while not stop.is_set():
+            await _save_note(note_num)
+
+    writer_task = asyncio.create_task(writer())
+    result["list (while saving)"] = [await _timed(lambda: _list_page(page_num)) for _ in range(rounds)]
+    stop.set()
+    await writer_task
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dir", default=None, help="数据库所在目录，默认系统临时目录")
+    parser.add_argument("--notes", type=int, default=5000, help="笔记数量")
+    parser.add_argument("--rounds", type=int, default=200, help="每项测量的次数")
+    parser.add_argument("--profiles", nargs="*", default=list(SQLITE_PROFILES), help="要测量的预设")
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for profile in args.profiles:
+            database = TempDatabase(os.path.join(directory, f"bench_{profile}.db"), get_sqlite_pragmas(profile))
+            result = database.run(lambda db: _bench_profile(db, args.notes, args.rounds))
+            print(f"[{profile}] {get_sqlite_pragmas(profile) or '（sqlite 默认值）'}")
+            for name, latencies in result.items():
+                print(f"    {name:<20} {_summary(latencies)}")
+
+
+if __name__ == "__main__":
+    main()
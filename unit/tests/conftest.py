@@ -0,0 +1,96 @@
+"""
+测试公用的 fixture：临时数据库，连接方式与生产环境相同（models.Database：写队列 + 只读连接池），不会碰 notes.db
+
+使用案例：
+
+    def test_xxx(database):
+        async def main(db: Database):
+            async with NoteService() as service:  # services 的 AsyncSessionLocal 指向临时数据库
+                ...
+            async with db.session_maker() as session:
+                ...
+
+        database.run(main)
+
+Details:
+    1. database 是模块级的 fixture，同一个测试文件中的测试共用一个数据库（alembic upgrade head 建表）
+    2. run 在新的事件循环中执行，每次新建一组连接，结束时关闭；期间 models（db_session）、services 和 utils.cleanup 的
+       AsyncSessionLocal 指向临时数据库
+    3. run 开始和结束时清空类属性缓存（计数缓存、页边界索引、写入后的访问次数、用户配置、fts_enabled），结束前写入所有合并写入
+       （WriteCoalescer.flush_all），否则会留到之后的事件循环，写进 notes.db
+    4. 基准测试（bench_*.py，不经过 pytest）直接使用 TempDatabase
+
+"""
+import asyncio
+import importlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+import pytest
+from alembic import command
+from alembic.config import Config
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+import models
+from models import Database, sqlite_pragmas
+from services import NoteService, UserConfigService
+from utils import WriteCoalescer, blob_store
+
+cleanup_module = importlib.import_module("utils.cleanup")  # utils.cleanup 这个名字被 cleanup 实例占用了，从 sys.modules 取模块
+
+T = TypeVar("T")
+
+
+def reset_class_caches():
+    """Service 的类属性缓存是进程级的，换数据库之后都要清空"""
+    NoteService.fts_enabled = None
+    NoteService.clear_count_cache()
+    NoteService.page_boundary_cache.clear()
+    NoteService.visit_written.clear()
+    UserConfigService.shared_cache.clear()
+
+
+class TempDatabase:
+    """alembic upgrade head 建好表的数据库文件"""
+
+    read_connections = 2
+
+    def __init__(self, path: str, pragmas: Dict[str, Any] | None = None):
+        self.path = path
+        self.url = f"sqlite+aiosqlite:///{path}"
+        self.pragmas = sqlite_pragmas if pragmas is None else pragmas
+        config = Config("alembic.ini")
+        config.set_main_option("sqlalchemy.url", f"sqlite:///{path}")
+        command.upgrade(config, "head")
+
+    def run(self, func: Callable[[Database], Awaitable[T]]) -> T:
+        """在新的事件循环中执行 await func(db)"""
+        return asyncio.run(self._run(func))
+
+    async def _run(self, func: Callable[[Database], Awaitable[T]]) -> T:
+        db = Database(self.url, self.pragmas, self.read_connections)
+        original = (models.AsyncSessionLocal, services.AsyncSessionLocal, cleanup_module.AsyncSessionLocal)
+        models.AsyncSessionLocal = services.AsyncSessionLocal = cleanup_module.AsyncSessionLocal = db.session_maker
+        reset_class_caches()
+        try:
+            return await func(db)
+        finally:
+            try:
+                await WriteCoalescer.flush_all()
+            finally:
+                models.AsyncSessionLocal, services.AsyncSessionLocal, cleanup_module.AsyncSessionLocal = original
+                reset_class_caches()
+                await db.close()
+
+
+@pytest.fixture(scope="module")
+def database():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        original = (blob_store.root, blob_store._leases)  # noqa
+        blob_store.root, blob_store._leases = Path(tmpdir) / "attachments", {}
+        try:
+            yield TempDatabase(os.path.join(tmpdir, "test.db"))
+        finally:
+            blob_store.root, blob_store._leases = original
@@ -0,0 +1,62 @@
+"""
+自动保存（NoteService.update_later）在工作单元中读取/修改笔记的测试：写入待写入的自动保存时不能提交调用方的工作单元，
+调用方已经写入（持有写连接）时不能等待自己
+
+运行（需要在 unit 目录下）：
+
+    cd unit && python -m pytest tests/test_autosave.py
+
+"""
+import asyncio
+
+from sqlalchemy import func, select
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Database, Note, Tag, db_session
+from services import NoteService
+
+
+async def _main(db: Database):
+    async with NoteService() as service:
+        note_id = (await service.create(title="笔记", content="")).unwrap().id
+
+    async def count_tags() -> int:
+        async with db.session_maker() as session:
+            return (await session.execute(select(func.count()).select_from(Tag))).scalar()
+
+    # 1. 工作单元中有未提交的修改：get 读到自动保存的内容，工作单元的修改不会被提交
+    NoteService.update_later(note_id, content="自动保存1")
+    try:
+        async with db_session() as session:
+            note = await session.get(Note, note_id)  # 开始读快照，note 在会话中
+            assert note.content == ""
+            session.add(Tag(name="未提交", note_id=note_id))
+            async with NoteService() as service:
+                assert (await service.get(note_id)).unwrap().content == "自动保存1"
+            assert await count_tags() == 0
+            raise RuntimeError("回滚")
+    except RuntimeError:
+        pass
+    assert await count_tags() == 0
+    async with NoteService() as service:
+        assert (await service.get(note_id)).unwrap().content == "自动保存1"
+
+    # 2. 工作单元已经写入：待写入的自动保存在当前事务中写入，不等待写连接
+    db.write_queue.acquire_timeout = 1
+    NoteService.update_later(note_id, content="自动保存2")
+
+    async def write_then_get():
+        async with db_session() as session:
+            session.add(Tag(name="已提交", note_id=note_id))
+            await session.flush()
+            async with NoteService() as service:
+                assert (await service.get(note_id)).unwrap().content == "自动保存2"
+
+    await asyncio.wait_for(write_then_get(), 5)
+    assert await count_tags() == 1
+    async with db.session_maker() as session:
+        assert (await session.get(Note, note_id)).content == "自动保存2"
+
+
+def test_autosave_in_unit_of_work(database):
+    database.run(_main)
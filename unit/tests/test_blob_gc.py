@@ -0,0 +1,91 @@
+"""
+blob 清理（AttachmentService.collect_garbage_blobs）与上传并发的测试：上传去重到一个引用计数为 0 的 blob 上时，
+附件记录提交之前清理流程不能删除这个 blob
+
+运行（需要在 unit 目录下）：
+
+    cd unit && python -m pytest tests/test_blob_gc.py
+
+"""
+import asyncio
+import hashlib
+import os
+
+from sqlalchemy import select, update
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Attachment, Blob, Database
+from services import AttachmentService
+from utils import blob_store
+
+CONTENT = os.urandom(64 * 1024)
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+def _reader(content: bytes):
+    chunks = [content[i:i + 16 * 1024] for i in range(0, len(content), 16 * 1024)]
+
+    async def read(_: int) -> bytes:
+        await asyncio.sleep(0)  # 让出事件循环，和清理流程交替执行
+        return chunks.pop(0) if chunks else b""
+
+    return read
+
+
+async def _make_unreferenced(session_maker):
+    """上传后删除附件：blob 引用计数为 0，并且已经过了宽限期（租约也已经过期）"""
+    async with AttachmentService() as service:
+        attachment = (await service.create_from_stream(_reader(CONTENT), filename="a.bin",
+                                                       mimetype="application/octet-stream")).unwrap()
+        (await service.delete(attachment.id)).unwrap()
+    async with session_maker() as session:
+        await session.execute(update(Blob).where(Blob.hash == CONTENT_HASH).values(updated_at=Blob.created_at))
+        await session.commit()
+    blob_store._leases.clear()  # noqa: 模拟租约过期
+
+
+async def _main(db: Database):
+    session_maker = db.session_maker
+    # 1. 确定的交错顺序：去重写入 -> 清理 -> 提交附件记录
+    await _make_unreferenced(session_maker)
+    async with AttachmentService() as service:
+        content_hash, size = await service._write_stream(_reader(CONTENT), "application/octet-stream", "b.bin")
+        assert content_hash == CONTENT_HASH
+        async with AttachmentService() as gc_service:
+            assert (await gc_service.collect_garbage_blobs(grace_seconds=0)).unwrap() == 0
+        (await service.create(content_hash=content_hash, size=size, filename="b.bin",
+                              mimetype="application/octet-stream")).unwrap()
+    assert blob_store.exists(CONTENT_HASH)
+
+    # 2. 并发：同一内容反复上传/删除，同时不停地清理；最后每个附件的内容都还在，引用计数与附件数一致
+    stop = asyncio.Event()
+
+    async def collect_forever():
+        while not stop.is_set():
+            async with AttachmentService() as gc_service:
+                (await gc_service.collect_garbage_blobs(grace_seconds=0)).unwrap()
+            blob_store._leases.clear()  # noqa: 租约随时过期，只靠清理流程自身的判断
+            await asyncio.sleep(0)
+
+    async def upload(i: int):
+        async with AttachmentService() as service:
+            attachment = (await service.create_from_stream(_reader(CONTENT), filename=f"{i}.bin",
+                                                           mimetype="application/octet-stream")).unwrap()
+            if i % 2:
+                (await service.delete(attachment.id)).unwrap()
+
+    collector = asyncio.create_task(collect_forever())
+    await asyncio.gather(*[upload(i) for i in range(20)])
+    stop.set()
+    await collector
+
+    async with session_maker() as session:
+        hashes = (await session.execute(select(Attachment.content_hash))).scalars().all()
+        ref_count = (await session.execute(select(Blob.ref_count).where(Blob.hash == CONTENT_HASH))).scalar()
+    assert hashes and ref_count == len(hashes)
+    for content_hash in hashes:
+        assert blob_store.read(content_hash) == CONTENT
+
+
+def test_upload_and_gc_concurrently(database):
+    database.run(_main)
@@ -0,0 +1,78 @@
+"""
+分块上传会话测试：乱序/重复上传分块、进程重启后续传（只依赖磁盘状态）、hash 校验、finalize 可重试
+
+运行（需要在 unit 目录下）：
+
+    cd unit && python -m pytest tests/test_chunked_upload.py
+
+"""
+import hashlib
+import os
+
+import pytest
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from utils import BlobStore, ChunkedUploadStore
+
+CHUNK_SIZE = ChunkedUploadStore.min_chunk_size
+CONTENT = os.urandom(CHUNK_SIZE * 3 + 123)
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ChunkedUploadStore(BlobStore(tmp_path))
+
+
+def _chunk(index: int) -> bytes:
+    return CONTENT[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+
+
+def test_resume_after_restart(uploads, tmp_path):
+    session = uploads.init("record.m4a", "audio/mp4", len(CONTENT), CHUNK_SIZE, "uuid-1")
+    assert session.chunk_count == 4
+    uploads.write_chunk(session.upload_id, 2, _chunk(2))
+    uploads.write_chunk(session.upload_id, 0, _chunk(0), hashlib.sha256(_chunk(0)).hexdigest())
+    uploads.write_chunk(session.upload_id, 0, _chunk(0))  # 重试同一个分块是幂等的
+
+    restarted = ChunkedUploadStore(BlobStore(tmp_path))  # 新实例只能从磁盘恢复状态
+    session = restarted.load(session.upload_id)
+    assert session.received == {0, 2}
+    with pytest.raises(ValueError):
+        restarted.finalize(session.upload_id, CONTENT_HASH)
+
+    for index in set(range(session.chunk_count)) - session.received:
+        restarted.write_chunk(session.upload_id, index, _chunk(index))
+    content_hash, size, session = restarted.finalize(session.upload_id, CONTENT_HASH)
+    assert (content_hash, size, session.temporary_uuid) == (CONTENT_HASH, len(CONTENT), "uuid-1")
+    assert restarted.store.read(content_hash) == CONTENT
+    # 创建附件记录失败时可以重试 finalize
+    assert restarted.finalize(session.upload_id, CONTENT_HASH)[0] == CONTENT_HASH
+
+    restarted.discard(session.upload_id)
+    with pytest.raises(KeyError):
+        restarted.load(session.upload_id)
+
+
+def test_invalid_chunks_are_rejected(uploads):
+    session = uploads.init("a.zip", "application/zip", len(CONTENT), CHUNK_SIZE)
+    with pytest.raises(ValueError):
+        uploads.write_chunk(session.upload_id, 1, _chunk(1)[:-1])  # 只有最后一个分块可以不足 chunk_size
+    with pytest.raises(ValueError):
+        uploads.write_chunk(session.upload_id, 4, b"")
+    with pytest.raises(ValueError):
+        uploads.write_chunk(session.upload_id, 0, _chunk(0), "0" * 64)
+    with pytest.raises(KeyError):
+        uploads.load("../" + session.upload_id)
+    assert uploads.load(session.upload_id).received == set()
+
+
+def test_hash_mismatch_discards_session(uploads):
+    session = uploads.init("a.zip", "application/zip", len(CONTENT), CHUNK_SIZE)
+    for index in range(session.chunk_count):
+        uploads.write_chunk(session.upload_id, index, _chunk(index))
+    with pytest.raises(ValueError):
+        uploads.finalize(session.upload_id, "0" * 64)
+    with pytest.raises(KeyError):
+        uploads.load(session.upload_id)
+    assert not uploads.store.exists(CONTENT_HASH)
@@ -0,0 +1,112 @@
+"""
+读写分离（db_routing.py）测试：并发写入组提交、同一批中回滚的会话不影响其他会话、写入前的查询走只读连接，
+以及嵌套写入：同一个任务中复用写连接，持有写连接时等待子任务写入立即报错（不会等到超时）
+
+运行（需要在 unit 目录下）：
+
+    cd unit && python -m pytest tests/test_db_routing.py
+
+"""
+import asyncio
+
+from sqlalchemy import event, text
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Database, Note
+from services import NoteService
+
+NOTE_NUM = 30
+
+
+async def _main(db: Database):
+    session_maker, write_queue = db.session_maker, db.write_queue
+    batches = []
+    event.listen(db.engine.sync_engine, "commit", lambda conn: batches.append(1))
+
+    async with NoteService() as service:
+        ids = [(await service.create(title=f"笔记{i}", content="")).unwrap().id for i in range(NOTE_NUM)]
+    assert len(batches) == NOTE_NUM  # 没有并发时每个会话单独提交
+
+    async def save(note_id: int) -> bool:
+        async with NoteService() as service:
+            return (await service.update(note_id, content=f"内容{note_id}")).is_ok()
+
+    async def save_then_rollback():
+        async with session_maker() as session:
+            session.add(Note(title="回滚", content=""))
+            await session.flush()
+            await session.rollback()
+
+    batches.clear()
+    results = await asyncio.gather(*[save(note_id) for note_id in ids], save_then_rollback())
+    assert all(results[:NOTE_NUM])
+    assert len(batches) < NOTE_NUM  # 组提交
+
+    async with session_maker() as session:
+        assert (await session.execute(text("SELECT count(*) FROM note WHERE content LIKE '内容%'"))).scalar() == NOTE_NUM
+        assert (await session.execute(text("SELECT count(*) FROM note WHERE title = '回滚'"))).scalar() == 0
+        # 写入前的查询走只读连接，写入后走写连接
+        assert session.sync_session.get_bind() is db.read_engine.sync_engine
+        await session.execute(text("UPDATE note SET title = '已修改' WHERE id = :id"), dict(id=ids[0]))
+        assert session.sync_session.get_bind() is not db.read_engine.sync_engine
+        await session.commit()
+    async with NoteService() as service:
+        assert (await service.get(ids[0])).unwrap().title == "已修改"
+
+    # 嵌套写入：外层会话已写入、未提交时，同一个任务中的内层会话复用写连接上的事务，而不是等待自己释放写连接
+    async def nested_write(outer_commit: bool):
+        async with session_maker() as outer:
+            await outer.execute(text("UPDATE note SET title = '外层' WHERE id = :id"), dict(id=ids[1]))
+            async with NoteService() as service:
+                assert (await service.update(ids[2], title="内层")).is_ok()
+                # 内层回滚只影响自己的 SAVEPOINT
+                async with session_maker() as inner:
+                    await inner.execute(text("UPDATE note SET title = '内层回滚' WHERE id = :id"), dict(id=ids[3]))
+                    await inner.rollback()
+            if outer_commit:
+                await outer.commit()
+            else:
+                await outer.rollback()
+
+    write_queue.acquire_timeout = 1
+    await asyncio.wait_for(nested_write(outer_commit=False), 5)
+    async with session_maker() as session:
+        titles = (await session.execute(text("SELECT title FROM note WHERE id IN (:a, :b, :c) ORDER BY id"),
+                                        dict(a=ids[1], b=ids[2], c=ids[3]))).scalars().all()
+        assert titles == ["笔记1", "笔记2", "笔记3"]  # 外层回滚时内层的写入一并回滚
+    await asyncio.wait_for(nested_write(outer_commit=True), 5)
+    async with session_maker() as session:
+        titles = (await session.execute(text("SELECT title FROM note WHERE id IN (:a, :b, :c) ORDER BY id"),
+                                        dict(a=ids[1], b=ids[2], c=ids[3]))).scalars().all()
+        assert titles == ["外层", "内层", "笔记3"]
+    # 写连接已经释放，其他会话可以正常写入
+    async with NoteService() as service:
+        assert (await service.update(ids[3], title="之后")).is_ok()
+
+    # 跨任务的嵌套写入：外层持有写连接时等待子任务（gather/create_task）写入，子任务立即报错，而不是等到 acquire_timeout
+    async def child_write(title: str):
+        async with session_maker() as session:
+            await session.execute(text("UPDATE note SET title = :title WHERE id = :id"), dict(title=title, id=ids[4]))
+            await session.commit()
+
+    async def cross_task_write():
+        async with session_maker() as outer:
+            await outer.execute(text("UPDATE note SET title = '外层' WHERE id = :id"), dict(id=ids[1]))
+            results = await asyncio.gather(child_write("gather"), asyncio.create_task(child_write("create_task")),
+                                           return_exceptions=True)
+            await outer.commit()
+        return results
+
+    write_queue.acquire_timeout = 30
+    results = await asyncio.wait_for(cross_task_write(), 5)
+    assert all(isinstance(result, RuntimeError) and "子任务" in str(result) for result in results), results
+    # 外层提交之后，子任务可以正常写入
+    await asyncio.wait_for(asyncio.create_task(child_write("之后")), 5)
+    async with session_maker() as session:
+        titles = (await session.execute(text("SELECT title FROM note WHERE id IN (:a, :b) ORDER BY id"),
+                                        dict(a=ids[1], b=ids[4]))).scalars().all()
+        assert titles == ["外层", "之后"]
+
+
+def test_group_commit(database):
+    database.run(_main)
@@ -0,0 +1,105 @@
+"""
+附件 content（BLOB）延迟加载测试：列出附件、加载笔记的附件、清理临时附件（分批 DELETE ... RETURNING）都不应该读取 content
+
+运行（需要在 unit 目录下）：
+
+    cd unit && python -m pytest tests/test_deferred_content.py
+
+"""
+import re
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import event, insert, update
+from sqlalchemy import inspect as sa_inspect
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Attachment, Database
+from services import NoteService, AttachmentService
+from utils import cleanup
+
+ATTACHMENT_NUM = 1000
+CONTENT = b"x" * 4096
+
+_SELECT_CONTENT_PATTERN = re.compile(r"\battachment\.content\b", re.IGNORECASE)
+
+
+def _run(database, func):
+    """在测试数据库上执行 func(captured)，captured 为执行过程中发出的 SELECT/DELETE 语句"""
+    captured = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):  # noqa
+        if statement.lstrip().upper().startswith(("SELECT", "DELETE")):
+            captured.append(statement)
+
+    async def main(db: Database):
+        for engine in (db.engine, db.read_engine):
+            event.listen(engine.sync_engine, "before_cursor_execute", _capture)
+        return await func(captured)
+
+    return database.run(main)
+
+
+@pytest.fixture(scope="module")
+def note_id(database):
+    async def seed(_):
+        async with NoteService() as service:
+            note = (await service.create(title="附件很多的笔记", content="...")).unwrap()
+        async with AttachmentService() as service:
+            # 旧数据：内容还在 attachment.content 中；另外一半是临时附件（note_id 为 NULL，已过期）
+            await service.db.execute(insert(Attachment), [
+                dict(filename=f"{i}.bin", content=CONTENT, mimetype="application/octet-stream", size=len(CONTENT),
+                     note_id=note.id if i % 2 else None, temporary_uuid=None if i % 2 else "expired")
+                for i in range(ATTACHMENT_NUM * 2)
+            ])
+            await service.db.execute(update(Attachment).where(Attachment.note_id.is_(None))
+                                     .values(created_at=datetime(2000, 1, 1, tzinfo=timezone.utc)))
+            await service.db.commit()
+        return note.id
+
+    return _run(database, seed)
+
+
+def _assert_content_not_read(captured, attachments):
+    assert captured, "没有捕获到任何查询"
+    selects_content = [statement for statement in captured if _SELECT_CONTENT_PATTERN.search(statement)]
+    assert not selects_content, f"查询读取了 attachment.content：{selects_content}"
+    assert all("content" in sa_inspect(attachment).unloaded for attachment in attachments)
+
+
+def test_listing_attachments_does_not_read_content(database, note_id):
+    async def func(captured):
+        async with AttachmentService() as service:
+            attachments = (await service.get_attachments_by_note_id(note_id)).unwrap()
+        async with NoteService() as service:
+            note = (await service.get_note_with_attachments(note_id)).unwrap()
+        assert len(attachments) == len(note.attachments) == ATTACHMENT_NUM
+        _assert_content_not_read(captured, [*attachments, *note.attachments])
+
+    _run(database, func)
+
+
+def test_cleanup_does_not_read_content(database, note_id, monkeypatch):
+    monkeypatch.setattr(cleanup, "batch_size", 300)
+
+    async def func(captured):
+        assert await cleanup.cleanup_now() == ATTACHMENT_NUM
+        assert await cleanup.cleanup_now() == 0
+        deletes = [statement for statement in captured if statement.lstrip().upper().startswith("DELETE")]
+        assert len(deletes) == 4 + 1  # 1000 条分 4 批（最后一批不足 300 条即结束），第二次清理只执行一次
+        assert all("RETURNING" in statement.upper() for statement in deletes)
+        _assert_content_not_read(captured, [])
+
+    _run(database, func)
+
+
+def test_content_is_loaded_on_demand(database, note_id):
+    async def func(captured):
+        async with AttachmentService() as service:
+            attachment = (await service.get_attachments_by_note_id(note_id)).unwrap()[0]
+            with pytest.raises(Exception):
+                _ = attachment.content  # raiseload：不允许隐式加载
+            assert (await service.read_content(attachment)).unwrap() == CONTENT
+            assert (await service.get(attachment.id, with_content=True)).unwrap().content == CONTENT
+
+    _run(database, func)
@@ -0,0 +1,94 @@
+"""
+游标翻页（NoteService.get_note_page）测试：向后翻到最后一页、再向前翻回第一页，以及按页号跳页，
+每种方式取到的笔记都要恰好覆盖全部笔记一次，并且顺序与 ORDER BY 一致
+
+运行（需要在 unit 目录下）：
+
+    cd unit && python -m pytest tests/test_keyset_paging.py
+
+Details:
+    1. 时间字段混合两种存储格式：utcnow() 写入的毫秒文本和 python 写入的微秒文本，并且有大量相同的时间（只能靠 id 区分）
+    2. 只检查返回的行，查询计划见 test_query_plan.py
+
+"""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, text
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Database, Note
+from services import NoteService, UserConfigService
+
+NOTE_NUM = 57
+PAGE_SIZE = 6
+
+
+async def _seed(session_maker):
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    async with session_maker() as session:
+        await session.execute(insert(Note), [
+            dict(title=f"笔记{i}", content="", note_type="default",
+                 created_at=base + timedelta(seconds=i // 4), updated_at=base + timedelta(seconds=i // 3))
+            for i in range(1, NOTE_NUM + 1)
+        ])
+        # 与 utcnow() 相同的毫秒格式，且每 5 条共用一个时间
+        await session.execute(text(
+            "UPDATE note SET updated_at = STRFTIME('%Y-%m-%d %H:%M:%f', '2026-01-01', '+' || (id / 5) || ' seconds'), "
+            "created_at = STRFTIME('%Y-%m-%d %H:%M:%f', '2026-01-01', '+' || (id / 4) || ' seconds') "
+            "WHERE id % 2 = 0"
+        ))
+        await session.commit()
+
+
+async def _expected_ids(session_maker, order_by: str) -> list:
+    column, direction = order_by.lstrip("-"), "DESC" if order_by.startswith("-") else "ASC"
+    async with session_maker() as session:
+        result = await session.execute(text(f"SELECT id FROM note ORDER BY {column} {direction}, id {direction}"))
+        return [row[0] for row in result]
+
+
+async def _walk(order_by: str, page_num: int) -> tuple[list, list, list]:
+    """(向后翻, 向前翻, 按页号跳页) 得到的 id"""
+    search_filter = {"note_type": "default", "order_by": order_by}
+    async with NoteService() as service:
+        forward, pages = [], []
+        note_page = await service.get_note_page(page=1, search_filter=search_filter)
+        while note_page.notes:
+            pages.append(note_page)
+            forward.extend(note.id for note in note_page.notes)
+            assert len(forward) <= NOTE_NUM, "向后翻页重复了"  # 出错时游标会原地打转，不加限制会死循环
+            note_page = await service.get_note_page(search_filter=search_filter, cursor=note_page.next_cursor)
+
+        backward = [note.id for note in pages[-1].notes]
+        note_page = pages[-1]
+        while note_page.notes:
+            note_page = await service.get_note_page(search_filter=search_filter, cursor=note_page.prev_cursor)
+            backward = [note.id for note in note_page.notes] + backward
+            assert len(backward) <= NOTE_NUM, "向前翻页重复了"
+
+        jumped = []
+        for page in range(page_num, 0, -1):  # 倒着跳，先建好后面的页边界
+            jumped = [note.id for note in await service.get_notes(page=page, search_filter=search_filter)] + jumped
+    return forward, backward, jumped
+
+
+async def _main(db: Database):
+    await _seed(db.session_maker)
+    async with UserConfigService() as user_config_service:
+        await user_config_service.init_user_config()
+        await user_config_service.set_value("page_size", PAGE_SIZE)
+    page_num = (NOTE_NUM + PAGE_SIZE - 1) // PAGE_SIZE
+    for order_by in ["-updated_at", "updated_at", "-created_at", "created_at", "-id", "id"]:
+        expected = await _expected_ids(db.session_maker, order_by)
+        forward, backward, jumped = await _walk(order_by, page_num)
+        assert forward == expected, order_by
+        assert backward == expected, order_by
+        assert jumped == expected, order_by
+
+
+def test_walk_every_page(database):
+    NoteService.page_boundary_stride = 2  # 让跳页用上页边界
+    try:
+        database.run(_main)
+    finally:
+        NoteService.page_boundary_stride = 10
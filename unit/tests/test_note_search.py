@@ -0,0 +1,98 @@
+"""
+笔记搜索（note_fts + tokenizer.py）测试：走全文索引的结果与整个搜索内容的 LIKE 子串搜索一致，
+包括拉丁字母的单词中间（如 thon 命中 python）、多个词的先后顺序、% 和 _ 按字面匹配，以及不走全文索引时的结果
+
+运行（需要在 unit 目录下）：
+
+    cd unit && python -m pytest tests/test_note_search.py
+
+"""
+from sqlalchemy import insert, text, or_
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Database, Note
+from services import NoteService, UserConfigService
+
+NOTES = [
+    ("Python 入门", "学习 python 的第一天"),
+    ("Jython", "在 JVM 上运行"),
+    ("【抖音】直播", "抖音直播带货"),
+    ("echo only", "shell 命令"),  # `hon` 只能跨过两个单词拼出来，不应命中
+    ("抖音 音乐", "两个词"),  # `抖音乐` 同理
+    ("100%_done", "特殊字符"),
+    ("杂项", "PyThOn 大小写"),
+]
+
+QUERIES = ["thon", "pyth", "ytho", "hon", "python 入门", "入门 python", "python 的", "抖音乐", "音直播", "JVM", "py",
+           "0%_", "%", "p", "音"]
+
+
+async def _main(db: Database):
+    session_maker = db.session_maker
+    async with session_maker() as session:
+        await session.execute(insert(Note), [dict(title=title, content=content, note_type="default")
+                                              for title, content in NOTES])
+        await session.commit()
+    async with UserConfigService() as user_config_service:
+        await user_config_service.init_user_config()
+
+    async def like_ids(search_content: str) -> set:
+        async with session_maker() as session:
+            condition = or_(Note.title.contains(search_content, autoescape=True),
+                            Note.content.contains(search_content, autoescape=True))
+            return set((await session.execute(Note.__table__.select().with_only_columns(Note.id)
+                                              .where(condition))).scalars())
+
+    async def search_ids(search_content: str) -> set:
+        async with NoteService() as service:
+            condition = await service.build_search_condition(search_content)
+            ids = set((await service.db.execute(Note.__table__.select().with_only_columns(Note.id)
+                                                .where(condition))).scalars())
+            hits = (await service.search_notes(search_content, page_size=100)).unwrap()
+            assert {hit.note.id for hit in hits} == ids, search_content
+            return ids
+
+    for query in QUERIES:
+        assert await search_ids(query) == await like_ids(query), query
+    assert await search_ids("thon") == {1, 2, 7}
+    assert await search_ids("hon") == {1, 2, 7}
+    assert await search_ids("python 入门") == {1} and await search_ids("入门 python") == set()
+
+    # 不走全文索引（sqlite 不支持 FTS5）时结果相同
+    NoteService.fts_enabled = False
+    try:
+        for query in QUERIES:
+            assert await search_ids(query) == await like_ids(query), query
+    finally:
+        NoteService.fts_enabled = None
+
+    # 分页：逐页取完与 count_note 一致，且不重复
+    async with NoteService() as service:
+        search_filter = {"note_type": "default", "search_content": "thon"}
+        total = (await service.count_note(search_filter)).unwrap()
+        paged = [hit.note.id for page in range(1, total + 2)
+                 for hit in (await service.search_notes("thon", page=page, page_size=1,
+                                                        search_filter=search_filter)).unwrap()]
+        assert total == 3 and sorted(paged) == [1, 2, 7]
+
+    # contentless 表：修改、删除笔记后旧的词不再命中，新的词能搜到
+    async with NoteService() as service:
+        (await service.update(2, title="Jruby", content="")).unwrap()
+        (await service.delete(1)).unwrap()
+    assert await search_ids("thon") == {7}
+    assert await search_ids("ruby") == {2}
+
+    # 重建索引后结果不变
+    async with NoteService() as service:
+        assert (await service.rebuild_search_index()).unwrap() == len(NOTES) - 1
+    for query in QUERIES:
+        assert await search_ids(query) == await like_ids(query), query
+
+    # contentless 表没有 note_fts_content 影子表，即不再存一份分词后的文本
+    async with session_maker() as session:
+        stmt = text("SELECT count(*) FROM sqlite_master WHERE name = 'note_fts_content'")
+        assert (await session.execute(stmt)).scalar() == 0
+
+
+def test_substring_search(database):
+    database.run(_main)
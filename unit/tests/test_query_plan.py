@@ -0,0 +1,220 @@
+"""
+查询计划回归测试：NoteService/AttachmentService 发出的每一条语句都执行一次 EXPLAIN QUERY PLAN，
+出现全表扫描（SCAN <table>）或者临时 B-tree 排序（USE TEMP B-TREE）就失败
+
+运行（需要在 unit 目录下，models.py 按相对路径读取 alembic.ini）：
+
+    cd unit && python -m pytest tests/test_query_plan.py
+
+Details:
+    1. 使用临时数据库（tests/conftest.py 的 database），连接方式与生产环境相同（写连接 + 只读连接），不会碰 notes.db
+    2. 本来就需要读整张表的方法（如标题视图、生成标签）放在 FULL_SCAN_ALLOWED 中，并写明原因
+    3. 新增查询方法时，请在 build_workload 中补充调用
+
+"""
+import re
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple, Callable, Awaitable
+
+import pytest
+from sqlalchemy import event, insert
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Note, Attachment, Database
+from services import NoteService, AttachmentService, UserConfigService
+from tokenizer import register_sqlite_functions
+from utils import WriteCoalescer, cleanup
+
+FULL_SCAN_ALLOWED = {
+    "get_titles": "生成标签需要扫描所有标题",
+    "get_no_content_notes": "标题视图列出全部笔记",
+    "list_all": "语义即列出全部记录",
+    "count_note(search_content=单字)": "分词器无法回答的查询退回 LIKE",
+    "rebuild_search_index": "按新分词器重建整个索引",
+    "user_config.set_value": "user_config 只有一行（没有登录系统）",
+}
+"""label -> 原因"""
+
+COALESCED_WRITES = ["incr_visit", "update_later", "user_config.set_value"]
+"""合并写入（WriteCoalescer）的方法，build_workload 中用 flushed 包装，在 label 内写入"""
+
+_TEMP_SORT_PATTERN = re.compile(r"USE TEMP B-TREE")
+
+
+def _is_bad_plan(detail: str, tables: set) -> bool:
+    """SCAN 用户表（不含虚拟表、子查询、sqlite_master）或者临时 B-tree 排序"""
+    if _TEMP_SORT_PATTERN.search(detail):
+        return True
+    match = re.match(r"SCAN (\w+)", detail)
+    return match is not None and match.group(1) in tables and "VIRTUAL TABLE" not in detail
+
+
+def build_workload() -> List[Tuple[str, Callable[[], Awaitable]]]:
+    """(label, 调用) 列表，label 用于定位语句的来源"""
+
+    async def with_note_service(func):
+        async with NoteService() as service:
+            return await func(service)
+
+    async def with_attachment_service(func):
+        async with AttachmentService() as service:
+            return await func(service)
+
+    default = {"note_type": "default"}
+
+    async def walk_pages(service: NoteService):
+        note_page = await service.get_note_page(page=1, search_filter=default, preview=True)
+        note_page = await service.get_note_page(page=2, search_filter=default, cursor=note_page.next_cursor)
+        await service.get_note_page(page=1, search_filter=default, cursor=note_page.prev_cursor)
+
+    async def with_user_config_service(func):
+        async with UserConfigService() as service:
+            return await func(service)
+
+    def note(func):
+        return lambda: with_note_service(func)
+
+    def flushed(call, coalescer: WriteCoalescer):
+        """合并写入的方法：在 label 内写入，UPDATE 语句也要检查"""
+
+        async def wrapper():
+            await call()
+            await coalescer.flush()
+
+        return wrapper
+
+    async def update_later():
+        NoteService.update_later(6, content="自动保存")  # 不等待写入，由 flushed 写入
+
+    def attachment(func):
+        return lambda: with_attachment_service(func)
+
+    return [
+        ("get", note(lambda s: s.get(1))),
+        ("create", note(lambda s: s.create(title="new", content="new"))),
+        ("update", note(lambda s: s.update(2, title="changed", note_type="hyperlink"))),
+        ("delete", note(lambda s: s.delete(3))),
+        ("incr_visit", flushed(note(lambda s: s.incr_visit(4)), NoteService.visit_coalescer)),
+        ("update_later", flushed(update_later, NoteService.autosave_coalescer)),
+        ("user_config.set_value", flushed(lambda: with_user_config_service(lambda s: s.set_value("page_size", 7)),
+                                          UserConfigService.value_coalescer)),
+        ("get_visit", note(lambda s: s.get_visit(4))),
+        ("get_visits", note(lambda s: s.get_visits([4, 5, 6]))),
+        ("get_notes", note(lambda s: s.get_notes(page=1, search_filter=default))),
+        ("get_notes(created_at)", note(lambda s: s.get_notes(page=1, search_filter={**default, "order_by": "-created_at"}))),
+        ("get_notes(page=25)", note(lambda s: s.get_notes(page=25, search_filter=default))),
+        ("get_notes(has_attachment)", note(lambda s: s.get_notes(page=1, search_filter={**default, "has_attachment": True}))),
+        ("get_note_page(cursor)", note(walk_pages)),
+        ("get_notes_with_attachment_count", note(lambda s: s.get_notes_with_attachment_count(page=1, search_filter=default))),
+        ("count_note", note(lambda s: s.count_note(default))),
+        ("count_note(has_attachment)", note(lambda s: s.count_note({**default, "has_attachment": False}))),
+        ("count_note(search_content)", note(lambda s: s.count_note({**default, "search_content": "笔记"}))),
+        ("count_note(search_content=单字)", note(lambda s: s.count_note({**default, "search_content": "笔"}))),
+        ("search_notes", note(lambda s: s.search_notes("笔记 python", page_size=10))),
+        ("search_notes(page=2, has_attachment)", note(lambda s: s.search_notes(
+            "笔记 python", page=2, search_filter={**default, "has_attachment": True}))),
+        ("search_notes(order_by)", note(lambda s: s.search_notes(
+            "笔记 python", search_filter={**default, "order_by": "-created_at"}))),
+        ("get_note_with_attachments", note(lambda s: s.get_note_with_attachments(1))),
+        ("get_no_content_notes", note(lambda s: s.get_no_content_notes())),
+        ("get_titles", note(lambda s: s.get_titles())),
+        ("list_all", note(lambda s: s.list_all())),
+        ("rebuild_search_index", note(lambda s: s.rebuild_search_index())),
+        ("attachment.get_by_filename", attachment(lambda s: s.get_by_filename(1, "a.txt"))),
+        ("attachment.create", attachment(lambda s: s.create(filename="b.txt", content=b"b", mimetype="text/plain",
+                                                              size=1, temporary_uuid="uuid-1"))),
+        ("attachment.count_attachment_by_temporary_uuid", attachment(lambda s: s.count_attachment_by_temporary_uuid("uuid-1"))),
+        ("attachment.update_by_temporary_uuid", attachment(lambda s: s.update_by_temporary_uuid("uuid-1", note_id=5))),
+        ("attachment.count_attachment", attachment(lambda s: s.count_attachment(5))),
+        ("attachment.count_attachments", attachment(lambda s: s.count_attachments([1, 5, 6]))),
+        ("attachment.get_attachments_by_note_id", attachment(lambda s: s.get_attachments_by_note_id(5))),
+        ("attachment.migrate_legacy_contents", attachment(lambda s: s.migrate_legacy_contents(batch_size=30))),
+        ("attachment.delete", attachment(lambda s: s.delete(1))),
+        ("attachment.collect_garbage_blobs", attachment(lambda s: s.collect_garbage_blobs(grace_seconds=0))),
+        ("cleanup.cleanup_now", lambda: cleanup.cleanup_now()),
+    ]
+
+
+async def _seed(session_maker):
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    async with session_maker() as session:
+        await session.execute(insert(Note), [
+            dict(title=f"【标签{i % 5}】笔记{i}", content=f"第 {i} 条笔记 python 内容" * 5,
+                 note_type="default" if i % 4 else "hyperlink",
+                 created_at=base + timedelta(minutes=i), updated_at=base + timedelta(minutes=i // 2))
+            for i in range(1, 301)
+        ])
+        await session.execute(insert(Attachment), [
+            dict(filename="a.txt", content=b"a", mimetype="text/plain", size=1, note_id=i)
+            for i in range(1, 301, 3)
+        ])
+        await session.commit()
+
+
+def _run_workload(database) -> List[Tuple[str, str, tuple]]:
+    """执行 workload，返回 [(label, statement, parameters), ...]"""
+    captured = []
+    current = {"label": None}
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):  # noqa
+        if current["label"] is not None:
+            if executemany:  # 计划与参数值无关，取第一组
+                parameters = parameters[0]
+            captured.append((current["label"], statement, tuple(parameters or ())))
+
+    async def main(db: Database):
+        for engine in (db.engine, db.read_engine):
+            event.listen(engine.sync_engine, "before_cursor_execute", _capture)
+        await _seed(db.session_maker)
+        async with UserConfigService() as user_config_service:
+            await user_config_service.init_user_config()
+            await user_config_service.set_value("page_size", 6)
+        await UserConfigService.value_coalescer.flush()
+        for label, call in build_workload():
+            current["label"] = label
+            await call()
+            current["label"] = None
+
+    NoteService.page_boundary_stride = 2  # 让 page=25 能用上页边界索引
+    try:
+        database.run(main)
+    finally:
+        NoteService.page_boundary_stride = 10
+    return captured
+
+
+@pytest.fixture(scope="module")
+def query_plans(database):
+    captured = _run_workload(database)
+    conn = sqlite3.connect(database.path)
+    register_sqlite_functions(conn)
+    tables = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")}
+    plans = []
+    for label, statement, parameters in captured:
+        if not re.match(r"\s*(SELECT|UPDATE|DELETE|INSERT|WITH)\b", statement, re.IGNORECASE):
+            continue
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        plans.append((label, statement, [row[-1] for row in rows if _is_bad_plan(row[-1], tables)]))
+    conn.close()
+    return plans
+
+
+def test_workload_is_captured(query_plans):
+    labels = {label for label, _, _ in query_plans}
+    missing = [label for label, _ in build_workload() if label not in labels]
+    assert not missing, f"这些调用没有发出任何语句（可能被缓存了）：{missing}"
+    updates = {label for label, statement, _ in query_plans if statement.lstrip().upper().startswith("UPDATE")}
+    missing = [label for label in COALESCED_WRITES if label not in updates]
+    assert not missing, f"这些合并写入的 UPDATE 没有在 label 内执行：{missing}"
+
+
+def test_no_full_scan_or_temp_sort(query_plans):
+    failures = []
+    for label, statement, bad in query_plans:
+        if label in FULL_SCAN_ALLOWED:
+            continue
+        if bad:
+            failures.append(f"[{label}] {bad}\n    {statement}")
+    assert not failures, "\n".join(failures)
@@ -0,0 +1,71 @@
+"""
+访问次数（NoteService.incr_visit/get_visits，合并写入）测试：读快照早于已经写入的增量时不漏算、写入过程中不重复计算，
+工作单元已经写入（持有写连接）时读取不会与等待写连接的 flush 互相等待
+
+运行（需要在 unit 目录下）：
+
+    cd unit && python -m pytest tests/test_visits.py
+
+"""
+import asyncio
+
+from sqlalchemy import text
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from models import Database, Note, db_session
+from services import NoteService
+
+
+async def _incr_visits(note_id: int, times: int):
+    async with NoteService() as service:
+        for _ in range(times):
+            await service.incr_visit(note_id)
+
+
+async def _main(db: Database):
+    coalescer = NoteService.visit_coalescer
+    async with NoteService() as service:
+        note_id = (await service.create(title="笔记", content="")).unwrap().id
+
+    # 1. 读快照在写入之前开始：数据库中还是旧值，写入后的值（visit_written）补上已经写入的增量
+    async with db_session() as session:
+        assert (await session.get(Note, note_id)).visit == 0  # 开始读快照
+        await asyncio.create_task(_incr_visits(note_id, 3))  # 子任务：单独的会话
+        await coalescer.flush()
+        await asyncio.create_task(_incr_visits(note_id, 2))  # 还没有写入
+        async with NoteService() as service:
+            assert await service.get_visit(note_id) == 5
+
+    # 2. 写入过程中反复读取：每次都是新的读快照，与 flush 交错
+    async def read_while_flushing():
+        for i in range(20):
+            await _incr_visits(note_id, 1)
+            flush = asyncio.create_task(coalescer.flush())
+            for _ in range(5):
+                async with NoteService() as service:
+                    assert await service.get_visit(note_id) == 5 + i + 1
+                await asyncio.sleep(0)
+            await flush
+
+    await read_while_flushing()
+
+    # 3. 工作单元持有写连接时，flush 在等待写连接；读取不等待 flush
+    db.write_queue.acquire_timeout = 1
+
+    async def read_while_holding_writer():
+        async with db_session() as session:
+            await session.execute(text("UPDATE note SET title = '已修改' WHERE id = :id"), dict(id=note_id))
+            await _incr_visits(note_id, 1)
+            flush = asyncio.create_task(coalescer.flush())
+            await asyncio.sleep(0.01)
+            async with NoteService() as service:
+                assert await service.get_visit(note_id) == 26
+        await flush
+
+    await asyncio.wait_for(read_while_holding_writer(), 5)
+    async with db.session_maker() as session:
+        assert (await session.get(Note, note_id)).visit == 26
+
+
+def test_visits(database):
+    database.run(_main)
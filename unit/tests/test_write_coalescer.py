@@ -0,0 +1,73 @@
+"""
+写入合并（utils/write_coalescer.py）测试：同一行的写入合并、持续写入时延迟有上限、达到 max_pending 立即写入、flush_all，
+以及写入过程中（mark_written 前后）读到的“数据库 + 增量”不会重复计算
+
+运行（需要在 unit 目录下）：
+
+    cd unit && python -m pytest tests/test_write_coalescer.py
+
+"""
+import asyncio
+import operator
+import time
+
+import services  # noqa: 需要先于 utils 导入，否则会循环导入
+from utils import WriteCoalescer
+
+
+async def _main():
+    flushed = []
+
+    async def flush(values: dict):
+        flushed.append((time.perf_counter() - start, dict(values)))
+
+    coalescer = WriteCoalescer("test", flush=flush, merge=operator.add, delay=0.2, max_pending=3)
+    start = time.perf_counter()
+
+    # 持续写入同一行：合并，但不会因为一直有新的写入而无限推迟
+    for _ in range(6):
+        coalescer.submit("a", 1)
+        assert coalescer.peek("a") is not None
+        await asyncio.sleep(0.1)
+    assert flushed and flushed[0][0] < 0.2 + 0.1
+    assert sum(values["a"] for _, values in flushed) + coalescer.peek("a", 0) == 6
+
+    # 达到 max_pending 立即写入
+    await coalescer.flush()
+    flushed.clear()
+    coalescer.submit("x", 1)
+    coalescer.submit("y", 1)
+    assert await coalescer.submit("z", 1) == 3
+    assert flushed[0][1] == {"x": 1, "y": 1, "z": 1}
+
+    # 退出时写入所有实例的待写入行（只留下这个测试的实例，services 的实例会写进 notes.db）
+    coalescer.submit("b", 2)
+    instances, WriteCoalescer.instances = WriteCoalescer.instances, [coalescer]
+    try:
+        await WriteCoalescer.flush_all()
+    finally:
+        WriteCoalescer.instances = instances
+    assert flushed[-1][1] == {"b": 2} and coalescer.peek("b") is None
+    WriteCoalescer.instances.remove(coalescer)
+
+    # 写入已经执行、flush 还没有返回时读取：mark_written 之后 peek 不再合并正在写入的增量，不会重复计算
+    database = {"visit": 0}
+
+    async def slow_flush(deltas: dict):
+        await asyncio.sleep(0.01)
+        database["visit"] += deltas["visit"]  # 写入
+        visits.mark_written()
+        await asyncio.sleep(0.01)  # 提交
+
+    visits = WriteCoalescer("test.visit", flush=slow_flush, merge=operator.add, delay=0.005)
+    for i in range(50):
+        visits.submit("visit", 1)
+        assert database["visit"] + visits.peek("visit", 0) == i + 1
+        await asyncio.sleep(0.004)
+    await visits.flush()
+    assert database["visit"] == 50
+    WriteCoalescer.instances.remove(visits)
+
+
+def test_write_coalescer():
+    asyncio.run(_main())
@@ -0,0 +1,132 @@
+"""
+笔记全文搜索的分词器
+
+sqlite 自带的 unicode61 分词器按空白和标点切分，中文整段会被当成一个 token（如 `【抖音】xxx`），
+trigram 分词器又要求查询至少 3 个字符，而中文搜索词常常只有两个字，所以分词放在 Python 层做：
+
+1. 建索引时：note 表上的触发器调用 sqlite 自定义函数 nms_tokenize(text)，写入 note_fts 的是分好词、空格分隔的文本
+2. 查询时：NoteService 调用 get_tokenizer().build_match_query(...) 生成 FTS5 MATCH 表达式
+
+两处必须使用同一个分词器，所以切换分词器（use_tokenizer）之后，需要立即执行 NoteService.rebuild_search_index() 重建索引。
+note_fts 是 contentless 表（不存原文），触发器删除旧索引时也要用同一个分词器重新分词，分词结果对不上会删不干净。
+
+注意，nms_tokenize 是在每个连接建立时注册的（见 models.py 和 migrations/env.py），
+用其他工具（如 DB Browser）直接修改 note 表会因为找不到该函数而失败。
+
+"""
+import re
+from abc import ABC, abstractmethod
+from typing import List, Dict
+
+# 中日韩统一表意文字（含扩展 A、兼容区）+ 日文假名 + 韩文音节
+_CJK_CHARS = r"㐀-䶿一-鿿豈-﫿぀-ヿ가-힯"
+_RUN_PATTERN = re.compile(rf"(?P<cjk>[{_CJK_CHARS}]+)|(?P<word>(?:(?![{_CJK_CHARS}])\w)+)")
+
+
+class Tokenizer(ABC):
+    """分词器基类，子类需要保证 tokenize 的结果是确定的（同样的输入得到同样的输出）"""
+    name: str
+
+    @abstractmethod
+    def tokenize(self, text: str) -> List[str]:
+        """建索引时使用，返回 token 列表"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def build_match_query(self, text: str) -> str | None:
+        """查询时使用，返回 FTS5 MATCH 表达式，返回 None 代表索引无法回答该查询（调用方需要退回 LIKE）
+
+        MATCH 只用来筛选候选：包含 text 的笔记一定要命中，命中的笔记调用方再用 LIKE 复核（见 NoteService.build_search_condition）
+        """
+        raise NotImplementedError
+
+    def highlight_terms(self, text: str) -> List[str]:
+        """查询时使用，返回需要在原文中定位/高亮的词（小写），用于生成摘要和高亮区间"""
+        return [term.lower() for term in (text or "").split()]
+
+
+class CjkNgramTokenizer(Tokenizer):
+    """中文连续段和拉丁字母/数字连续段（转小写）都切成 n-gram
+
+    Details:
+        1. `【抖音】Python入门` -> ["抖音", "py", "yt", "th", "ho", "on", "入门"]（n=2）
+        2. `抖音直播` -> ["抖音", "音直", "直播"]（n=2），查询 `音直播` 时生成短语 "音直 直播"，即子串匹配
+        3. 拉丁字母同样是任意子串匹配（与原先的 LIKE '%thon%' 一致），而不只是单词前缀
+        4. 短于 n 个字符的段（如单个汉字、单个字母）索引回答不了，不放进 MATCH 表达式；所有段都短于 n 个字符时返回 None
+        5. MATCH 只是必要条件：短语可能跨过两段的边界误命中（如 `echo only` 命中 `hon`），也不管各段的先后顺序和中间的字符，
+           调用方需要用 LIKE 复核整个搜索内容
+
+    """
+
+    def __init__(self, n: int = 2):
+        if n < 2:
+            raise ValueError(f"n must be >= 2, got {n}")
+        self.n = n
+        self.name = f"cjk_{n}gram"
+
+    def _ngrams(self, run: str) -> List[str]:
+        if len(run) <= self.n:
+            return [run]
+        return [run[i:i + self.n] for i in range(len(run) - self.n + 1)]
+
+    def tokenize(self, text: str) -> List[str]:
+        tokens = []
+        for match in _RUN_PATTERN.finditer(text or ""):
+            tokens.extend(self._ngrams(match.group().lower()))
+        return tokens
+
+    def build_match_query(self, text: str) -> str | None:
+        terms = []
+        for match in _RUN_PATTERN.finditer(text or ""):
+            run = match.group().lower()
+            if len(run) < self.n:
+                continue
+            # 连续的 n-gram 组成短语，短语要求 token 位置相邻，等价于子串匹配
+            terms.append('"{}"'.format(" ".join(self._ngrams(run))))
+        if not terms:
+            return None
+        # 空格分隔即 AND
+        return " ".join(terms)
+
+    def highlight_terms(self, text: str) -> List[str]:
+        terms = []
+        for match in _RUN_PATTERN.finditer(text or ""):
+            term = match.group("cjk") or match.group("word").lower()
+            if term not in terms:
+                terms.append(term)
+        return terms
+
+
+_tokenizers: Dict[str, Tokenizer] = {}
+_current_tokenizer_name: str | None = None
+
+
+def register_tokenizer(tokenizer: Tokenizer) -> None:
+    _tokenizers[tokenizer.name] = tokenizer
+
+
+def use_tokenizer(name: str) -> None:
+    """切换当前分词器（切换后需要重建 note_fts 索引）"""
+    global _current_tokenizer_name
+    if name not in _tokenizers:
+        raise KeyError(f"tokenizer {name} doesn't exist")
+    _current_tokenizer_name = name
+
+
+def get_tokenizer() -> Tokenizer:
+    return _tokenizers[_current_tokenizer_name]
+
+
+def tokenize_to_text(text: str | None) -> str:
+    """sqlite 自定义函数 nms_tokenize 的实现"""
+    return " ".join(get_tokenizer().tokenize(text or ""))
+
+
+def register_sqlite_functions(dbapi_connection) -> None:
+    """在 sqlite 连接上注册分词函数（sqlite3 和 SQLAlchemy 的 aiosqlite 适配连接都有 create_function）"""
+    dbapi_connection.create_function("nms_tokenize", 1, tokenize_to_text, deterministic=True)
+
+
+register_tokenizer(CjkNgramTokenizer(2))
+register_tokenizer(CjkNgramTokenizer(3))
+use_tokenizer("cjk_2gram")
@@ -36,6 +36,13 @@ from .cleanup import cleanup  # Usage: from utils import cleanup
 from .ai import DeepSeekClient, build_ai_chain, audio_to_text_by_qwen3_asr
 from .mediator import get_thread_pool_executor
 from .timer import print_interval_time, IntervalTimer
+from .metrics import metrics
+from .coalescer import LatestTaskRunner
+from .write_coalescer import WriteCoalescer
+from .blob_store import BlobStore, blob_store
+from .chunked_upload import ChunkedUploadStore, UploadSession, chunked_uploads
+from .zip_stream import ZipStream
+from .thumbnail import ThumbnailGenerator, thumbnails
 
 
 class MiscUtils:
@@ -0,0 +1,344 @@
+"""
+内容寻址的附件存储：文件按内容的 SHA-256 命名，存放在分片目录中，相同内容只存一份
+
+目录结构：
+
+    attachments/
+        ab/cd/abcdef...（64 位十六进制，原始内容）
+        ab/cd/abcdef....z（压缩后的内容，见下文）
+        tmp/（写入中的临时文件）
+        uploads/（分块上传中的文件，见 utils/chunked_upload.py）
+
+Details:
+    1. 数据库 attachment 表只记录 content_hash，引用计数在 blob 表中，由 attachment 表上的触发器维护（见迁移脚本 blob_store）
+    2. 写入先写临时文件，再 os.replace 到最终路径（原子操作），不会出现写了一半的 blob
+    3. 引用计数归零的 blob 不会立刻删除，由清理服务（utils/cleanup.py）过了宽限期后删除
+    4. 所有方法都是同步的文件操作，异步环境中请放到线程中执行（asyncio.to_thread）
+    5. 大文件使用 open_writer 分块写入，hash 和大小边写边算，不需要把整个文件读进内存
+    6. 透明压缩：调用方根据 mimetype 判断是否值得压缩（should_compress），超过阈值的内容 zlib 压缩后存为 .z 文件，
+       压缩率不理想时（已经压缩过的格式伪装成文本等）仍然存原始内容。hash/size 始终是原始内容的，读取时自动解压。
+       压缩文件格式：MAGIC(4) + codec(1) + 原始大小(8, little-endian) + zlib 数据
+    7. 写入/去重时给 hash 加一个租约（lease_seconds），清理流程（collect）不会删除租约内的 blob：
+       新附件可能去重到一个引用计数为 0 的 blob 上，在附件记录提交之前，引用计数还是 0（租约只在当前进程内有效）
+
+"""
+import hashlib
+import io
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Iterator, BinaryIO
+
+from settings import dynamic_settings
+from log import logger
+
+
+class BlobStore:
+    """SHA-256 内容寻址存储
+
+    Usage:
+        content_hash = blob_store.put(b"...")
+        content = blob_store.read(content_hash)
+
+    """
+
+    hash_name = "sha256"
+    shard_depth = 2  # 两级目录，每级 2 个十六进制字符（256 * 256 个目录）
+    shard_width = 2
+
+    compress_threshold = 4 * 1024  # 小于这个字节数的内容不压缩（收益太小）
+    compress_level = 6
+    compress_max_ratio = 0.9  # 压缩后大于原始大小的 90% 时放弃压缩
+    compressed_suffix = ".z"
+    compressed_magic = b"NMSZ"
+    compressed_header = struct.Struct("<4sBQ")  # magic, codec, 原始大小
+    codec_zlib = 1
+
+    lease_seconds = 10 * 60  # 写入/去重之后多久内不会被清理流程删除（足够调用方提交附件记录）
+
+    compressible_mimetypes = {
+        "application/json", "application/xml", "application/javascript", "application/x-javascript",
+        "application/x-yaml", "application/yaml", "application/x-sh", "application/sql", "application/x-ndjson",
+        "application/csv", "image/svg+xml", "image/bmp", "image/tiff",
+    }
+    compressible_extensions = {".txt", ".md", ".markdown", ".json", ".csv", ".tsv", ".log", ".xml", ".html", ".htm",
+                               ".svg", ".yaml", ".yml", ".toml", ".ini", ".sql", ".py", ".js", ".css", ".bmp"}
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self._lock = threading.Lock()  # 去重判断 + 加租约 与 collect 的删除互斥
+        self._leases: dict[str, float] = {}  # hash -> 租约到期时间（time.monotonic）
+
+    @classmethod
+    def should_compress(cls, mimetype: str | None, filename: str | None = None) -> bool:
+        """文本类内容值得压缩；图片/音视频/压缩包/office 文档等本身已经压缩过，跳过"""
+        mimetype = (mimetype or "").split(";")[0].strip().lower()
+        if mimetype.startswith("text/") or mimetype in cls.compressible_mimetypes:
+            return True
+        # 浏览器识别不出来的类型（如 .log、.md）通常是 application/octet-stream 或者空
+        if mimetype in ("", "application/octet-stream") and filename:
+            return os.path.splitext(filename)[1].lower() in cls.compressible_extensions
+        return False
+
+    def path_of(self, content_hash: str) -> Path:
+        """blob 文件路径（原始内容，不检查是否存在）"""
+        if len(content_hash) != 64 or not all(c in "0123456789abcdef" for c in content_hash):
+            raise ValueError(f"invalid content hash: {content_hash!r}")
+        shards = [content_hash[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_depth)]
+        return self.root.joinpath(*shards, content_hash)
+
+    def compressed_path_of(self, content_hash: str) -> Path:
+        return self.path_of(content_hash).with_suffix(self.compressed_suffix)
+
+    def _locate(self, content_hash: str) -> tuple[Path, bool]:
+        """返回 (实际文件路径, 是否压缩)，文件不存在时抛出 FileNotFoundError"""
+        compressed_path = self.compressed_path_of(content_hash)
+        if compressed_path.is_file():
+            return compressed_path, True
+        path = self.path_of(content_hash)
+        if path.is_file():
+            return path, False
+        raise FileNotFoundError(f"blob {content_hash} doesn't exist")
+
+    def exists(self, content_hash: str) -> bool:
+        return self.path_of(content_hash).is_file() or self.compressed_path_of(content_hash).is_file()
+
+    def put(self, content: bytes, compress: bool = False) -> str:
+        """写入内容，返回 content_hash，内容已存在时不重复写入"""
+        content_hash = hashlib.new(self.hash_name, content).hexdigest()
+        with self._lock:
+            if self.exists(content_hash):
+                self._lease(content_hash)
+                logger.debug("[BlobStore:put] dedup {}", content_hash)
+                return content_hash
+        writer = self.open_writer(compress=compress)
+        try:
+            writer.write(content)
+            return writer.commit()[0]
+        finally:
+            writer.abort()
+
+    def open_writer(self, compress: bool = False) -> "BlobWriter":
+        """流式写入：边写边计算 hash 和大小，内存占用只有一个分块"""
+        return BlobWriter(self, compress=compress)
+
+    def adopt(self, temp_path: Path, content_hash: str, size: int, compress: bool = False) -> bool:
+        """把一个已经写完、hash 已知的临时文件（必须在 root 下，os.replace 不跨文件系统）移入存储，返回是否压缩存储
+
+        内容已存在时丢弃临时文件；调用方负责保证 content_hash 与文件内容一致
+        """
+        # 压缩比较耗时，放在锁外面
+        compressed_path = None
+        if compress and size >= self.compress_threshold and not self.exists(content_hash):
+            compressed_path = self._compress_file(temp_path, size)
+            if compressed_path.stat().st_size > size * self.compress_max_ratio:
+                compressed_path.unlink(missing_ok=True)
+                compressed_path = None
+        with self._lock:
+            self._lease(content_hash)
+            if self.exists(content_hash):
+                logger.debug("[BlobStore:adopt] dedup {}", content_hash)
+                temp_path.unlink(missing_ok=True)
+                if compressed_path is not None:
+                    compressed_path.unlink(missing_ok=True)
+                return False
+            if compressed_path is not None:
+                self._commit(compressed_path, self.compressed_path_of(content_hash))
+                temp_path.unlink(missing_ok=True)
+                return True
+            self._commit(temp_path, self.path_of(content_hash))
+            return False
+
+    def read(self, content_hash: str) -> bytes:
+        return b"".join(self.iter_chunks(content_hash))
+
+    def open(self, content_hash: str) -> BinaryIO:
+        """可 seek 的文件对象（压缩的内容会解压到内存中，只用于图片等不压缩的内容时才是零拷贝）"""
+        path, compressed = self._locate(content_hash)
+        if not compressed:
+            return open(path, "rb")
+        return io.BytesIO(self.read(content_hash))
+
+    def size_of(self, content_hash: str) -> int:
+        """原始内容的大小"""
+        path, compressed = self._locate(content_hash)
+        if not compressed:
+            return path.stat().st_size
+        with open(path, "rb") as f:
+            return self._read_header(f)
+
+    def stored_size_of(self, content_hash: str) -> int:
+        """磁盘上实际占用的大小"""
+        return self._locate(content_hash)[0].stat().st_size
+
+    def iter_chunks(self, content_hash: str, chunk_size: int = 64 * 1024,
+                    start: int = 0, length: int | None = None) -> Iterator[bytes]:
+        """分块读取 [start, start + length)，length 为 None 时读到结尾（HTTP Range 请求用）
+
+        压缩的内容只能从头解压，跳过 start 之前的部分（CPU 开销与 start 成正比，内存仍然只有一个分块）
+        """
+        path, compressed = self._locate(content_hash)
+        with open(path, "rb") as f:
+            if compressed:
+                self._read_header(f)
+                chunks = self._iter_decompressed(f, chunk_size)
+            else:
+                f.seek(start)
+                chunks = iter(lambda: f.read(chunk_size), b"")
+                start = 0
+            remaining = length
+            for chunk in chunks:
+                if start >= len(chunk):
+                    start -= len(chunk)
+                    continue
+                chunk = chunk[start:]
+                start = 0
+                if remaining is not None:
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                yield chunk
+                if remaining is not None and remaining <= 0:
+                    break
+
+    def remove(self, content_hash: str) -> bool:
+        """删除 blob 文件，返回是否真的删除了（只应该由引用计数为 0 的清理流程调用）"""
+        removed = False
+        for path in (self.path_of(content_hash), self.compressed_path_of(content_hash)):
+            try:
+                path.unlink()
+                removed = True
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def collect(self, content_hash: str) -> bool:
+        """清理流程删除引用计数为 0 的 blob：租约内（刚写入或者刚去重过）的不删除，返回 False；否则删除文件（不存在也算），返回 True"""
+        with self._lock:
+            if self._leases.get(content_hash, 0) > time.monotonic():
+                logger.debug("[BlobStore:collect] leased {}", content_hash)
+                return False
+            self._leases.pop(content_hash, None)
+            self.remove(content_hash)
+            return True
+
+    def _lease(self, content_hash: str):
+        """需要持有 self._lock"""
+        now = time.monotonic()
+        if len(self._leases) >= 1024:
+            self._leases = {key: deadline for key, deadline in self._leases.items() if deadline > now}
+        self._leases[content_hash] = now + self.lease_seconds
+
+    def stats(self) -> dict:
+        """遍历存储目录统计：blob 数量、压缩的数量、原始大小之和、磁盘占用之和（会读取每个压缩文件的头部）"""
+        blobs = compressed = raw_bytes = stored_bytes = 0
+        for path in self.root.glob("/".join(["??"] * self.shard_depth + ["*"])):
+            stored_size = path.stat().st_size
+            blobs += 1
+            stored_bytes += stored_size
+            if path.suffix == self.compressed_suffix:
+                compressed += 1
+                with open(path, "rb") as f:
+                    raw_bytes += self._read_header(f)
+            else:
+                raw_bytes += stored_size
+        return {
+            "blobs": blobs,
+            "compressed": compressed,
+            "raw_bytes": raw_bytes,
+            "stored_bytes": stored_bytes,
+            "ratio": round(stored_bytes / raw_bytes, 4) if raw_bytes else 1.0,  # 磁盘占用 / 原始大小，越小越好
+        }
+
+    def _read_header(self, f: BinaryIO) -> int:
+        magic, codec, size = self.compressed_header.unpack(f.read(self.compressed_header.size))
+        if magic != self.compressed_magic or codec != self.codec_zlib:
+            raise ValueError(f"invalid compressed blob: {f.name}")
+        return size
+
+    @staticmethod
+    def _iter_decompressed(f: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+        """每次最多输出 chunk_size 字节，防止高压缩率的内容一次解压出一大块"""
+        decompressor = zlib.decompressobj()
+        while data := f.read(chunk_size):
+            while data:
+                chunk = decompressor.decompress(data, chunk_size)
+                if chunk:
+                    yield chunk
+                data = decompressor.unconsumed_tail
+        if tail := decompressor.flush():
+            yield tail
+
+    def _compress_file(self, source: Path, size: int, chunk_size: int = 256 * 1024) -> Path:
+        """把 source 压缩到一个新的临时文件，返回临时文件路径"""
+        temp_path = self._new_temp_path()
+        compressor = zlib.compressobj(self.compress_level)
+        with open(source, "rb") as src, open(temp_path, "wb") as dst:
+            dst.write(self.compressed_header.pack(self.compressed_magic, self.codec_zlib, size))
+            while chunk := src.read(chunk_size):
+                dst.write(compressor.compress(chunk))
+            dst.write(compressor.flush())
+            dst.flush()
+            os.fsync(dst.fileno())
+        return temp_path
+
+    def _new_temp_path(self) -> Path:
+        temp_dir = self.root / "tmp"
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        return temp_dir / f"{uuid.uuid4().hex}.part"
+
+    @staticmethod
+    def _commit(temp_path: Path, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 同一内容并发写入时，后 replace 的覆盖先 replace 的，内容相同，没有影响
+        os.replace(temp_path, path)
+
+
+class BlobWriter:
+    """流式写入器，内容先写到临时文件，commit 时才知道 hash（以及是否值得压缩），再移动到最终路径
+
+    Usage:
+        writer = blob_store.open_writer(compress=blob_store.should_compress(mimetype, filename))
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+            content_hash, size = writer.commit()
+        finally:
+            writer.abort()  # commit 之后调用没有影响
+
+    """
+
+    def __init__(self, store: BlobStore, compress: bool = False):
+        self.store = store
+        self.compress = compress
+        self.size = 0
+        self.compressed = False  # commit 后是否以压缩形式存储
+        self._hash = hashlib.new(store.hash_name)
+        self._temp_path = store._new_temp_path()  # noqa: 同一模块内的协作类
+        self._file = open(self._temp_path, "wb")
+
+    def write(self, chunk: bytes):
+        self._hash.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> tuple[str, int]:
+        """返回 (content_hash, size)，内容已存在时丢弃临时文件"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        content_hash = self._hash.hexdigest()
+        self.compressed = self.store.adopt(self._temp_path, content_hash, self.size, self.compress)
+        return content_hash, self.size
+
+    def abort(self):
+        """放弃写入，删除临时文件"""
+        if not self._file.closed:
+            self._file.close()
+        self._temp_path.unlink(missing_ok=True)
+
+
+blob_store = BlobStore(dynamic_settings.attachment_store_dir)
@@ -0,0 +1,214 @@
+"""
+可续传的分块上传：大文件（录音、压缩包等）分块上传，分块直接写入附件存储目录下的会话文件，最后校验 hash 后移入内容寻址存储
+
+协议（见 api.py /api/upload/chunked，前端见 templates/drag_upload.js）：
+
+    1. init：     POST   /api/upload/chunked                      -> upload_id、chunk_size、chunk_count
+    2. chunk N：  PUT    /api/upload/chunked/{upload_id}/{N}      请求体为分块内容，可选 X-Chunk-Sha256 校验单个分块
+    3. 续传：     GET    /api/upload/chunked/{upload_id}          -> 已收到的分块（received），只补传缺少的分块
+    4. finalize： POST   /api/upload/chunked/{upload_id}/finalize 校验整个文件的 SHA-256，创建附件记录
+
+目录结构：
+
+    attachments/
+        uploads/<upload_id>/meta.json（文件名、大小、分块大小等）
+        uploads/<upload_id>/received（已写入的分块序号，每行一个，只追加）
+        uploads/<upload_id>/data（按文件大小预分配，分块按偏移写入）
+
+Details:
+    1. 会话状态全部在磁盘上，进程重启后可以继续上传；内存占用只有一个分块
+    2. 分块按 序号 * chunk_size 的偏移写入同一个文件，重复上传同一个分块是幂等的，分块可以乱序、并发上传
+    3. 分块先写入 data 并 fsync，再追加到 received，中途崩溃只会导致该分块需要重传
+    4. finalize 时 data 与 blob 存储在同一个目录树下，校验通过后 os.replace 移入（见 BlobStore.adopt），不复制
+    5. 超过 expire_seconds 没有更新的会话由清理服务删除（见 utils/cleanup.py）
+    6. 所有方法都是同步的文件操作，异步环境中请放到线程中执行（asyncio.to_thread）
+
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from collections import namedtuple
+from pathlib import Path
+
+from log import logger
+
+from .blob_store import BlobStore, blob_store
+from .metrics import metrics
+
+UploadSession = namedtuple("UploadSession", [
+    "upload_id", "filename", "mimetype", "size", "chunk_size", "chunk_count", "temporary_uuid", "received",
+    "content_hash",
+])
+"""分块上传会话，received 为已收到的分块序号（frozenset），content_hash 在 finalize 之后才有值"""
+
+_UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ChunkedUploadStore:
+    """分块上传会话存储
+
+    Usage:
+        session = chunked_uploads.init("a.mp4", "video/mp4", size)
+        chunked_uploads.write_chunk(session.upload_id, 0, data)
+        content_hash, size, session = chunked_uploads.finalize(session.upload_id, expected_hash)
+        ...  # 创建附件记录
+        chunked_uploads.discard(session.upload_id)
+
+    找不到会话抛出 KeyError，参数或内容不合法抛出 ValueError
+    """
+
+    default_chunk_size = 4 * 1024 * 1024
+    min_chunk_size = 64 * 1024
+    max_chunk_size = 16 * 1024 * 1024
+    max_size = 4 * 1024 * 1024 * 1024  # 单个文件上限 4GB
+    expire_seconds = 24 * 60 * 60  # 超过一天没有更新的会话视为放弃
+    hash_chunk_size = 1024 * 1024
+
+    def __init__(self, store: BlobStore):
+        self.store = store
+
+    @property
+    def root(self) -> Path:
+        return self.store.root / "uploads"
+
+    def _dir_of(self, upload_id: str) -> Path:
+        if not _UPLOAD_ID_PATTERN.match(upload_id or ""):
+            raise KeyError(upload_id)
+        return self.root / upload_id
+
+    def init(self, filename: str, mimetype: str | None, size: int, chunk_size: int | None = None,
+             temporary_uuid: str | None = None) -> UploadSession:
+        """创建会话，按文件大小预分配 data 文件"""
+        chunk_size = chunk_size or self.default_chunk_size
+        if not filename:
+            raise ValueError("filename is required")
+        if not 0 < size <= self.max_size:
+            raise ValueError(f"size must be in (0, {self.max_size}]")
+        if not self.min_chunk_size <= chunk_size <= self.max_chunk_size:
+            raise ValueError(f"chunk_size must be in [{self.min_chunk_size}, {self.max_chunk_size}]")
+
+        upload_id = uuid.uuid4().hex
+        directory = self._dir_of(upload_id)
+        directory.mkdir(parents=True)
+        with open(directory / "data", "wb") as f:
+            f.truncate(size)  # 稀疏文件，不真正占用磁盘
+        (directory / "received").touch()
+        meta = dict(filename=filename, mimetype=mimetype, size=size, chunk_size=chunk_size,
+                    temporary_uuid=temporary_uuid, content_hash=None)
+        self._write_meta(directory, meta)
+        metrics.incr("chunked_upload.init")
+        logger.debug("[ChunkedUploadStore:init] {} {} ({} bytes)", upload_id, filename, size)
+        return self._session(upload_id, meta, frozenset())
+
+    def load(self, upload_id: str) -> UploadSession:
+        directory = self._dir_of(upload_id)
+        try:
+            meta = json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+            lines = (directory / "received").read_text(encoding="utf-8").split()
+        except FileNotFoundError:
+            raise KeyError(upload_id) from None
+        return self._session(upload_id, meta, frozenset(int(line) for line in lines))
+
+    def write_chunk(self, upload_id: str, index: int, data: bytes, chunk_hash: str | None = None) -> UploadSession:
+        """写入第 index 个分块（从 0 开始），除最后一个分块外大小必须等于 chunk_size"""
+        session = self.load(upload_id)
+        if session.content_hash is not None:
+            raise ValueError(f"upload {upload_id} is already finalized")
+        if not 0 <= index < session.chunk_count:
+            raise ValueError(f"chunk index must be in [0, {session.chunk_count})")
+        offset = index * session.chunk_size
+        expected_size = min(session.chunk_size, session.size - offset)
+        if len(data) != expected_size:
+            raise ValueError(f"chunk {index} must be {expected_size} bytes, got {len(data)}")
+        if chunk_hash is not None and hashlib.sha256(data).hexdigest() != chunk_hash.lower():
+            metrics.incr("chunked_upload.chunk_hash_mismatch")
+            raise ValueError(f"chunk {index} hash mismatch")
+
+        directory = self._dir_of(upload_id)
+        with open(directory / "data", "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if index not in session.received:
+            # 追加一行是原子的（O_APPEND），并发上传不同分块不会互相覆盖
+            with open(directory / "received", "a", encoding="utf-8") as f:
+                f.write(f"{index}\n")
+        metrics.incr("chunked_upload.chunk")
+        metrics.incr("chunked_upload.bytes", len(data))
+        return session._replace(received=session.received | {index})
+
+    def finalize(self, upload_id: str, expected_hash: str | None = None) -> tuple[str, int, UploadSession]:
+        """所有分块到齐后计算 SHA-256，与 expected_hash 比较，一致则移入内容寻址存储，返回 (content_hash, size, session)
+
+        可以重复调用（比如创建附件记录失败后重试），hash 不一致时删除会话，需要重新上传
+        """
+        session = self.load(upload_id)
+        directory = self._dir_of(upload_id)
+        if session.content_hash is not None and self.store.exists(session.content_hash):
+            return session.content_hash, session.size, session
+        missing = session.chunk_count - len(session.received)
+        if missing:
+            raise ValueError(f"{missing} chunks are missing")
+
+        digest = hashlib.new(self.store.hash_name)
+        with open(directory / "data", "rb") as f:
+            while chunk := f.read(self.hash_chunk_size):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        if expected_hash is not None and content_hash != expected_hash.lower():
+            metrics.incr("chunked_upload.hash_mismatch")
+            self.discard(upload_id)
+            raise ValueError(f"hash mismatch: expected {expected_hash}, got {content_hash}")
+
+        compress = self.store.should_compress(session.mimetype, session.filename)
+        self.store.adopt(directory / "data", content_hash, session.size, compress)
+        meta = json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+        meta["content_hash"] = content_hash
+        self._write_meta(directory, meta)
+        metrics.incr("chunked_upload.finalized")
+        return content_hash, session.size, session._replace(content_hash=content_hash)
+
+    def discard(self, upload_id: str):
+        """删除会话（完成或者放弃上传）"""
+        shutil.rmtree(self._dir_of(upload_id), ignore_errors=True)
+
+    def remove_expired(self, expire_seconds: float | None = None) -> int:
+        """删除超过 expire_seconds 没有更新的会话，返回删除的数量"""
+        expire_seconds = self.expire_seconds if expire_seconds is None else expire_seconds
+        if not self.root.is_dir():
+            return 0
+        deadline = time.time() - expire_seconds
+        removed = 0
+        for directory in self.root.iterdir():
+            try:
+                # 写入分块会更新 data/received 的 mtime，目录本身的 mtime 不会变
+                updated_at = max(path.stat().st_mtime for path in directory.iterdir())
+            except (ValueError, OSError):  # 空目录 / 并发删除
+                updated_at = directory.stat().st_mtime if directory.exists() else 0
+            if updated_at <= deadline:
+                shutil.rmtree(directory, ignore_errors=True)
+                removed += 1
+        if removed:
+            metrics.incr("chunked_upload.expired", removed)
+            logger.info("[ChunkedUploadStore:remove_expired] removed: {}", removed)
+        return removed
+
+    @staticmethod
+    def _write_meta(directory: Path, meta: dict):
+        temp_path = directory / "meta.json.part"
+        temp_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(temp_path, directory / "meta.json")
+
+    @staticmethod
+    def _session(upload_id: str, meta: dict, received: frozenset) -> UploadSession:
+        chunk_count = -(-meta["size"] // meta["chunk_size"])
+        return UploadSession(upload_id, meta["filename"], meta["mimetype"], meta["size"], meta["chunk_size"],
+                             chunk_count, meta["temporary_uuid"], received, meta["content_hash"])
+
+
+chunked_uploads = ChunkedUploadStore(blob_store)
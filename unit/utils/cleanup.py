@@ -16,15 +16,21 @@ async def shutdown_event():
 """
 
 import asyncio
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Sequence
 
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, Row
 
 from services import Attachment
 from models import AsyncSessionLocal
+from mediator import get_attachment_service  # 【循环依赖】services 导入 utils 时 AttachmentService 还没有定义
 from log import logger
 
+from .metrics import metrics
+from .chunked_upload import chunked_uploads
+
+
 class _Cleanup:
     """清理服务
 
@@ -34,10 +40,14 @@ class _Cleanup:
 
     """
 
+    batch_size = 500  # 每批删除的临时附件数量
+    expire_seconds = 5 * 60  # 临时附件创建多久之后才清理
+
     def __init__(self, interval_seconds: int = 5 * 60):
         self.interval_seconds = interval_seconds
         self.is_running = False
         self.task = None
+        self.migrate_task = None
 
     async def start(self):
         """启动清理服务"""
@@ -48,6 +58,7 @@ class _Cleanup:
         logger.info(f"🧹 清理服务已启动，间隔: {self.interval_seconds} 秒")
         self.is_running = True
         self.task = asyncio.create_task(self._run_cleanup_loop())
+        self.migrate_task = asyncio.create_task(self._migrate_legacy_contents())
 
     async def stop(self):
         """停止清理服务"""
@@ -56,6 +67,8 @@ class _Cleanup:
             return
 
         self.is_running = False
+        if self.migrate_task and not self.migrate_task.done():
+            self.migrate_task.cancel()
         if self.task:
             self.task.cancel()
             try:
@@ -71,61 +84,85 @@ class _Cleanup:
                 # [knowledge] 虽然事件循环全靠主循环，但是由于此处有 await asyncio.sleep(...)，所以不会长时间占用 cpu 即阻塞
                 await asyncio.sleep(self.interval_seconds)
                 await self._cleanup_expired_items()  # 先睡眠再执行，不要刚启动就执行
+                await self._collect_garbage_blobs()
+                await asyncio.to_thread(chunked_uploads.remove_expired)  # 放弃了的分块上传
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"清理过程中发生错误: {e}")
                 await asyncio.sleep(60)  # 出错后等待 1 分钟再重试
 
-    async def _get_items_to_delete(self, session) -> Sequence[Attachment]:
-        five_minutes_ago = datetime.now(tz=timezone.utc) - timedelta(minutes=5)
-        stmt = select(Attachment).where(Attachment.note_id.is_(None) & (Attachment.created_at <= five_minutes_ago))
-        result = await session.execute(stmt)
-        items_to_delete = result.scalars().all()
-        if not items_to_delete:
-            logger.debug("没有找到需要清理的临时记录")
-        return items_to_delete
-
-    async def _delete_items(self, session):
-        # 五分钟内被创建的不要删（但是这同样要求前端需要提示呢，否则有点难受）
-        five_minutes_ago = datetime.now(tz=timezone.utc) - timedelta(minutes=5)
-        stmt = delete(Attachment).where(Attachment.note_id.is_(None) & (Attachment.created_at <= five_minutes_ago))
-        await session.execute(stmt)
+    async def _delete_expired_batch(self, session, expired_before: datetime) -> Sequence[Row]:
+        """删除一批过期的临时附件，只返回 id 和文件名（不读取 content）
+
+        子查询走部分索引 ix_attachment_orphan_created_at，每批最多 batch_size 条，单个写事务很短
+        """
+        batch = (select(Attachment.id)
+                 .where(Attachment.note_id.is_(None), Attachment.created_at <= expired_before)
+                 .limit(self.batch_size)
+                 .scalar_subquery())
+        stmt = (delete(Attachment)
+                .where(Attachment.id.in_(batch))
+                .returning(Attachment.id, Attachment.filename)
+                .execution_options(synchronize_session=False))
+        rows = (await session.execute(stmt)).all()
         await session.commit()
+        return rows
+
+    async def _cleanup_expired_items(self) -> int:
+        """分批清理临时项，返回删除的记录数
 
-    async def _cleanup_expired_items(self):
-        """清理临时项"""
+        每批一个事务，批与批之间让出事件循环，临时附件再多也不会长时间占用写锁或阻塞页面
+        """
+        # 五分钟内被创建的不要删（但是这同样要求前端需要提示呢，否则有点难受）
+        expired_before = datetime.now(tz=timezone.utc) - timedelta(seconds=self.expire_seconds)
+        start = time.perf_counter()
+        deleted_num = 0
         try:
             async with AsyncSessionLocal() as session:
-                items_to_delete = await self._get_items_to_delete(session)
-
-                if not items_to_delete:
-                    return
-
-                await self._delete_items(session)
-
-                logger.info(f"成功删除 {len(items_to_delete)} 条临时记录")
-
-                # 记录详细信息（可选）
-                for item in items_to_delete:
-                    logger.debug(f"删除记录: id={item.id}, name={item.filename}, "
-                                 f"note_id={item.note_id}, temporary_uuid={item.temporary_uuid}")
-
+                while True:
+                    batch_start = time.perf_counter()
+                    rows = await self._delete_expired_batch(session, expired_before)
+                    if not rows:
+                        break
+                    deleted_num += len(rows)
+                    metrics.incr("cleanup.expired.batches")
+                    metrics.incr("cleanup.expired.deleted", len(rows))
+                    logger.debug("删除临时记录 {} 条（{:.1f} ms）: {}", len(rows), (time.perf_counter() - batch_start) * 1000,
+                                 ", ".join(f"{row.id}:{row.filename}" for row in rows))
+                    if len(rows) < self.batch_size:
+                        break
+                    await asyncio.sleep(0)
         except Exception as e:
+            metrics.incr("cleanup.expired.failed")
             logger.error(f"清理数据库时发生错误: {e}")
             raise
+        finally:
+            metrics.incr("cleanup.expired.runs")
+            metrics.incr("cleanup.expired.duration_ms", round((time.perf_counter() - start) * 1000))
+
+        if deleted_num:
+            logger.info(f"成功删除 {deleted_num} 条临时记录")
+        else:
+            logger.debug("没有找到需要清理的临时记录")
+        return deleted_num
+
+    @staticmethod
+    async def _collect_garbage_blobs():
+        """删除没有附件引用的 blob 文件（删除附件时只减引用计数）"""
+        async with get_attachment_service()() as service:
+            await service.collect_garbage_blobs()
+
+    @staticmethod
+    async def _migrate_legacy_contents():
+        """启动时把旧数据 attachment.content 搬到内容寻址存储（分批提交，中途退出下次启动继续）"""
+        async with get_attachment_service()() as service:
+            result = await service.migrate_legacy_contents()
+            if result.is_ok() and result.unwrap():
+                logger.info(f"旧附件迁移完成，数量: {result.unwrap()}")
 
     async def cleanup_now(self) -> int:
         """立即执行一次清理，返回删除的记录数"""
-        async with AsyncSessionLocal() as session:
-            items_to_delete = await self._get_items_to_delete(session)
-
-            if not items_to_delete:
-                return 0
-
-            await self._delete_items(session)
-
-            return len(items_to_delete)
-
+        return await self._cleanup_expired_items()
 
 cleanup = _Cleanup()
@@ -0,0 +1,73 @@
+"""
+只保留最新一次提交的异步任务（搜索框边输入边搜索用）
+
+Details:
+    1. submit 时取消上一次提交的任务：还在防抖等待中的直接丢弃（不会访问数据库），已经在执行的 task.cancel()
+    2. 防抖期间的多次提交合并成一次执行，所以最终只会渲染最新一次提交的结果
+    3. 每个页面（每个客户端）一个实例，不同客户端之间互不影响
+
+"""
+import asyncio
+from typing import Callable, Awaitable
+
+from log import logger
+
+from .metrics import metrics
+
+
+class LatestTaskRunner:
+    """最新任务执行器
+
+    Usage:
+        runner = LatestTaskRunner("search", debounce_seconds=0.3)
+        runner.submit(lambda: rebuild_table())  # 连续 submit，只有最后一次会执行完
+
+    Metrics:
+        {name}.submitted：提交次数
+        {name}.dropped：防抖期间被新提交顶掉，没有执行的次数
+        {name}.cancelled：执行途中被新提交取消的次数
+        {name}.completed：执行完成的次数
+        {name}.failed：执行出错的次数
+
+    """
+
+    def __init__(self, name: str, debounce_seconds: float = 0.3):
+        self.name = name
+        self.debounce_seconds = debounce_seconds
+        self._task: asyncio.Task | None = None
+        self._started = False  # 当前 task 是否已经过了防抖等待，开始执行
+
+    def submit(self, task_factory: Callable[[], Awaitable], debounce: bool = True) -> asyncio.Task:
+        """提交任务，取消上一次未完成的任务
+
+        :param task_factory: 返回 awaitable 的函数，任务真正开始时才调用，这样被丢弃的任务连协程都不会创建
+        :param debounce: 为 False 时立刻执行（如按下回车）
+        """
+        self.cancel()
+        metrics.incr(f"{self.name}.submitted")
+        self._started = False
+        self._task = asyncio.create_task(self._run(task_factory, self.debounce_seconds if debounce else 0))
+        return self._task
+
+    def cancel(self) -> None:
+        if self._task is None or self._task.done():
+            return
+        if self._started:
+            metrics.incr(f"{self.name}.cancelled")
+            logger.debug("[LatestTaskRunner:{}] cancel running task", self.name)
+        else:
+            metrics.incr(f"{self.name}.dropped")
+        self._task.cancel()
+
+    async def _run(self, task_factory: Callable[[], Awaitable], delay: float):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._started = True
+        try:
+            await task_factory()
+            metrics.incr(f"{self.name}.completed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.incr(f"{self.name}.failed")
+            logger.error("[LatestTaskRunner:{}] {}", self.name, e)
@@ -0,0 +1,36 @@
+"""
+进程内的简单计数器，没有接入 prometheus 等监控系统，可以通过 GET /metrics 查看
+
+使用案例：
+
+from utils import metrics
+
+metrics.incr("search.cancelled")
+
+"""
+import threading
+from collections import defaultdict
+from typing import Dict
+
+
+class _Metrics:
+    """计数器（线程安全，计数只增不减，进程重启后清零）"""
+
+    def __init__(self):
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+
+metrics = _Metrics()
@@ -0,0 +1,145 @@
+"""
+图片附件缩略图：上传后在后台线程池中生成，按内容 hash 缓存在附件存储目录下，/api/thumbnail 读取
+
+目录结构：
+
+    attachments/
+        thumbnails/ab/abcdef..._256.webp
+
+Details:
+    1. 缩略图按内容 hash + 尺寸命名，内容不变缩略图就不变，相同图片只生成一次
+    2. 解码/缩放是 CPU 密集操作，放到专用线程池中执行（Pillow 在解码和缩放时会释放 GIL），不阻塞事件循环
+    3. 同一张图片同时被请求多次时只生成一次（共享同一个 future）
+    4. 旧附件没有缩略图，第一次请求 /api/thumbnail 时生成（惰性回填）
+    5. Pillow 是可选依赖（matplotlib 依赖它，通常已安装），没有安装时不生成缩略图，/api/thumbnail 返回原图
+
+"""
+import asyncio
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from log import logger
+
+from .blob_store import BlobStore, blob_store
+from .metrics import metrics
+
+
+class ThumbnailGenerator:
+    """缩略图生成器
+
+    Usage:
+        thumbnails.submit(content_hash)  # 上传后调用，不等待结果
+        path = await thumbnails.ensure(content_hash)  # 读取，不存在则生成，生成失败返回 None
+
+    """
+
+    size = 256  # 最长边像素
+    quality = 80
+    # svg 不需要缩略图（矢量图），其余常见位图
+    supported_mimetypes = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp", "image/tiff"}
+    max_source_pixels = 80_000_000  # 超过这个像素数的图片不处理（防止解压炸弹）
+
+    def __init__(self, store: BlobStore, max_workers: int = 2):
+        self.store = store
+        self.max_workers = max_workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending: dict[str, asyncio.Future] = {}
+        self._format: str | None = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="thumbnail")
+        return self._executor
+
+    @property
+    def format(self) -> str | None:
+        """WEBP 优先，Pillow 不支持 WEBP 时使用 JPEG，没有安装 Pillow 时为 None"""
+        if self._format is None:
+            try:
+                from PIL import features
+            except ImportError:
+                return None
+            self._format = "WEBP" if features.check("webp") else "JPEG"
+        return self._format
+
+    @property
+    def mimetype(self) -> str:
+        return "image/webp" if self.format == "WEBP" else "image/jpeg"
+
+    def is_supported(self, mimetype: str | None) -> bool:
+        return mimetype in self.supported_mimetypes and self.format is not None
+
+    def path_of(self, content_hash: str) -> Path:
+        extension = "webp" if self.format == "WEBP" else "jpg"
+        self.store.path_of(content_hash)  # 只为了校验 hash 格式（不允许路径穿越）
+        return self.store.root / "thumbnails" / content_hash[:2] / f"{content_hash}_{self.size}.{extension}"
+
+    def submit(self, content_hash: str) -> asyncio.Future:
+        """后台生成（已存在或者正在生成时直接返回）"""
+        loop = asyncio.get_running_loop()
+        future = self._pending.get(content_hash)
+        if future is not None and future.get_loop() is loop:
+            return future
+        future = loop.run_in_executor(self.executor, self._generate, content_hash)
+        self._pending[content_hash] = future
+        future.add_done_callback(lambda f: self._on_done(content_hash, f))
+        return future
+
+    def _on_done(self, content_hash: str, future: asyncio.Future):
+        self._pending.pop(content_hash, None)
+        # 上传后提交的任务没有人 await，在这里取出异常，避免 "exception was never retrieved"
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("[ThumbnailGenerator] {} - {}", content_hash, future.exception())
+
+    async def ensure(self, content_hash: str) -> Path | None:
+        """返回缩略图路径，不存在则生成（等待生成完成），失败返回 None"""
+        path = self.path_of(content_hash)
+        if path.is_file():
+            metrics.incr("thumbnail.hit")
+            return path
+        try:
+            return await asyncio.shield(self.submit(content_hash))
+        except Exception:
+            return None
+
+    def remove(self, content_hash: str):
+        """blob 被删除时一起删除缩略图"""
+        self.path_of(content_hash).unlink(missing_ok=True)
+
+    def _generate(self, content_hash: str) -> Path:
+        """在线程池中执行"""
+        from PIL import Image, ImageOps
+
+        path = self.path_of(content_hash)
+        if path.is_file():
+            return path
+        try:
+            with self.store.open(content_hash) as f, Image.open(f) as image:
+                if image.width * image.height > self.max_source_pixels:
+                    raise ValueError(f"image too large: {image.width}x{image.height}")
+                image.draft("RGB", (self.size, self.size))  # JPEG 解码时直接按比例缩小，省内存和时间
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((self.size, self.size))
+                has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+                mode = "RGBA" if has_alpha and self.format == "WEBP" else "RGB"
+                if image.mode != mode:
+                    image = image.convert(mode)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = path.with_name(f"{uuid.uuid4().hex}.part")
+                try:
+                    image.save(temp_path, format=self.format, quality=self.quality)
+                    os.replace(temp_path, path)
+                finally:
+                    temp_path.unlink(missing_ok=True)
+        except Exception:
+            metrics.incr("thumbnail.failed")
+            raise
+        metrics.incr("thumbnail.generated")
+        logger.debug("[ThumbnailGenerator:_generate] {}", path)
+        return path
+
+
+thumbnails = ThumbnailGenerator(blob_store)
@@ -0,0 +1,175 @@
+"""
+写入合并：高频的小写入（访问次数、自动保存、用户配置）先放在内存中，同一行的多次写入合并成一次，定时在一个事务中写入
+
+使用案例：
+
+    visits = WriteCoalescer("note.visit", flush=flush_visits, merge=operator.add, delay=5)
+    visits.submit(note_id, 1)  # 不等待写入
+    visit = await read_visit(note_id) + visits.peek(note_id, 0)  # 数据库中的值 + 还没有写入的增量（见 Details 3）
+    await WriteCoalescer.flush_all()  # app.on_shutdown
+
+Details:
+    1. 延迟有上限：第一次 submit 之后最多 delay 秒开始写入（之后的 submit 不会推迟写入时间），待写入的行超过 max_pending 时立即写入
+    2. flush 回调一次收到所有待写入的行 {key: value}，应该在一个事务中写入；同一时刻只有一次 flush，保证写入顺序。
+       回调在单独的任务中执行（空的 contextvars 上下文），不会加入调用方的工作单元（models.db_session），
+       由回调自己的会话提交；调用方已经写入（持有写连接）时等待 flush 会等待自己，需要自己处理（见 NoteService._flush_pending_autosave）
+    3. 写入之前读取需要自己合并 peek 的值（如访问次数 = 数据库中的值 + 待写入的增量），或者先调用 flush；
+       增量（merge 是加法）的读快照可能早于或者晚于正在进行的写入，单看数据库中的值分不清是否已经包含这部分增量：
+       flush 回调执行写入后记下写入后的值并调用 mark_written，peek 不再合并正在写入的行，读取时与记下的值比较
+       （见 NoteService.get_visits），不需要在读数据库期间加锁
+    4. 正常退出时 app.on_shutdown 调用 flush_all，进程被强制结束（kill -9、断电）时最多丢失 delay 秒内的写入
+    5. 写入失败不重试：submit 返回的 future 收到异常，没有人等待时只记录日志
+
+"""
+import asyncio
+import contextvars
+import time
+from typing import Any, Callable, Awaitable, Hashable
+
+from log import logger
+
+from .metrics import metrics
+
+
+def _latest(old: Any, new: Any) -> Any:  # noqa: old 是 merge 的固定参数
+    return new
+
+
+class WriteCoalescer:
+    """按 key 合并写入
+
+    Metrics:
+        {name}.submitted：submit 次数
+        {name}.merged：合并到已有待写入行的次数（省掉的写入）
+        {name}.flushes：写入（事务）次数
+        {name}.rows：写入的行数
+        {name}.failed：写入失败的次数
+        {name}.flush_ms：写入耗时
+
+    """
+
+    instances: list["WriteCoalescer"] = []  # 所有实例，flush_all 使用
+
+    def __init__(self,
+                 name: str,
+                 flush: Callable[[dict], Awaitable[Any]],
+                 merge: Callable[[Any, Any], Any] = _latest,
+                 delay: float = 1.0,
+                 max_pending: int = 1000):
+        """
+        :param flush: 写入回调，参数为 {key: value}
+        :param merge: 同一个 key 的旧值和新值合并，默认保留新值
+        :param delay: 最长延迟（秒）
+        :param max_pending: 待写入的行数上限，达到后立即写入
+        """
+        self.name = name
+        self.delay = delay
+        self.max_pending = max_pending
+        self._flush = flush
+        self._merge = merge
+        self._pending: dict = {}
+        self._flushing: dict = {}  # 正在写入的行（还没有提交），peek 需要合并
+        self._future: asyncio.Future | None = None  # 当前这一批写入完成的 future
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock: asyncio.Lock | None = None
+        self._task: asyncio.Task | None = None
+        self._sleeping = False
+        WriteCoalescer.instances.append(self)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 第一次使用，或者换了事件循环（测试中多次 asyncio.run），旧的任务和 future 已经随旧的事件循环结束
+            self._loop, self._lock, self._task, self._future = loop, asyncio.Lock(), None, None
+        return loop
+
+    def submit(self, key: Hashable, value: Any) -> asyncio.Future:
+        """合并到待写入的行，返回这一批写入完成的 future（可以不等待）"""
+        loop = self._ensure_loop()
+        metrics.incr(f"{self.name}.submitted")
+        if key in self._pending:
+            self._pending[key] = self._merge(self._pending[key], value)
+            metrics.incr(f"{self.name}.merged")
+        else:
+            self._pending[key] = value
+        if self._future is None:
+            self._future = loop.create_future()
+            self._future.add_done_callback(self._on_done)
+        if self._task is None or self._task.done():
+            self._start(loop, 0 if len(self._pending) >= self.max_pending else self.delay)
+        elif len(self._pending) >= self.max_pending and self._sleeping:
+            self._task.cancel()  # 只取消等待中的任务，正在写入的任务写完之后会继续处理新的行
+            self._start(loop, 0)
+        return self._future
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """还没有写入数据库的值（正在写入的和待写入的合并）"""
+        if key in self._flushing and key in self._pending:
+            return self._merge(self._flushing[key], self._pending[key])
+        return self._pending.get(key, self._flushing.get(key, default))
+
+    def take(self, key: Hashable, default: Any = None) -> Any:
+        """取出待写入的值（调用方自己写入，如手动保存时合并自动保存的内容），正在写入的不能取出"""
+        return self._pending.pop(key, default)
+
+    def mark_written(self):
+        """flush 回调中调用：正在写入的行已经执行（可能还没有提交），由回调自己记下写入后的值，peek 不再合并这些行"""
+        self._flushing = {}
+
+    async def flush(self) -> int:
+        """立即写入所有待写入的行，返回写入的行数（失败返回 0，异常交给 submit 返回的 future）"""
+        self._ensure_loop()
+        async with self._lock:
+            pending, future = self._pending, self._future
+            self._pending, self._future = {}, None
+            if not pending:
+                if future is not None and not future.done():
+                    future.set_result(0)
+                return 0
+            self._flushing = pending
+            start = time.perf_counter()
+            try:
+                await self._loop.create_task(self._flush(pending), context=contextvars.Context())
+            except Exception as e:
+                metrics.incr(f"{self.name}.failed")
+                logger.error("[WriteCoalescer:{}] flush {} rows failed: {}", self.name, len(pending), e)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+                return 0
+            finally:
+                self._flushing = {}
+            metrics.incr(f"{self.name}.flushes")
+            metrics.incr(f"{self.name}.rows", len(pending))
+            metrics.incr(f"{self.name}.flush_ms", int((time.perf_counter() - start) * 1000))
+            if future is not None and not future.done():
+                future.set_result(len(pending))
+            return len(pending)
+
+    @classmethod
+    async def flush_all(cls):
+        """写入所有实例的待写入行（app.on_shutdown）"""
+        for instance in cls.instances:
+            if instance._pending:
+                await instance.flush()
+
+    def _start(self, loop: asyncio.AbstractEventLoop, delay: float):
+        # 空的上下文：后台任务不持有 submit 调用方的工作单元（会话）
+        self._task = loop.create_task(self._run(delay), context=contextvars.Context())
+
+    async def _run(self, delay: float):
+        while True:
+            self._sleeping = True
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._sleeping = False
+            await self.flush()
+            if not self._pending:  # 写入期间又有新的 submit
+                return
+            delay = 0 if len(self._pending) >= self.max_pending else self.delay
+
+    @staticmethod
+    def _on_done(future: asyncio.Future):
+        # 大多数 submit 不等待结果，在这里取出异常，避免 "exception was never retrieved"（flush 中已经记录日志）
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,100 @@
+"""
+流式生成 ZIP：边压缩边输出，不在磁盘或内存中暂存整个压缩包（/api/download_zip 打包下载笔记的所有附件）
+
+使用案例：
+
+    zip_stream = ZipStream()
+    for chunk in zip_stream.add("a.txt", [b"hello"], size=5, compress=True):
+        yield chunk
+    yield zip_stream.close()
+
+Details:
+    1. 输出是不可 seek 的流，zipfile 会改用数据描述符（data descriptor）在内容之后写 CRC 和大小，不需要回填文件头
+    2. 内存占用只有一个输入分块加上 deflate 的内部缓冲区，与文件大小无关
+    3. 已经压缩过的格式（图片、音视频、压缩包等）使用存储模式（ZIP_STORED），只算 CRC，不浪费 CPU 再压缩一遍
+    4. 调用方事先知道文件大小（附件记录的 size），超过 4GB 的文件据此写 ZIP64 扩展字段
+    5. 同步生成器，StreamingResponse 会放到线程池中迭代，不阻塞事件循环
+
+"""
+import io
+import zipfile
+from datetime import datetime
+from typing import Iterable, Iterator
+
+
+class _Sink(io.RawIOBase):
+    """不可 seek 的输出缓冲区，zipfile 写入的数据由 ZipStream 及时取走"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """流式 ZIP 写入器，add/close 返回（产出）应该立即发送给客户端的字节"""
+
+    compress_level = 6
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w", compression=zipfile.ZIP_DEFLATED,
+                                    compresslevel=self.compress_level)
+        self._names: set[str] = set()
+
+    def unique_name(self, name: str) -> str:
+        """压缩包内的文件名：去掉路径（防止解压时路径穿越），重名时加序号，如 a (1).txt"""
+        name = name.replace("\\", "/").split("/")[-1].strip() or "unnamed"
+        if name in (".", ".."):
+            name = "unnamed"
+        stem, dot, suffix = name.rpartition(".")
+        if not stem:
+            stem, dot, suffix = name, "", ""
+        candidate, i = name, 1
+        while candidate.lower() in self._names:
+            candidate = f"{stem} ({i}){dot}{suffix}"
+            i += 1
+        self._names.add(candidate.lower())
+        return candidate
+
+    def add(self, name: str, chunks: Iterable[bytes], size: int, compress: bool = True,
+            date_time: datetime | None = None) -> Iterator[bytes]:
+        """写入一个文件，name 会经过 unique_name 处理"""
+        zinfo = zipfile.ZipInfo(self.unique_name(name), date_time=self._zip_date_time(date_time))
+        zinfo.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        zinfo.file_size = size  # 只用于判断是否需要 ZIP64，实际大小由写入的内容决定
+        with self._zip.open(zinfo, "w") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                if data := self._sink.drain():
+                    yield data
+        if data := self._sink.drain():  # 数据描述符，以及 deflate 最后 flush 的数据
+            yield data
+
+    def add_bytes(self, name: str, content: bytes, compress: bool = True,
+                  date_time: datetime | None = None) -> Iterator[bytes]:
+        return self.add(name, [content], len(content), compress, date_time)
+
+    def close(self) -> bytes:
+        """写入中央目录，返回最后一段数据"""
+        self._zip.close()
+        return self._sink.drain()
+
+    @staticmethod
+    def _zip_date_time(value: datetime | None) -> tuple:
+        # ZIP 的时间没有时区（按本地时间），范围从 1980 年开始
+        value = value or datetime.now()
+        if value.tzinfo is not None:
+            value = value.astimezone().replace(tzinfo=None)
+        return max(value, datetime(1980, 1, 1)).timetuple()[:6]
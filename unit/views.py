@@ -25,7 +25,7 @@ from abc import ABC, abstractmethod, ABCMeta
 from datetime import datetime
 from functools import partial
 from pathlib import Path
-from typing import Type, Self, TypeVar, Dict, Generic, get_args, get_origin, ForwardRef
+from typing import Type, Self, TypeVar, Dict, Generic, get_args, get_origin, ForwardRef, Literal
 
 import numpy as np
 import aiofiles
@@ -38,7 +38,7 @@ from nicegui.events import UploadEventArguments
 from utils import extract_urls, refresh_page, DeepSeekClient, go_main, go_add_note, is_valid_filename, go_get_note
 from utils.tkinter_ui import create_tk_root, import_filedialog, import_messagebox
 from services import AttachmentService, NoteService, UserConfigService
-from models import NoteTypeMaskedEnum, Attachment
+from models import NoteTypeMaskedEnum, Attachment, Note
 from settings import dynamic_settings
 from components import LoadingOverlay, AboutDialog, TextDialog
 from log import logger
@@ -367,6 +367,12 @@ def build_softmenu(icon="mdi-note", size="16px", color="blue-600") -> ui.button:
 
 # endregion
 
+def attachment_url(endpoint: Literal["view_file", "thumbnail"], attachment: Attachment) -> str:
+    """附件的访问链接，带上内容 hash 时浏览器可以长期缓存（见 api.view_file）"""
+    version = f"&v={attachment.content_hash[:16]}" if attachment.content_hash else ""
+    return f"/api/{endpoint}?file_id={attachment.id}{version}"
+
+
 async def see_attachment(note_id: int, detail_page: bool = False):
     performed_deletion = False
 
@@ -436,7 +442,7 @@ async def see_attachment(note_id: int, detail_page: bool = False):
 
                 with ui.row().classes("gap-0"):
                     def see():
-                        ui.navigate.to(f"/api/view_file?file_id={attachment.id}", new_tab=True)
+                        ui.navigate.to(attachment_url("view_file", attachment), new_tab=True)
 
                     # [2025-11-14] 暂且就通过这种方式实现吧
                     eye = ui.button(icon="mdi-eye-outline", on_click=see).props("flat dense")
@@ -469,9 +475,18 @@ async def see_attachment(note_id: int, detail_page: bool = False):
         return card
 
     async def preview_images():
-        with ui.dialog(value=True), ui.card().classes("w-[500px] h-[500px]"):
-            # dialog 好像只能这么大？可恶... 得解决
-            ui.image("docs/images/page_add_note.png").classes("w-[500px] h-[500px]")
+        # 只加载缩略图（/api/thumbnail），点击再打开原图
+        images = [attachment for attachment in attachments if (attachment.mimetype or "").startswith("image/")]
+        if not images:
+            ui.notify("没有图片附件", type="info")
+            return
+        with ui.dialog(value=True), ui.card().classes("w-[640px] max-w-full"):
+            with ui.grid(columns=3).classes("w-full gap-2 max-h-[70vh] overflow-y-auto"):
+                for image_attachment in images:
+                    image = ui.image(attachment_url("thumbnail", image_attachment))
+                    image.classes("w-full h-40 cursor-pointer rounded").props("fit=contain loading=lazy")
+                    image.tooltip(image_attachment.filename)
+                    image.on("click", partial(ui.navigate.to, attachment_url("view_file", image_attachment), new_tab=True))
 
     # ====== ui ====== #
     with ui.dialog() as dialog, ui.card():
@@ -937,7 +952,7 @@ class HeaderView(View["HeaderController"]):
                         )
 
                         async def show_title_view():
-                            async def create_item(note: NoteService.NotePreview):
+                            async def create_item(note: Note):
                                 with ui.item():
                                     with ui.item_section().props("avatar"):
                                         ui.item_label(str(note.id)) \
@@ -945,7 +960,8 @@ class HeaderView(View["HeaderController"]):
                                             .on("click", partial(go_get_note, note.id)) \
                                             .tooltip("跳转至详情页")
                                     with ui.item_section():
-                                        truncated_content = note.content[:200]
+                                        # note.preview 是数据库截取的正文开头，标题视图不加载完整正文
+                                        truncated_content = note.preview
                                         if truncated_content.strip():
                                             truncated_content += "..."
                                         with ui.item_label(note.title).classes("cursor-pointer") \
@@ -3,6 +3,7 @@ import inspect
 import os
 import re
 import asyncio
+import time
 from typing import List, Sequence, Callable, Annotated, Dict, AsyncGenerator, TypedDict, Any
 from datetime import datetime, timedelta, timezone
 from functools import partial
@@ -11,7 +12,7 @@ from dataclasses import dataclass, field
 from openai import OpenAI, AsyncOpenAI
 from loguru import logger
 from result import Result, Ok, Err
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, Row
 from sqlalchemy.ext.asyncio import async_scoped_session, AsyncSession
 from fastapi import Depends
 from nicegui import background_tasks, ui
@@ -126,6 +127,9 @@ class _Cleanup:
 
     """
 
+    batch_size = 500  # 每批删除的临时附件数量
+    expire_seconds = 5 * 60  # 临时附件创建多久之后才清理
+
     def __init__(self, interval_seconds: int = 5 * 60):
         self.interval_seconds = interval_seconds
         self.is_running = False
@@ -169,56 +173,50 @@ class _Cleanup:
                 logger.error(f"清理过程中发生错误: {e}")
                 await asyncio.sleep(60)  # 出错后等待 1 分钟再重试
 
-    async def _get_items_to_delete(self, session) -> Sequence[Attachment]:
-        five_minutes_ago = datetime.now(tz=timezone.utc) - timedelta(minutes=5)
-        stmt = select(Attachment).where(Attachment.note_id.is_(None) & (Attachment.created_at <= five_minutes_ago))
-        result = await session.execute(stmt)
-        items_to_delete = result.scalars().all()
-        if not items_to_delete:
-            logger.debug("没有找到需要清理的临时记录")
-        return items_to_delete
-
-    async def _delete_items(self, session):
-        # 五分钟内被创建的不要删（但是这同样要求前端需要提示呢，否则有点难受）
-        five_minutes_ago = datetime.now(tz=timezone.utc) - timedelta(minutes=5)
-        stmt = delete(Attachment).where(Attachment.note_id.is_(None) & (Attachment.created_at <= five_minutes_ago))
-        await session.execute(stmt)
+    async def _delete_expired_batch(self, session, expired_before: datetime) -> Sequence[Row]:
+        """删除一批过期的临时附件，只返回 id 和文件名（不读取 content）"""
+        batch = (select(Attachment.id)
+                 .where(Attachment.note_id.is_(None), Attachment.created_at <= expired_before)
+                 .limit(self.batch_size)
+                 .scalar_subquery())
+        stmt = (delete(Attachment)
+                .where(Attachment.id.in_(batch))
+                .returning(Attachment.id, Attachment.filename)
+                .execution_options(synchronize_session=False))
+        rows = (await session.execute(stmt)).all()
         await session.commit()
+        return rows
 
-    async def _cleanup_expired_items(self):
-        """清理临时项"""
+    async def _cleanup_expired_items(self) -> int:
+        """分批清理临时项（每批一个事务，批与批之间让出事件循环），返回删除的记录数"""
+        # 五分钟内被创建的不要删（但是这同样要求前端需要提示呢，否则有点难受）
+        expired_before = datetime.now(tz=timezone.utc) - timedelta(seconds=self.expire_seconds)
+        start = time.perf_counter()
+        deleted_num = 0
         try:
             async with AsyncSessionLocal() as session:
-                items_to_delete = await self._get_items_to_delete(session)
-
-                if not items_to_delete:
-                    return
-
-                await self._delete_items(session)
-
-                logger.info(f"成功删除 {len(items_to_delete)} 条临时记录")
-
-                # 记录详细信息（可选）
-                for item in items_to_delete:
-                    logger.debug(f"删除记录: id={item.id}, name={item.filename}, "
-                                 f"note_id={item.note_id}, temporary_uuid={item.temporary_uuid}")
-
+                while True:
+                    rows = await self._delete_expired_batch(session, expired_before)
+                    if not rows:
+                        break
+                    deleted_num += len(rows)
+                    logger.debug("删除临时记录 {} 条: {}", len(rows), ", ".join(f"{row.id}:{row.filename}" for row in rows))
+                    if len(rows) < self.batch_size:
+                        break
+                    await asyncio.sleep(0)
         except Exception as e:
             logger.error(f"清理数据库时发生错误: {e}")
             raise
 
+        if deleted_num:
+            logger.info(f"成功删除 {deleted_num} 条临时记录，耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+        else:
+            logger.debug("没有找到需要清理的临时记录")
+        return deleted_num
+
     async def cleanup_now(self) -> int:
         """立即执行一次清理，返回删除的记录数"""
-        async with AsyncSessionLocal() as session:
-            items_to_delete = await self._get_items_to_delete(session)
-
-            if not items_to_delete:
-                return 0
-
-            await self._delete_items(session)
-
-            return len(items_to_delete)
-
+        return await self._cleanup_expired_items()
 
 cleanup = _Cleanup()
 